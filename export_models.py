@@ -0,0 +1,384 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# The engagement model gets exactly local_server's preprocessing (no import side effects)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_local"))
+from engagement_models import EngagementClassifier, load_interpreter_class, preprocess
+
+# ==========================================
+# MODEL EXPORT + PARITY REPORT
+# ==========================================
+# Produces smaller / faster CPU variants of the three models we ship and scores
+# every variant on the same labelled sample folder.
+#
+#   python export_models.py export   --out exported_models
+#   python export_models.py evaluate --out exported_models --samples samples/
+#
+# Sample folder layout: one sub-folder per label, e.g.
+#   samples/engaged/*.jpg  samples/not_engaged/*.jpg  samples/Bored/*.jpg ...
+# Accuracy only counts images whose folder matches one of the model's labels.
+# "Parity" is top-1 agreement with the family's original model on ALL images,
+# so it works even without matching labels.
+
+YOLO_PATH = "./iskomate/best.pt"
+TFLITE_PATH = "./run_local/engagement_model_quantized.tflite"
+BEIT_NAME = "nihar245/Expression-Detection-BEIT-Large"
+
+YOLO_SIZES = [640, 480, 320]  # Reduced input sizes to try
+ENGAGEMENT_LABELS = ["highly_engaged", "engaged", "barely_engaged", "not_engaged"]
+BEIT_LABELS = ["Bored", "Confused", "Engaged", "Neutral"]
+
+MANIFEST_NAME = "manifest.json"
+
+
+# ==========================================
+# 1. EXPORT
+# ==========================================
+def quantize_onnx(src, dst):
+    """Dynamic (weight-only) int8 quantization, no calibration data needed."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(src, dst, weight_type=QuantType.QUInt8)
+    return dst
+
+def export_yolo(out_dir, calib_data=None):
+    from ultralytics import YOLO
+    variants = []
+    for size in YOLO_SIZES:
+        model = YOLO(YOLO_PATH)
+
+        onnx_path = os.path.join(out_dir, f"yolo_{size}.onnx")
+        shutil.move(model.export(format="onnx", imgsz=size, dynamic=False), onnx_path)
+        variants.append({"family": "yolo", "name": f"onnx_{size}", "path": onnx_path, "imgsz": size})
+
+        onnx_q_path = os.path.join(out_dir, f"yolo_{size}_int8.onnx")
+        variants.append({"family": "yolo", "name": f"onnx_int8_{size}",
+                         "path": quantize_onnx(onnx_path, onnx_q_path), "imgsz": size})
+
+        ov_path = os.path.join(out_dir, f"yolo_{size}_openvino_model")
+        shutil.rmtree(ov_path, ignore_errors=True)
+        shutil.move(model.export(format="openvino", imgsz=size), ov_path)
+        variants.append({"family": "yolo", "name": f"openvino_{size}", "path": ov_path, "imgsz": size})
+
+        # Full int8 TFLite needs representative images for calibration
+        if calib_data:
+            tfl_path = os.path.join(out_dir, f"yolo_{size}_int8.tflite")
+            shutil.move(model.export(format="tflite", imgsz=size, int8=True, data=calib_data), tfl_path)
+            variants.append({"family": "yolo", "name": f"tflite_int8_{size}", "path": tfl_path, "imgsz": size})
+    return variants
+
+def tflite_input_params(path=TFLITE_PATH):
+    """[normalization, [scale, zero point]] of the TFLite model's input, resolved like local_server does."""
+    Interpreter, _ = load_interpreter_class()
+    detail = Interpreter(model_path=path).get_input_details()[0]
+    scale, zero_point = detail['quantization']
+    _, normalization = EngagementClassifier.build_lut(detail['dtype'], (scale, zero_point))
+    return [normalization, [float(scale), int(zero_point)]]
+
+def export_engagement(out_dir):
+    # The Keras source is not in the repo, so the TFLite model can't be re-quantized;
+    # we convert it to ONNX and quantize that instead.
+    import tf2onnx
+    onnx_path = os.path.join(out_dir, "engagement.onnx")
+    tf2onnx.convert.from_tflite(TFLITE_PATH, output_path=onnx_path)
+    onnx_q_path = os.path.join(out_dir, "engagement_int8.onnx")
+    # The ONNX graph has no input quantization params: keep the source model's
+    input_params = tflite_input_params()
+    return [
+        {"family": "engagement", "name": "onnx", "path": onnx_path, "input_params": input_params},
+        {"family": "engagement", "name": "onnx_int8", "path": quantize_onnx(onnx_path, onnx_q_path),
+         "input_params": input_params},
+    ]
+
+def export_beit(out_dir):
+    import torch
+    from transformers import BeitForImageClassification
+    model = BeitForImageClassification.from_pretrained(BEIT_NAME).eval()
+    model.config.return_dict = False
+
+    onnx_path = os.path.join(out_dir, "beit.onnx")
+    dummy = torch.zeros(1, 3, 224, 224)
+    torch.onnx.export(model, (dummy,), onnx_path, input_names=["pixel_values"],
+                      output_names=["logits"], opset_version=17)
+    onnx_q_path = os.path.join(out_dir, "beit_int8.onnx")
+    return [
+        {"family": "beit", "name": "onnx", "path": onnx_path},
+        {"family": "beit", "name": "onnx_int8", "path": quantize_onnx(onnx_path, onnx_q_path)},
+    ]
+
+EXPORTERS = {"yolo": export_yolo, "engagement": export_engagement, "beit": export_beit}
+
+def run_export(args):
+    os.makedirs(args.out, exist_ok=True)
+    variants = []
+    for family in args.family:
+        print(f"--> Exporting {family}...")
+        try:
+            if family == "yolo":
+                variants += export_yolo(args.out, args.calib_data)
+            else:
+                variants += EXPORTERS[family](args.out)
+        except Exception as e:
+            print(f"Export of {family} failed: {e}")
+
+    manifest_path = os.path.join(args.out, MANIFEST_NAME)
+    with open(manifest_path, "w") as f:
+        json.dump(variants, f, indent=2)
+    print(f"Wrote {len(variants)} variants to {manifest_path}")
+
+
+# ==========================================
+# 2. RUNNERS (one predict() per variant type)
+# ==========================================
+class TFLiteRunner:
+    """local_server's own EngagementClassifier: same normalization, (de)quantization and softmax."""
+    labels = ENGAGEMENT_LABELS
+
+    def __init__(self, path, threads):
+        Interpreter, _ = load_interpreter_class()
+        interpreter = Interpreter(model_path=path, num_threads=threads)
+        interpreter.allocate_tensors()
+        self.classifier = EngagementClassifier(interpreter)
+
+    def predict(self, image):
+        return int(np.argmax(self.classifier.classify(image)))
+
+# ONNX input element types the engagement model can be exported with
+ONNX_INPUT_TYPES = {"tensor(float)": np.float32, "tensor(uint8)": np.uint8, "tensor(int8)": np.int8}
+
+class EngagementOnnxRunner:
+    """
+    Same input as local_server gives the TFLite model: its normalization, plus
+    its quantization when the ONNX input kept the integer type (a float input
+    takes the real values the quantized ones stand for).
+    """
+    labels = ENGAGEMENT_LABELS
+
+    def __init__(self, path, threads, input_params=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input = self.session.get_inputs()[0]
+
+        dtype = ONNX_INPUT_TYPES.get(self.input.type)
+        if dtype is None:
+            raise ValueError(f"Unsupported ONNX input type {self.input.type}")
+        normalization, quantization = input_params or tflite_input_params()
+        if dtype == np.float32:
+            quantization = (0.0, 0)
+        self.lut, _ = EngagementClassifier.build_lut(dtype, tuple(quantization), normalization)
+        self.size = (int(self.input.shape[2]), int(self.input.shape[1]))
+
+    def predict(self, image):
+        data = preprocess(image, self.size, self.lut)
+        return int(np.argmax(self.session.run(None, {self.input.name: data})[0][0]))
+
+class BeitTorchRunner:
+    labels = BEIT_LABELS
+
+    def __init__(self, path, threads):
+        import torch
+        from transformers import BeitForImageClassification, AutoImageProcessor
+        torch.set_num_threads(threads)
+        self.torch = torch
+        self.model = BeitForImageClassification.from_pretrained(path).eval()
+        self.processor = AutoImageProcessor.from_pretrained(BEIT_NAME)
+
+    def predict(self, image):
+        inputs = self.processor(images=cv2.cvtColor(image, cv2.COLOR_BGR2RGB), return_tensors="pt")
+        with self.torch.no_grad():
+            return int(self.model(**inputs).logits.argmax(-1).item())
+
+class BeitOnnxRunner:
+    labels = BEIT_LABELS
+
+    def __init__(self, path, threads):
+        import onnxruntime as ort
+        from transformers import AutoImageProcessor
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.processor = AutoImageProcessor.from_pretrained(BEIT_NAME)
+
+    def predict(self, image):
+        inputs = self.processor(images=cv2.cvtColor(image, cv2.COLOR_BGR2RGB), return_tensors="np")
+        return int(np.argmax(self.session.run(None, {"pixel_values": inputs["pixel_values"]})[0][0]))
+
+class YoloRunner:
+    """Ultralytics loads .pt, .onnx, OpenVINO folders and .tflite the same way."""
+    def __init__(self, path, threads, imgsz=640):
+        import torch
+        from ultralytics import YOLO
+        torch.set_num_threads(threads)
+        self.model = YOLO(path, task="detect")
+        self.imgsz = imgsz
+        self.labels = None
+
+    def predict(self, image):
+        result = self.model(image, imgsz=self.imgsz, conf=0.25, verbose=False)[0]
+        if self.labels is None:
+            self.labels = [result.names[i] for i in sorted(result.names)]
+        if len(result.boxes) == 0:
+            return -1
+        # Most confident box decides the image label
+        return int(result.boxes.cls[int(result.boxes.conf.argmax())])
+
+def make_runner(variant, threads):
+    family, path = variant["family"], variant["path"]
+    if family == "yolo":
+        return YoloRunner(path, threads, variant.get("imgsz", 640))
+    if family == "engagement":
+        if path.endswith(".tflite"):
+            return TFLiteRunner(path, threads)
+        return EngagementOnnxRunner(path, threads, variant.get("input_params"))
+    if family == "beit":
+        return BeitOnnxRunner(path, threads) if path.endswith(".onnx") else BeitTorchRunner(path, threads)
+    raise ValueError(f"Unknown family '{family}'")
+
+
+# ==========================================
+# 3. EVALUATION
+# ==========================================
+REFERENCES = [
+    {"family": "yolo", "name": "pytorch (original)", "path": YOLO_PATH, "imgsz": 640, "reference": True},
+    {"family": "engagement", "name": "tflite (original)", "path": TFLITE_PATH, "reference": True},
+    {"family": "beit", "name": "pytorch (original)", "path": BEIT_NAME, "reference": True},
+]
+
+def load_samples(folder):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(folder, "*", "*"))):
+        image = cv2.imread(path)
+        if image is not None:
+            samples.append((os.path.basename(os.path.dirname(path)).lower(), image))
+    return samples
+
+def model_size_mb(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(f) for f in glob.glob(os.path.join(path, "**"), recursive=True)
+                   if os.path.isfile(f)) / 1e6
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1e6
+    return None  # Hub model, size unknown locally
+
+def evaluate_variant(variant, samples, threads, warmup=3):
+    start = time.time()
+    runner = make_runner(variant, threads)
+    load_s = time.time() - start
+
+    for _, image in samples[:warmup]:
+        runner.predict(image)
+
+    predictions, timings = [], []
+    for _, image in samples:
+        t0 = time.perf_counter()
+        predictions.append(runner.predict(image))
+        timings.append((time.perf_counter() - t0) * 1000)
+
+    labels = [l.lower() for l in (runner.labels or [])]
+    scored = [(labels.index(truth), pred) for (truth, _), pred in zip(samples, predictions) if truth in labels]
+    accuracy = sum(t == p for t, p in scored) / len(scored) if scored else None
+
+    return {
+        "load_s": load_s,
+        "mean_ms": float(np.mean(timings)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "accuracy": accuracy,
+        "labelled": len(scored),
+        "predictions": predictions,
+    }
+
+def run_evaluate(args):
+    samples = load_samples(args.samples)
+    if not samples:
+        print(f"Error: no images found under '{args.samples}/<label>/'.")
+        return
+    print(f"Loaded {len(samples)} sample images")
+
+    variants = [v for v in REFERENCES if v["family"] in args.family]
+    manifest_path = os.path.join(args.out, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            variants += [v for v in json.load(f) if v["family"] in args.family]
+
+    rows = []
+    reference_predictions = {}
+    for variant in variants:
+        print(f"--> Evaluating {variant['family']} / {variant['name']}...")
+        row = {"family": variant["family"], "variant": variant["name"],
+               "size_mb": model_size_mb(variant["path"])}
+        try:
+            result = evaluate_variant(variant, samples, args.threads)
+        except Exception as e:
+            print(f"    failed: {e}")
+            rows.append({**row, "error": str(e)})
+            continue
+
+        predictions = result.pop("predictions")
+        if variant.get("reference"):
+            reference_predictions[variant["family"]] = predictions
+        ref = reference_predictions.get(variant["family"])
+        result["parity"] = (float(np.mean([a == b for a, b in zip(ref, predictions)]))
+                            if ref is not None else None)
+        rows.append({**row, **result})
+
+    write_report(rows, args.report)
+
+def fmt(value, spec):
+    return "n/a" if value is None else format(value, spec)
+
+def write_report(rows, report_path):
+    header = "| Family | Variant | Size (MB) | Load (s) | Mean (ms) | p95 (ms) | Accuracy | Parity |"
+    lines = [header, "|" + "---|" * 8]
+    for r in rows:
+        if "error" in r:
+            lines.append(f"| {r['family']} | {r['variant']} | {fmt(r['size_mb'], '.1f')} | failed: {r['error']} | | | | |")
+            continue
+        accuracy = "n/a" if r["accuracy"] is None else f"{r['accuracy']:.1%} ({r['labelled']})"
+        lines.append(f"| {r['family']} | {r['variant']} | {fmt(r['size_mb'], '.1f')} | {r['load_s']:.2f} | "
+                     f"{r['mean_ms']:.1f} | {r['p95_ms']:.1f} | {accuracy} | {fmt(r['parity'], '.1%')} |")
+    table = "\n".join(lines)
+    print("\n" + table)
+
+    with open(report_path, "w") as f:
+        f.write(table + "\n")
+    csv_path = os.path.splitext(report_path)[0] + ".csv"
+    fields = ["family", "variant", "size_mb", "load_s", "mean_ms", "p95_ms", "accuracy", "labelled", "parity", "error"]
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\nReport written to {report_path} and {csv_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export CPU-optimized model variants and compare them")
+    sub = parser.add_subparsers(dest="command", required=True)
+    families = ["yolo", "engagement", "beit"]
+
+    p_export = sub.add_parser("export", help="Write ONNX / int8 / OpenVINO / reduced-size variants")
+    p_export.add_argument("--out", default="exported_models")
+    p_export.add_argument("--family", nargs="+", default=families, choices=families)
+    p_export.add_argument("--calib-data", help="Ultralytics dataset YAML for int8 TFLite YOLO calibration")
+
+    p_eval = sub.add_parser("evaluate", help="Score originals + exported variants on a labelled folder")
+    p_eval.add_argument("--out", default="exported_models")
+    p_eval.add_argument("--samples", required=True, help="Folder with one sub-folder per label")
+    p_eval.add_argument("--family", nargs="+", default=families, choices=families)
+    p_eval.add_argument("--threads", type=int, default=os.cpu_count())
+    p_eval.add_argument("--report", default="model_report.md")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        run_export(args)
+    else:
+        run_evaluate(args)
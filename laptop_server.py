@@ -1,18 +1,141 @@
+import argparse
+import glob
+import os
+import shutil
 from flask import Flask, request
 from flask_socketio import SocketIO, emit
 import cv2
 import base64
 import numpy as np
-from ultralytics import YOLO
 import threading
 import time
 
+# --- Model Configuration (can be overridden on the command line) ---
+MODEL_PATH = os.environ.get("ISKOMATE_YOLO_MODEL", "best.pt")
+MODEL_BACKEND = "auto"    # auto / pytorch / onnx / openvino
+MODEL_IMGSZ = 640
+MODEL_THREADS = os.cpu_count() # Inference threads, on every backend
+WARMUP_RUNS = 3
+BENCHMARK_RUNS = 10       # Frames timed per backend when picking automatically
+LATENCY_LOG_EVERY = 100   # Log steady-state latency every N frames
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'laptop-server-key'
 socketio_server = SocketIO(app, cors_allowed_origins="*")
 
-# Load YOLO model (use your trained engagement detection model)
-model = YOLO("C:\Users\John Gwen Isaac\Downloads\best.pt")
+class YoloDetector:
+    """
+    Loads the YOLO model on the chosen CPU backend.
+    ONNX / OpenVINO copies are exported next to the .pt file on first use,
+    one per input size (exports have a fixed input shape).
+    With backend="auto" every available backend is warmed up and timed,
+    and the fastest one is kept.
+    """
+    BACKENDS = ["pytorch", "onnx", "openvino"]
+
+    def __init__(self, model_path, backend="auto", imgsz=640, threads=None):
+        self.model_path = model_path
+        self.imgsz = imgsz
+        self.threads = threads or os.cpu_count()
+        self.avg_latency_ms = None
+        self.frames = 0
+
+        # Thread count must be set before torch spins up its pool
+        os.environ.setdefault("OMP_NUM_THREADS", str(self.threads))
+        import torch
+        torch.set_num_threads(self.threads)
+
+        if backend == "auto":
+            self.backend, self.model = self._pick_fastest()
+        else:
+            self.backend, self.model = backend, self._load(backend)
+            self._warm_up(self.model)
+        self.names = self.model.names
+        print(f"✅ YOLO ready: backend={self.backend} imgsz={self.imgsz} threads={self.threads}")
+
+    def _load(self, backend):
+        from ultralytics import YOLO
+        stem = os.path.splitext(self.model_path)[0]
+        if backend == "pytorch":
+            return YOLO(self.model_path)
+
+        # imgsz in the name: an export made at another size would not fit this one
+        exported = {"onnx": f"{stem}_{self.imgsz}.onnx",
+                    "openvino": f"{stem}_{self.imgsz}_openvino_model"}[backend]
+        if not os.path.exists(exported):
+            print(f"Exporting {self.model_path} to {backend} (imgsz={self.imgsz})...")
+            path = YOLO(self.model_path).export(format=backend, imgsz=self.imgsz)
+            shutil.move(str(path), exported)
+        model = YOLO(exported, task="detect")
+        self._set_runtime_threads(model, backend, exported)
+        return model
+
+    def _set_runtime_threads(self, model, backend, exported):
+        """
+        Ultralytics opens ONNX Runtime / OpenVINO with their own default thread
+        counts: rebuild its session / compiled model with self.threads.
+        """
+        model(self._dummy_frame(), imgsz=self.imgsz, verbose=False)  # Creates the predictor + runtime
+        runtime = model.predictor.model
+        if backend == "onnx" and hasattr(runtime, "session"):
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            runtime.session = ort.InferenceSession(exported, options, providers=["CPUExecutionProvider"])
+        elif backend == "openvino" and hasattr(runtime, "ov_compiled_model"):
+            import openvino as ov
+            core = ov.Core()
+            xml = glob.glob(os.path.join(exported, "*.xml"))[0]
+            runtime.ov_compiled_model = core.compile_model(
+                core.read_model(xml), "CPU",
+                {"INFERENCE_NUM_THREADS": self.threads, "PERFORMANCE_HINT": "LATENCY"})
+        else:
+            print(f"⚠️ Could not set the {backend} thread count on this Ultralytics version")
+
+    def _dummy_frame(self):
+        return np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+
+    def _warm_up(self, model):
+        for _ in range(WARMUP_RUNS):
+            model(self._dummy_frame(), imgsz=self.imgsz, verbose=False)
+
+    def _benchmark(self, model):
+        frame = self._dummy_frame()
+        start = time.perf_counter()
+        for _ in range(BENCHMARK_RUNS):
+            model(frame, imgsz=self.imgsz, verbose=False)
+        return (time.perf_counter() - start) * 1000 / BENCHMARK_RUNS
+
+    def _pick_fastest(self):
+        best = None
+        for backend in self.BACKENDS:
+            try:
+                model = self._load(backend)
+                self._warm_up(model)
+                ms = self._benchmark(model)
+            except Exception as e:
+                print(f"   {backend:<9} unavailable ({e})")
+                continue
+            print(f"   {backend:<9} {ms:7.1f} ms/frame")
+            if best is None or ms < best[2]:
+                best = (backend, model, ms)
+        if best is None:
+            raise RuntimeError("No YOLO backend could be loaded")
+        return best[0], best[1]
+
+    def __call__(self, frame, conf=0.5):
+        start = time.perf_counter()
+        results = self.model(frame, conf=conf, imgsz=self.imgsz, verbose=False)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        self.frames += 1
+        self.avg_latency_ms = elapsed_ms if self.avg_latency_ms is None else 0.9 * self.avg_latency_ms + 0.1 * elapsed_ms
+        if self.frames % LATENCY_LOG_EVERY == 0:
+            print(f"⏱️ [{self.backend}] steady-state {self.avg_latency_ms:.1f} ms/frame ({self.frames} frames)")
+        return results
+
+# Loaded in __main__ (see the command line options)
+model = None
 
 # Store connected Raspberry Pis
 connected_raspis = {}
@@ -27,6 +150,15 @@ def handle_register(data):
     }
     print(f"✅ Raspberry Pi registered: {session_id}")
 
+@socketio_server.on('unregister_raspi')
+def handle_unregister(data):
+    """One session on a shared Pi connection ended; the connection stays open"""
+    session_id = data.get('session_id')
+    info = connected_raspis.get(session_id)
+    if info is not None and info['sid'] == request.sid:
+        del connected_raspis[session_id]
+        print(f"➖ Session ended: {session_id}")
+
 @socketio_server.on('video_frame')
 def handle_video_frame(data):
     """Process video frame from Raspberry Pi"""
@@ -104,4 +236,14 @@ def handle_disconnect():
             print(f"❌ Raspberry Pi disconnected: {session_id}")
 
 if __name__ == '__main__':
-    socketio_server.run(app, host='0.0.0.0', port=6001, debug=True, allow_unsafe_werkzeug=True)
+    parser = argparse.ArgumentParser(description="Iskomate laptop YOLO server")
+    parser.add_argument("--model", default=MODEL_PATH, help="Path to the trained best.pt")
+    parser.add_argument("--backend", default=MODEL_BACKEND, choices=["auto"] + YoloDetector.BACKENDS)
+    parser.add_argument("--imgsz", type=int, default=MODEL_IMGSZ)
+    parser.add_argument("--threads", type=int, default=MODEL_THREADS,
+                        help="CPU inference threads (PyTorch, ONNX Runtime and OpenVINO)")
+    args = parser.parse_args()
+
+    model = YoloDetector(args.model, backend=args.backend, imgsz=args.imgsz, threads=args.threads)
+    # use_reloader=False: the debug reloader would load (and benchmark) the model twice
+    socketio_server.run(app, host='0.0.0.0', port=6001, debug=True, use_reloader=False, allow_unsafe_werkzeug=True)
@@ -1,9 +1,11 @@
 from flask import Flask, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import cv2
 import base64
 import threading
 import json
+import time
+from collections import deque
 from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
 from aiortc.contrib.media import MediaRelay
 import asyncio
@@ -14,25 +16,179 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
 socketio_server = SocketIO(app, cors_allowed_origins="*")
 
+LAPTOP_SERVER_URL = 'http://100.105.15.120:6001'
+
+# Per-session flow control
+MAX_IN_FLIGHT = 2          # Frames sent to the laptop without a result yet; newer frames are skipped beyond this
+ACK_TIMEOUT = 5            # Seconds before unanswered frames are written off (laptop restart, lost result)
+DEFAULT_SESSION_FPS = 15
+SESSION_IDLE_TIMEOUT = 300 # Seconds an unused session (not processing, no clients) is kept
+
+# Results fan-out to the Flutter viewers
+RESULTS_MAX_RATE = 4       # Emits per second per session, at most
+PERCENT_THRESHOLD = 2.0    # Percentage points a value must move before it is re-sent
+SNAPSHOT_INTERVAL = 5      # Seconds between full 'results' snapshots (deltas in between)
+ALERT_WINDOW = 10          # Seconds of results an alert decision looks at
+ALERT_MIN_RATIO = 0.6      # Share of results in the window that must show disengagement
+ALERT_MIN_RESULTS = 5      # ...and at least this many results
+ALERT_COOLDOWN = 30        # Seconds between alerts for one session
+
 # Store active sessions
 sessions = {}
+sessions_lock = threading.Lock()
 relay = MediaRelay()
 
-# Socket.IO client to connect to laptop server
-laptop_client = socketio.Client()
-LAPTOP_SERVER_URL = 'http://100.105.15.120:6001'
+def new_session():
+    return {
+        'active': False,
+        'peer_connection': None,
+        'loop': None,
+        'processing': False,
+        'thread': None,
+        'fps': DEFAULT_SESSION_FPS,
+        'clients': set(),          # Socket.IO sids watching this session
+        'last_used': time.time(),
+        # Flow control: send times of frames the laptop has not answered yet
+        'in_flight': deque(),
+        'stats': {
+            'frames_sent': 0,
+            'frames_skipped': 0,   # Not sent because MAX_IN_FLIGHT was reached
+            'frames_lost': 0,      # Sent but never answered within ACK_TIMEOUT
+            'results': 0,
+            'bytes_sent': 0,
+            'avg_rtt_ms': None,
+            'started_at': None,
+        },
+    }
 
 class CameraVideoStreamTrack(VideoStreamTrack):
     def __init__(self):
         super().__init__()
         self.cap = cv2.VideoCapture(0)  # Use Raspberry Pi camera
-        
+
     async def recv(self):
         pts, time_base = await self.next_timestamp()
         ret, frame = self.cap.read()
         if ret:
             return av.VideoFrame.from_ndarray(frame, format="bgr24")
 
+class SharedCamera:
+    """
+    ONE capture thread for every processing session.
+    Each frame is JPEG + base64 encoded once, however many sessions send it.
+    Runs only while at least one session uses it.
+    """
+    def __init__(self, index=0):
+        self.index = index
+        self.lock = threading.Lock()
+        self.users = 0
+        self.running = False
+        self.seq = 0
+        self.frame_base64 = None
+
+    def acquire(self):
+        with self.lock:
+            self.users += 1
+            if not self.running:
+                self.running = True
+                threading.Thread(target=self._capture_loop, daemon=True).start()
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+
+    def _capture_loop(self):
+        cap = cv2.VideoCapture(self.index)
+        while True:
+            with self.lock:
+                if self.users == 0:
+                    self.running = False
+                    self.frame_base64 = None
+                    break
+            ret, frame = cap.read()
+            if not ret:
+                time.sleep(0.1)
+                continue
+            _, buffer = cv2.imencode('.jpg', frame)
+            encoded = base64.b64encode(buffer).decode('utf-8')
+            with self.lock:
+                self.frame_base64 = encoded
+                self.seq += 1
+        cap.release()
+
+    def latest(self):
+        """(sequence number, base64 JPEG or None)"""
+        with self.lock:
+            return self.seq, self.frame_base64
+
+shared_camera = SharedCamera(0)
+
+class LaptopLink:
+    """
+    ONE persistent Socket.IO connection to the laptop, shared by all sessions.
+    Reconnects on its own and re-registers every processing session after
+    each (re)connect; frames carry their session_id so one link serves all.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.client = socketio.Client(reconnection=True, reconnection_delay=1, reconnection_delay_max=10)
+        self.lock = threading.Lock()
+        self.registered = set()
+        self.connects = 0
+
+        self.client.on('connect', self._on_connect)
+        self.client.on('disconnect', self._on_disconnect)
+        threading.Thread(target=self._connect_loop, daemon=True).start()
+
+    def _connect_loop(self):
+        # socketio.Client only auto-reconnects after a first successful connect
+        delay = 1
+        while not self.client.connected:
+            try:
+                self.client.connect(self.url, wait_timeout=5)
+            except Exception as e:
+                print(f"Laptop connection failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    def _on_connect(self):
+        self.connects += 1
+        with self.lock:
+            session_ids = list(self.registered)
+        for session_id in session_ids:
+            self.client.emit('register_raspi', {'session_id': session_id})
+        print(f"Laptop connected ({len(session_ids)} session(s) registered)")
+
+    def _on_disconnect(self):
+        print("Laptop connection lost, reconnecting...")
+
+    @property
+    def connected(self):
+        return self.client.connected
+
+    def add_session(self, session_id):
+        with self.lock:
+            self.registered.add(session_id)
+        if self.connected:
+            self.client.emit('register_raspi', {'session_id': session_id})
+
+    def remove_session(self, session_id):
+        with self.lock:
+            self.registered.discard(session_id)
+        if self.connected:
+            self.client.emit('unregister_raspi', {'session_id': session_id})
+
+    def send_frame(self, session_id, frame_base64):
+        if not self.connected:
+            return False
+        try:
+            self.client.emit('video_frame', {'session_id': session_id, 'frame': frame_base64})
+            return True
+        except Exception:
+            return False
+
+laptop_link = LaptopLink(LAPTOP_SERVER_URL)
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({"status": "online", "device": "raspberry_pi"})
@@ -41,107 +197,268 @@ def health():
 def create_session():
     """Create new session with unique ID"""
     session_id = request.json.get('session_id')
-    sessions[session_id] = {
-        'active': False,
-        'peer_connection': None,
-        'processing': False
-    }
+    with sessions_lock:
+        sessions.setdefault(session_id, new_session())
     return jsonify({"success": True, "session_id": session_id})
 
+@app.route('/sessions', methods=['GET'])
+def list_sessions():
+    """Per-session throughput stats and the shared laptop link state"""
+    now = time.time()
+    with sessions_lock:
+        data = {}
+        for session_id, session in sessions.items():
+            stats = dict(session['stats'])
+            elapsed = now - stats['started_at'] if stats['started_at'] else 0
+            stats['fps'] = round(stats['results'] / elapsed, 2) if elapsed else 0.0
+            stats['kbps'] = round(stats['bytes_sent'] * 8 / 1000 / elapsed, 1) if elapsed else 0.0
+            stats['in_flight'] = len(session['in_flight'])
+            data[session_id] = {'processing': session['processing'], 'clients': len(session['clients']),
+                                'fps_limit': session['fps'], 'stats': stats,
+                                'results': results_publisher.stats(session_id)}
+    return jsonify({"laptop_connected": laptop_link.connected, "laptop_connects": laptop_link.connects,
+                    "sessions": data})
+
 @socketio_server.on('offer')
 def handle_offer(data):
     """Handle WebRTC offer from Flutter app"""
     session_id = data.get('session_id')
     offer_sdp = data.get('sdp')
-    
+    with sessions_lock:
+        session = sessions.setdefault(session_id, new_session())
+        session['clients'].add(request.sid)
+        session['last_used'] = time.time()
+    join_room(session_id)
+
     async def create_answer():
         pc = RTCPeerConnection()
-        sessions[session_id]['peer_connection'] = pc
-        
+        session['peer_connection'] = pc
+
         # Add camera track
         camera_track = CameraVideoStreamTrack()
         pc.addTrack(camera_track)
-        
+
         # Set remote description
         await pc.setRemoteDescription(RTCSessionDescription(
             sdp=offer_sdp['sdp'],
             type=offer_sdp['type']
         ))
-        
+
         # Create answer
         answer = await pc.createAnswer()
         await pc.setLocalDescription(answer)
-        
+
         return {
             'sdp': pc.localDescription.sdp,
             'type': pc.localDescription.type
         }
-    
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    session['loop'] = loop
     answer = loop.run_until_complete(create_answer())
-    
+
     emit('answer', {'session_id': session_id, 'sdp': answer})
 
 @socketio_server.on('start_processing')
 def handle_start_processing(data):
     """Start sending video to laptop for processing"""
     session_id = data.get('session_id')
-    
-    if session_id in sessions:
-        sessions[session_id]['processing'] = True
-        
-        # Connect to laptop server
-        try:
-            laptop_client.connect(LAPTOP_SERVER_URL)
-            laptop_client.emit('register_raspi', {'session_id': session_id})
-            
-            # Start video forwarding thread
-            thread = threading.Thread(
-                target=forward_video_to_laptop,
-                args=(session_id,)
-            )
-            thread.start()
-            
-            emit('processing_started', {'session_id': session_id})
-        except Exception as e:
-            emit('error', {'message': str(e)})
+
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            emit('error', {'message': f"Unknown session: {session_id}"})
+            return
+        session['clients'].add(request.sid)
+        session['last_used'] = time.time()
+        session['fps'] = float(data.get('fps', session['fps']))
+        already_running = session['processing']
+        session['processing'] = True
+    join_room(session_id)
+
+    if not already_running:
+        # The shared laptop link stays up; this only adds the session to it
+        laptop_link.add_session(session_id)
+        session['stats']['started_at'] = session['stats']['started_at'] or time.time()
+        session['thread'] = threading.Thread(target=forward_video_to_laptop, args=(session_id,), daemon=True)
+        session['thread'].start()
+
+    emit('processing_started', {'session_id': session_id})
+
+def take_credit(session, now):
+    """Flow control: True if this session may send another frame right now."""
+    in_flight = session['in_flight']
+    # Write off frames the laptop will never answer
+    while in_flight and now - in_flight[0] > ACK_TIMEOUT:
+        in_flight.popleft()
+        session['stats']['frames_lost'] += 1
+    return len(in_flight) < MAX_IN_FLIGHT
 
 def forward_video_to_laptop(session_id):
     """Forward video frames to laptop for processing"""
-    cap = cv2.VideoCapture(0)
-    
-    while sessions[session_id]['processing']:
-        ret, frame = cap.read()
-        if ret:
-            # Encode frame to base64
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame_base64 = base64.b64encode(buffer).decode('utf-8')
-            
-            # Send to laptop server
-            laptop_client.emit('video_frame', {
-                'session_id': session_id,
-                'frame': frame_base64
-            })
-        
-        # Control frame rate (e.g., 15 fps)
-        cv2.waitKey(66)
-    
-    cap.release()
-
-@laptop_client.on('processed_frame')
+    session = sessions[session_id]
+    stats = session['stats']
+    shared_camera.acquire()
+    last_seq = -1
+
+    try:
+        while session['processing']:
+            start = time.time()
+            seq, frame_base64 = shared_camera.latest()
+
+            if frame_base64 is not None and seq != last_seq:
+                last_seq = seq
+                with sessions_lock:
+                    allowed = take_credit(session, start)
+                    if allowed:
+                        session['in_flight'].append(start)
+                if not allowed:
+                    # Laptop is behind: skip instead of queueing stale frames
+                    stats['frames_skipped'] += 1
+                elif laptop_link.send_frame(session_id, frame_base64):
+                    stats['frames_sent'] += 1
+                    stats['bytes_sent'] += len(frame_base64)
+                else:
+                    with sessions_lock:
+                        if session['in_flight']:
+                            session['in_flight'].pop()
+
+            # Control frame rate (per session)
+            time.sleep(max(0.0, 1.0 / session['fps'] - (time.time() - start)))
+    finally:
+        shared_camera.release()
+
+def on_result_received(session_id):
+    """A result came back: free one flow-control credit and record the round trip."""
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            return
+        stats = session['stats']
+        stats['results'] += 1
+        if session['in_flight']:
+            rtt_ms = (time.time() - session['in_flight'].popleft()) * 1000
+            stats['avg_rtt_ms'] = rtt_ms if stats['avg_rtt_ms'] is None else 0.8 * stats['avg_rtt_ms'] + 0.2 * rtt_ms
+
+class ResultsPublisher:
+    """
+    Per-session results state, published at most RESULTS_MAX_RATE times per second.
+      'results'        full snapshot (every SNAPSHOT_INTERVAL, and for new viewers)
+      'results_delta'  only the fields that moved past their threshold
+    One emit per session room reaches every phone watching it. Alerts fire
+    only when disengagement persists over ALERT_WINDOW, with a cooldown.
+    """
+    FIELDS = ('engaged_percent', 'disengaged_percent', 'engaged_count', 'disengaged_count')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = {}  # session_id -> dict (see _state)
+        threading.Thread(target=self._publish_loop, daemon=True).start()
+
+    @staticmethod
+    def _state():
+        return {'latest': None, 'sent': None, 'seq': 0, 'last_snapshot': 0,
+                'window': deque(), 'last_alert': 0,
+                'received': 0, 'snapshots': 0, 'deltas': 0, 'alerts': 0}
+
+    def update(self, session_id, values):
+        """Called for every processed frame; only stores, never emits."""
+        now = time.time()
+        fire_alert = False
+        with self.lock:
+            state = self.state.setdefault(session_id, self._state())
+            state['latest'] = values
+            state['received'] += 1
+
+            window = state['window']
+            window.append((now, values['disengaged_count'] > 0))
+            while window and now - window[0][0] > ALERT_WINDOW:
+                window.popleft()
+            disengaged = sum(1 for _, flag in window if flag)
+            if (len(window) >= ALERT_MIN_RESULTS and disengaged / len(window) >= ALERT_MIN_RATIO
+                    and now - state['last_alert'] >= ALERT_COOLDOWN):
+                state['last_alert'] = now
+                state['alerts'] += 1
+                fire_alert = True
+
+        if fire_alert:
+            trigger_disengagement_alert(values['disengaged_count'])
+
+    def _changed_fields(self, latest, sent):
+        changed = {}
+        for field in self.FIELDS:
+            threshold = PERCENT_THRESHOLD if field.endswith('_percent') else 0
+            if abs(latest[field] - sent[field]) > threshold:
+                changed[field] = latest[field]
+        return changed
+
+    def _publish_loop(self):
+        interval = 1.0 / RESULTS_MAX_RATE
+        while True:
+            time.sleep(interval)
+            now = time.time()
+            emits = []
+            with self.lock:
+                for session_id, state in self.state.items():
+                    latest = state['latest']
+                    if latest is None:
+                        continue
+                    if state['sent'] is None or now - state['last_snapshot'] >= SNAPSHOT_INTERVAL:
+                        event, payload = 'results', dict(latest)
+                        state['last_snapshot'] = now
+                        state['snapshots'] += 1
+                        state['sent'] = dict(latest)
+                    else:
+                        payload = self._changed_fields(latest, state['sent'])
+                        if not payload:
+                            continue
+                        event = 'results_delta'
+                        state['deltas'] += 1
+                        state['sent'].update(payload)
+                    state['seq'] += 1
+                    payload.update(session_id=session_id, seq=state['seq'])
+                    emits.append((event, payload, session_id))
+
+            # Emit outside the lock; Socket.IO fans out to every viewer in the room
+            for event, payload, room in emits:
+                socketio_server.emit(event, payload, room=room)
+
+    def snapshot(self, session_id):
+        """Full current state for a viewer that just joined, or None."""
+        with self.lock:
+            state = self.state.get(session_id)
+            if state is None or state['latest'] is None:
+                return None
+            return dict(state['latest'], session_id=session_id, seq=state['seq'])
+
+    def stats(self, session_id):
+        with self.lock:
+            state = self.state.get(session_id)
+            if state is None:
+                return None
+            return {key: state[key] for key in ('received', 'snapshots', 'deltas', 'alerts')}
+
+    def drop(self, session_id):
+        with self.lock:
+            self.state.pop(session_id, None)
+
+results_publisher = ResultsPublisher()
+
+@laptop_link.client.on('processed_frame')
 def handle_processed_frame(data):
     """Receive processed frame from laptop and send to Flutter"""
     session_id = data.get('session_id')
     socketio_server.emit('processed_video', data, room=session_id)
 
-@laptop_client.on('detection_results')
+@laptop_link.client.on('detection_results')
 def handle_detection_results(data):
     """Receive detection results from laptop"""
     session_id = data.get('session_id')
+    on_result_received(session_id)
     engaged_count = data.get('engaged_count', 0)
     disengaged_count = data.get('disengaged_count', 0)
-    
+
     # Calculate percentages
     total = engaged_count + disengaged_count
     if total > 0:
@@ -150,19 +467,14 @@ def handle_detection_results(data):
     else:
         engaged_percent = 0
         disengaged_percent = 0
-    
-    # Send to Flutter app
-    socketio_server.emit('results', {
-        'session_id': session_id,
+
+    # Rate-limited, delta-encoded send to the Flutter app (and debounced alert)
+    results_publisher.update(session_id, {
         'engaged_percent': engaged_percent,
         'disengaged_percent': disengaged_percent,
         'engaged_count': engaged_count,
         'disengaged_count': disengaged_count
-    }, room=session_id)
-    
-    # Trigger alert if disengaged detected
-    if disengaged_count > 0:
-        trigger_disengagement_alert(disengaged_count)
+    })
 
 def trigger_disengagement_alert(count):
     """Trigger alert on Raspberry Pi (buzzer, LED, etc.)"""
@@ -170,14 +482,96 @@ def trigger_disengagement_alert(count):
     # GPIO.output(BUZZER_PIN, GPIO.HIGH)
     print(f"⚠️ ALERT: {count} disengaged students detected!")
 
+def stop_session_processing(session_id):
+    """Stops forwarding for one session; the laptop link and other sessions are untouched."""
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None or not session['processing']:
+            return
+        session['processing'] = False
+        session['in_flight'].clear()
+    laptop_link.remove_session(session_id)
+    if session['thread'] is not None:
+        session['thread'].join(timeout=2)
+        session['thread'] = None
+
+def end_session(session_id):
+    """Full cleanup: stop processing, close WebRTC, forget the session."""
+    stop_session_processing(session_id)
+    with sessions_lock:
+        session = sessions.pop(session_id, None)
+    results_publisher.drop(session_id)
+    if session is None:
+        return
+    pc, loop = session['peer_connection'], session['loop']
+    if pc is not None and loop is not None:
+        try:
+            loop.run_until_complete(pc.close())
+            loop.close()
+        except Exception as e:
+            print(f"Peer connection cleanup failed for {session_id}: {e}")
+    print(f"Session ended: {session_id}")
+
 @socketio_server.on('stop_processing')
 def handle_stop_processing(data):
     """Stop processing"""
     session_id = data.get('session_id')
     if session_id in sessions:
-        sessions[session_id]['processing'] = False
-        laptop_client.disconnect()
+        stop_session_processing(session_id)
         emit('processing_stopped', {'session_id': session_id})
 
+@socketio_server.on('watch_session')
+def handle_watch_session(data):
+    """Another phone wants this session's results (no WebRTC needed)"""
+    session_id = data.get('session_id')
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None:
+            emit('error', {'message': f"Unknown session: {session_id}"})
+            return
+        session['clients'].add(request.sid)
+        session['last_used'] = time.time()
+    join_room(session_id)
+    # Deltas only make sense on top of a snapshot
+    snapshot = results_publisher.snapshot(session_id)
+    if snapshot is not None:
+        emit('results', snapshot)
+
+@socketio_server.on('end_session')
+def handle_end_session(data):
+    session_id = data.get('session_id')
+    leave_room(session_id)
+    end_session(session_id)
+    emit('session_ended', {'session_id': session_id})
+
+@socketio_server.on('disconnect')
+def handle_client_disconnect():
+    """A phone went away: sessions nobody is watching anymore are ended."""
+    with sessions_lock:
+        orphaned = []
+        for session_id, session in sessions.items():
+            if request.sid in session['clients']:
+                session['clients'].discard(request.sid)
+                session['last_used'] = time.time()
+                if not session['clients']:
+                    orphaned.append(session_id)
+    for session_id in orphaned:
+        end_session(session_id)
+
+def session_janitor():
+    """Removes sessions created over HTTP but never used (or long idle)."""
+    while True:
+        time.sleep(60)
+        now = time.time()
+        with sessions_lock:
+            idle = [session_id for session_id, session in sessions.items()
+                    if not session['processing'] and not session['clients']
+                    and now - session['last_used'] > SESSION_IDLE_TIMEOUT]
+        for session_id in idle:
+            end_session(session_id)
+
+threading.Thread(target=session_janitor, daemon=True).start()
+
 if __name__ == '__main__':
-    socketio_server.run(app, host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # use_reloader=False: the debug reloader would open a second laptop link
+    socketio_server.run(app, host='0.0.0.0', port=5000, debug=True, use_reloader=False)
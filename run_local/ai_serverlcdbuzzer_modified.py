@@ -1,19 +1,38 @@
 import asyncio
+import argparse
 import json
 import logging
 import websockets
 import time
 import threading
+import heapq
+import queue
 import cv2
 import requests
 import numpy as np
 import os
-import RPi.GPIO as GPIO
+import mmap
+import stat
 from av import VideoFrame
 from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack, RTCConfiguration
+from aiortc.contrib.media import MediaRelay
 from aiortc.sdp import candidate_from_sdp
-import firebase_admin
-from firebase_admin import credentials, db
+from pi_backends import GpioRecorder, MemoryDatabase, open_camera, save_framebuffer_png
+from latency_trace import TraceLog, trace_key
+from segment_store import SegmentRecorder
+from engagement_models import EngagementClassifier, load_interpreter_class
+from workload_governor import WorkloadGovernor, SystemSensors, TEMP_PATH, THROTTLED_PATH, LOADAVG_PATH, STAT_PATH
+
+# Pi-only packages: missing on a workstation, where --simulate replaces them
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
+try:
+    import firebase_admin
+    from firebase_admin import credentials, db
+except ImportError:
+    firebase_admin = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,31 +46,114 @@ SIGNALING_URL = "ws://100.74.50.99:8765"
 # This is used if the Laptop is not running or WiFi is disconnected.
 CLOUD_API_URL = "https://is-ko123-engagement-api.hf.space/process_frame"
 
+# Local fallback server (local_server.py running on the Pi itself). Set to None to disable.
+LOCAL_FALLBACK_URL = "http://127.0.0.1:5000/process_frame"
+
+# Endpoint health checks
+PROBE_INTERVAL = 3            # Seconds between background latency probes
+PROBE_TIMEOUT = 1.0
+BREAKER_FAILURE_THRESHOLD = 3 # Consecutive failures before an endpoint is skipped
+BREAKER_COOLDOWN = 15         # Seconds before a tripped endpoint is tried again
+REMOTE_PROBE_INTERVAL = 30    # While running on-device: one real upload this often re-measures the remote
+
+# Push channel from local_server (/stream). Firebase is only used while it is down.
+STREAM_READ_TIMEOUT = 30      # Must be longer than the server's keep-alive interval
+
 # Hardware Config
 BUZZER_PIN = 26  # GPIO 26 (Physical Pin 37)
 FRAMEBUFFER_DEVICE = "/dev/fb1" # Your LCD Screen
+SIM_FRAMEBUFFER_FILE = "/tmp/iskomate_fb1.raw"  # --simulate writes the LCD here instead
 IMAGE_FOLDER = "/home/pi/engagement_images/"
 
+# LCD Overlay (live scores / face count / session timer over the status image)
+LCD_OVERLAY = True
+LCD_REFRESH = 0.2             # Seconds between overlay updates (only changed pixels are written)
+LCD_RESYNC_INTERVAL = 60      # Seconds between full-screen rewrites, in case something else drew on the LCD
+
+# Alert Rules
+ALERT_DEBOUNCE = 10           # Seconds of continuous "not engaged" before the first alarm
+ALERT_COOLDOWN = 5            # Quiet seconds after a pattern before escalating
+ALERT_STALE_AFTER = 15        # No result for this long -> stop escalating (student left, uplink down)
+# Buzzer patterns as (on, off) pulses in seconds; each repeat escalates one level
+ALERT_PATTERNS = [
+    [(0.5, 0.5)] * 3,         # Level 1: three short beeps (the original alarm)
+    [(0.3, 0.2)] * 5,         # Level 2: five quick beeps
+    [(1.5, 0.5)] * 3,         # Level 3: three long beeps (stays here)
+]
+
+# Edge Inference Config (runs the model ON the Pi)
+# "auto"   = local model, unless the remote server answers faster
+# "remote" = always upload (old behaviour)
+# "local"  = never upload
+INFERENCE_MODE = os.environ.get("ISKOMATE_INFERENCE_MODE", "auto")
+LOCAL_MODEL_PATH = "/home/pi/engagement_model_quantized.tflite"
+EDGE_NUM_THREADS = 4          # Pi 4/5 has 4 cores
+
+# Upload Mode
+# "frame" = whole JPEG frame (works with every server)
+# "faces" = padded crop of the largest face + every face box (local_server skips its own detection;
+#           it classifies one face per frame, like in "frame" mode, and counts the boxes)
+UPLOAD_MODE = os.environ.get("ISKOMATE_UPLOAD_MODE", "frame")
+FACE_CROP_PADDING = 0.25      # Extra margin around each face, as a fraction of its size
+MAX_UPLOAD_FACES = 8          # Boxes reported (for the face count); only the first gets a crop
+UPLOAD_INTERVAL = 0.2         # Seconds between uploads (~5 FPS to save bandwidth)
+JPEG_QUALITY = 50             # Full-frame uploads (face crops use 80)
+
+# Recording (rolling indexed JPEG segments for replay; see segment_store.py / segment_replay.py)
+RECORD_DIR = os.environ.get("ISKOMATE_RECORD_DIR", "")  # Empty = not recording
+RECORD_FPS = 10               # Frames per second written (0 = every captured frame)
+RECORD_MAX_SEGMENTS = 60      # 60 one-minute segments = the last hour
+
+# Metrics
+METRICS_INTERVAL = 30         # Seconds between pipeline metric log lines
+# Per-hop latency spans (read with latency_report.py). Off by default: the log grows
+# without limit (~3.5 MB/h at 5 fps). Enable with e.g. ISKOMATE_TRACE_LOG=/tmp/iskomate_trace_pi.bin
+TRACE_LOG = os.environ.get("ISKOMATE_TRACE_LOG", "")
+
+# Thermal/load governor (tiers in workload_governor.py): steps capture size, upload rate,
+# JPEG quality, WebRTC size and LCD refresh down before the SoC throttles.
+# Sensor paths can point at fake files for testing.
+GOVERNOR_ENABLED = os.environ.get("ISKOMATE_GOVERNOR", "1") != "0"
+GOVERNOR_TEMP_PATH = os.environ.get("ISKOMATE_TEMP_PATH", TEMP_PATH)
+GOVERNOR_THROTTLED_PATH = os.environ.get("ISKOMATE_THROTTLED_PATH", THROTTLED_PATH)
+GOVERNOR_LOADAVG_PATH = os.environ.get("ISKOMATE_LOADAVG_PATH", LOADAVG_PATH)
+GOVERNOR_STAT_PATH = os.environ.get("ISKOMATE_STAT_PATH", STAT_PATH)
+WEBRTC_SIZE = None            # (width, height) cap for viewer frames; set by the governor
+
 # ==========================================
 # 1. HARDWARE SETUP
 # ==========================================
-try:
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setwarnings(False)
-    GPIO.setup(BUZZER_PIN, GPIO.OUT)
-    GPIO.output(BUZZER_PIN, GPIO.LOW)
-except Exception as e:
-    logger.error(f"GPIO Setup Failed: {e}")
+# Nothing touches hardware at import time; setup_hardware() runs from __main__.
+rtdb = None          # firebase_admin.db, or MemoryDatabase with --simulate
+firebase_ref = None
 
-try:
-    if not firebase_admin._apps:
-        cred = credentials.Certificate("/home/pi/serviceAccountKey.json")
-        firebase_admin.initialize_app(cred, {
-            'databaseURL': 'https://iskomate-f149c-default-rtdb.asia-southeast1.firebasedatabase.app/'
-        })
-    firebase_ref = db.reference('aiResult/engagement_stats')
-except Exception as e:
-    logger.error(f"Firebase Setup Failed: {e}")
+def setup_hardware(simulate=False):
+    global GPIO, rtdb, firebase_ref
+
+    if simulate:
+        GPIO = GpioRecorder()
+        rtdb = MemoryDatabase()
+        logger.info("SIMULATION: GPIO recorder, in-memory realtime DB")
+
+    try:
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(BUZZER_PIN, GPIO.OUT)
+        GPIO.output(BUZZER_PIN, GPIO.LOW)
+    except Exception as e:
+        logger.error(f"GPIO Setup Failed: {e}")
+
+    try:
+        if not simulate:
+            if not firebase_admin._apps:
+                cred = credentials.Certificate("/home/pi/serviceAccountKey.json")
+                firebase_admin.initialize_app(cred, {
+                    'databaseURL': 'https://iskomate-f149c-default-rtdb.asia-southeast1.firebasedatabase.app/'
+                })
+            rtdb = db
+        firebase_ref = rtdb.reference('aiResult/engagement_stats')
+    except Exception as e:
+        logger.error(f"Firebase Setup Failed: {e}")
 
 # Load Images
 status_images = {}
@@ -69,16 +171,314 @@ except Exception as e:
 # ==========================================
 # 2. FRAMEBUFFER MANAGER (DIRECT WRITE)
 # ==========================================
+def scores_to_state(data):
+    """Maps an engagement_stats dict (percentages) to the LCD state key."""
+    scores = {
+        "highly": float(data.get('highly_engaged', 0)),
+        "engaged": float(data.get('engaged', 0)),
+        "barely": float(data.get('barely_engaged', 0)),
+        "not": float(data.get('not_engaged', 0)),
+    }
+    return max(scores, key=scores.get)
+
+def to_rgb565(bgr):
+    """BGR (OpenCV) image -> uint16 RGB565 array (R=5 bits, G=6 bits, B=5 bits)."""
+    b, g, r = cv2.split(bgr)
+    return ((r.astype(np.uint16) >> 3) << 11) | ((g.astype(np.uint16) >> 2) << 5) | (b.astype(np.uint16) >> 3)
+
+def color565(b, g, r):
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+class FramebufferWriter:
+    """
+    Keeps a shadow copy of the screen and writes only the bounding box of
+    the pixels that differ. The framebuffer is mmapped when possible,
+    otherwise each changed row is written with pwrite.
+    """
+    def __init__(self, path, width, height):
+        self.width = width
+        self.height = height
+        self.shadow = np.zeros((height, width), dtype=np.uint16)
+        self.pixels_written = 0
+
+        size = width * height * 2
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if stat.S_ISREG(os.fstat(self.fd).st_mode) and os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        try:
+            self.map = mmap.mmap(self.fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self.screen = np.frombuffer(self.map, dtype=np.uint16).reshape(height, width)
+        except (OSError, ValueError):
+            self.screen = None
+
+    def blit(self, x, y, tile, force=False):
+        """Draws an RGB565 tile at (x, y). Returns the number of pixels written."""
+        h, w = tile.shape
+        region = self.shadow[y:y + h, x:x + w]
+        if force:
+            y0, y1, x0, x1 = 0, h, 0, w
+        else:
+            diff = tile != region
+            rows = np.flatnonzero(diff.any(axis=1))
+            if rows.size == 0:
+                return 0
+            cols = np.flatnonzero(diff.any(axis=0))
+            y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+        changed = tile[y0:y1, x0:x1]
+        region[y0:y1, x0:x1] = changed
+        if self.screen is not None:
+            self.screen[y + y0:y + y1, x + x0:x + x1] = changed
+        else:
+            for row in range(y1 - y0):
+                offset = ((y + y0 + row) * self.width + x + x0) * 2
+                os.pwrite(self.fd, changed[row].tobytes(), offset)
+
+        self.pixels_written += changed.size
+        return changed.size
+
+class GlyphCache:
+    """Fixed-width text tiles in RGB565; each character is rendered once."""
+    def __init__(self, fg=(255, 255, 255), bg=(32, 32, 32), scale=0.5, thickness=1):
+        self.fg, self.bg = fg, bg
+        self.scale, self.thickness = scale, thickness
+        (w, h), baseline = cv2.getTextSize("W", cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        self.cell_w, self.cell_h, self.baseline = w + 1, h + baseline + 2, baseline
+        self.glyphs = {}
+
+    def glyph(self, ch):
+        tile = self.glyphs.get(ch)
+        if tile is None:
+            cell = np.full((self.cell_h, self.cell_w, 3), self.bg, dtype=np.uint8)
+            cv2.putText(cell, ch, (0, self.cell_h - self.baseline - 1), cv2.FONT_HERSHEY_SIMPLEX,
+                        self.scale, self.fg, self.thickness, cv2.LINE_AA)
+            tile = self.glyphs[ch] = to_rgb565(cell)
+        return tile
+
+    def text(self, s):
+        return np.hstack([self.glyph(ch) for ch in s])
+
+class LcdRenderer:
+    """
+    Status image as the base layer, with live widgets on top:
+      top strip:    face count (left), session timer (right)
+      bottom panel: one score bar + percentage per engagement class
+    The base is converted once per state; widget tiles are diffed against
+    the screen so a timer tick only rewrites the digits that changed.
+    """
+    PANEL_BG = (32, 32, 32)
+    TOP_H = 24
+    ROW_H = 20
+    BARS = [
+        ("highly_engaged", "HI", (0, 200, 0)),
+        ("engaged", "EN", (200, 160, 0)),
+        ("barely_engaged", "BA", (0, 165, 255)),
+        ("not_engaged", "NO", (0, 0, 220)),
+    ]
+
+    def __init__(self, device_path, width, height):
+        self.width, self.height = width, height
+        self.writer = FramebufferWriter(device_path, width, height)
+        self.font = GlyphCache(bg=self.PANEL_BG)
+        self.bases = {}
+        self.panel_565 = color565(*self.PANEL_BG)
+        self.track_565 = color565(70, 70, 70)
+        self.bar_565 = {key: color565(*bgr) for key, _, bgr in self.BARS}
+
+        self.panel_y = height - len(self.BARS) * self.ROW_H - 8
+        self.bar_x = 8 + 3 * self.font.cell_w
+        self.bar_w = width - self.bar_x - 5 * self.font.cell_w - 8
+        self.bar_h = 12
+
+    def base(self, state):
+        tile = self.bases.get(state)
+        if tile is None:
+            img = status_images.get(state)
+            if img is None:
+                img = status_images["default"]
+            tile = self.bases[state] = to_rgb565(cv2.resize(img, (self.width, self.height)))
+        return tile
+
+    def widgets(self, live):
+        """Yields (x, y, tile) for every live element."""
+        font = self.font
+        faces = "-" if live["faces"] is None else str(live["faces"])
+        yield 8, 4, font.text(f"Faces: {faces:<3}")
+        yield self.width - 8 - 8 * font.cell_w, 4, font.text(f"{live['timer']:>8}")
+
+        for i, (key, label, _) in enumerate(self.BARS):
+            y = self.panel_y + 4 + i * self.ROW_H
+            pct = None if live["scores"] is None else live["scores"].get(key)
+            yield 8, y, font.text(label)
+
+            bar = np.full((self.bar_h, self.bar_w), self.track_565, dtype=np.uint16)
+            if pct is not None:
+                bar[:, :int(self.bar_w * min(max(pct, 0), 100) / 100)] = self.bar_565[key]
+            yield self.bar_x, y + (font.cell_h - self.bar_h) // 2, bar
+
+            text = "  --" if pct is None else f"{pct:3.0f}%"
+            yield self.width - 8 - 4 * font.cell_w, y, font.text(text)
+
+    def show(self, state, live, force=False):
+        """New status image: compose the whole screen once and write what differs."""
+        frame = self.base(state).copy()
+        if live is not None:
+            frame[:self.TOP_H] = self.panel_565
+            frame[self.panel_y:] = self.panel_565
+            for x, y, tile in self.widgets(live):
+                frame[y:y + tile.shape[0], x:x + tile.shape[1]] = tile
+        return self.writer.blit(0, 0, frame, force=force)
+
+    def update(self, live):
+        """Overlay tick: only widget rectangles are compared and written."""
+        return sum(self.writer.blit(x, y, tile) for x, y, tile in self.widgets(live))
+
+class AlertScheduler:
+    """
+    ONE thread drives the buzzer from a timer queue.
+    State updates are posted (never blocking the caller); debounce, buzzer
+    pulses, cooldown and escalation are all timers on the same heap, so
+    there are no per-alarm threads and no shared flags between threads.
+    """
+    def __init__(self, pin, debounce_s=ALERT_DEBOUNCE, cooldown_s=ALERT_COOLDOWN, patterns=ALERT_PATTERNS,
+                 stale_s=ALERT_STALE_AFTER):
+        self.pin = pin
+        self.debounce_s = debounce_s
+        self.cooldown_s = cooldown_s
+        self.stale_s = stale_s
+        self.patterns = patterns
+
+        self.events = queue.Queue(maxsize=64)
+        self.timers = []          # heap of (due, seq, action, generation)
+        self.timer_seq = 0
+
+        # Owned by the scheduler thread only
+        self.state = "default"
+        self.last_event_at = 0.0  # monotonic time of the last posted state
+        self.generation = 0       # Bumped to cancel every pending alarm timer
+        self.level = 0            # Escalation level of the next pattern
+        self.buzzing = False
+
+        # Metrics
+        self.events_processed = 0
+        self.dropped_events = 0
+        self.alarms_fired = 0
+        self.avg_decision_ms = 0.0
+        self.max_decision_ms = 0.0
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def post_state(self, state, trace=None, received_at=None):
+        """trace/received_at: latency-trace key and arrival time of the result behind this state"""
+        try:
+            self.events.put_nowait((time.monotonic(), state, trace, received_at))
+        except queue.Full:
+            self.dropped_events += 1
+
+    def stats(self):
+        return {
+            "events": self.events_processed,
+            "dropped": self.dropped_events,
+            "alarms": self.alarms_fired,
+            "avg_decision_ms": round(self.avg_decision_ms, 3),
+            "max_decision_ms": round(self.max_decision_ms, 3),
+        }
+
+    def _schedule(self, delay, action):
+        self.timer_seq += 1
+        heapq.heappush(self.timers, (time.monotonic() + delay, self.timer_seq, action, self.generation))
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self.timers:
+                timeout = max(0.0, self.timers[0][0] - time.monotonic())
+            try:
+                posted_at, state, trace, received_at = self.events.get(timeout=timeout)
+                self.last_event_at = posted_at
+                self._on_state(state)
+                if trace is not None:
+                    trace_log.span(trace, "alert_decision", received_at)
+                latency_ms = (time.monotonic() - posted_at) * 1000
+                self.events_processed += 1
+                self.avg_decision_ms = 0.9 * self.avg_decision_ms + 0.1 * latency_ms
+                self.max_decision_ms = max(self.max_decision_ms, latency_ms)
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            while self.timers and self.timers[0][0] <= now:
+                _, _, action, generation = heapq.heappop(self.timers)
+                if generation == self.generation:
+                    action()
+
+    def _on_state(self, state):
+        was_not = self.state == "not"
+        self.state = state
+
+        if state == "not":
+            if not was_not:
+                self._schedule(self.debounce_s, self._start_pattern)
+        elif was_not:
+            # Student re-engaged (or left the camera): cancel everything and reset escalation
+            self._reset()
+
+    def _reset(self):
+        self.generation += 1
+        self.level = 0
+        self._buzzer(False)
+
+    def _start_pattern(self):
+        # Only escalate on fresh evidence: results stopped -> nobody to alert
+        if time.monotonic() - self.last_event_at > self.stale_s:
+            logger.info(f"No result for {self.stale_s}s, alarm stopped")
+            self.state = "default"
+            self._reset()
+            return
+
+        pattern = self.patterns[min(self.level, len(self.patterns) - 1)]
+        self.alarms_fired += 1
+        logger.info(f"ALARM level {self.level + 1} {self.stats()}")
+
+        delay = 0.0
+        for on_s, off_s in pattern:
+            self._schedule(delay, lambda: self._buzzer(True))
+            self._schedule(delay + on_s, lambda: self._buzzer(False))
+            delay += on_s + off_s
+        self.level += 1
+        # Still not engaged after the cooldown -> next (stronger) pattern
+        self._schedule(delay + self.cooldown_s, self._start_pattern)
+
+    def _buzzer(self, on):
+        if on == self.buzzing:
+            return
+        self.buzzing = on
+        try:
+            GPIO.output(self.pin, GPIO.HIGH if on else GPIO.LOW)
+        except Exception as e:
+            logger.error(f"Buzzer Error: {e}")
+
 class FramebufferManager:
-    def __init__(self):
+    def __init__(self, device_path=FRAMEBUFFER_DEVICE):
         self.width = 480
         self.height = 320
-        self.device_path = FRAMEBUFFER_DEVICE
+        self.device_path = device_path
+        self.renderer = None
         self.latest_state = "default"
 
-        # Buzzer Logic
-        self.not_engaged_start_time = 0
-        self.is_buzzing = False
+        # Buzzer Logic (single scheduler thread)
+        self.alerts = AlertScheduler(BUZZER_PIN)
+
+        # Live overlay values
+        self.latest_scores = None
+        self.face_count = None
+        self.session_start = None
+        self.pending_trace = None  # (trace key, received_at) of the result the LCD has not shown yet
+
+        # True while results arrive over the LAN push stream from endpoint push_source.
+        # Firebase is ignored only while uploads also go to that endpoint.
+        self.push_connected = False
+        self.push_source = None
 
         # Start Loops
         threading.Thread(target=self._firebase_listener, daemon=True).start()
@@ -86,104 +486,160 @@ class FramebufferManager:
 
     def _firebase_listener(self):
         def on_snapshot(event):
-            if event.data:
+            pushed = self.push_connected and endpoint_manager is not None \
+                and endpoint_manager.upload_target == self.push_source
+            if event.data and not pushed:
                 try:
-                    data = event.data
-                    scores = {
-                        "highly": float(data.get('highly_engaged', 0)),
-                        "engaged": float(data.get('engaged', 0)),
-                        "barely": float(data.get('barely_engaged', 0)),
-                        "not": float(data.get('not_engaged', 0)),
-                    }
-                    highest_state = max(scores, key=scores.get)
-                    self._handle_logic(highest_state)
+                    self.on_result(event.data)
                 except: pass
 
         if firebase_ref:
             firebase_ref.listen(on_snapshot)
 
-    def _handle_logic(self, state):
-        self.latest_state = state
+    def on_result(self, data):
+        """One engagement_stats dict from any source (push stream, Firebase, edge model)."""
+        if "not_engaged" not in data:
+            # "No Face Detected" updates carry no scores; nobody there to alert
+            self.face_count = 0
+            self.alerts.post_state("no_face")
+            return
+        received_at = time.time()
+        trace = trace_key(data)
+        if trace is not None and "timestamp" in data:
+            trace_log.span(trace, "publish_to_pi", data["timestamp"] / 1000, received_at)
 
-        if state == "not":
-            if self.not_engaged_start_time == 0:
-                self.not_engaged_start_time = time.time()
-            elif time.time() - self.not_engaged_start_time > 10:
-                if not self.is_buzzing:
-                    threading.Thread(target=self._trigger_alarm).start()
+        if self.session_start is None:
+            self.session_start = received_at
+        self.latest_scores = data
+        self.face_count = data.get("faces", self.face_count)
+        self._handle_logic(scores_to_state(data), trace, received_at)
+
+    def _overlay_values(self):
+        if not LCD_OVERLAY:
+            return None
+        if self.session_start is None:
+            timer = "--:--"
         else:
-            self.not_engaged_start_time = 0
-            self.is_buzzing = False
-
-    def _trigger_alarm(self):
-        self.is_buzzing = True
-        for _ in range(3):
-            if self.latest_state != "not": break
-            GPIO.output(BUZZER_PIN, GPIO.HIGH)
-            time.sleep(0.5)
-            GPIO.output(BUZZER_PIN, GPIO.LOW)
-            time.sleep(0.5)
-        time.sleep(5)
-        self.is_buzzing = False
+            elapsed = int(time.time() - self.session_start)
+            timer = f"{elapsed // 3600}:{elapsed // 60 % 60:02d}:{elapsed % 60:02d}" if elapsed >= 3600 \
+                else f"{elapsed // 60:02d}:{elapsed % 60:02d}"
+        return {"scores": self.latest_scores, "faces": self.face_count, "timer": timer}
+
+    def _handle_logic(self, state, trace=None, received_at=None):
+        self.latest_state = state
+        if trace is not None:
+            trace_log.span(trace, "glass_to_logic", trace[0] / 1000)
+            self.pending_trace = (trace, received_at)
+        # Non-blocking: the scheduler thread decides about the buzzer
+        self.alerts.post_state(state, trace, received_at)
 
     def _display_loop(self):
-        """Writes raw pixels to /dev/fb1"""
+        """Writes raw RGB565 pixels to /dev/fb1, only where the screen changed"""
         logger.info(f"Writing directly to {self.device_path}")
+        renderer = self.renderer = None
+        shown_state = None
+        last_resync = 0
 
         while True:
             try:
-                # Get Image
-                img = status_images.get(self.latest_state, status_images["default"])
-
-                if img is not None:
-                    # 1. Resize to screen dimensions (480x320)
-                    resized = cv2.resize(img, (self.width, self.height))
-
-                    # 2. Convert BGR (OpenCV) to RGB 565 (LCD)
-                    # This is the magic math to make colors look right on Pi screens
-                    b, g, r = cv2.split(resized)
+                if renderer is None:
+                    renderer = self.renderer = LcdRenderer(self.device_path, self.width, self.height)
 
-                    # RGB565 logic: R=5bits, G=6bits, B=5bits
-                    r5 = (r >> 3).astype(np.uint16)
-                    g6 = (g >> 2).astype(np.uint16)
-                    b5 = (b >> 3).astype(np.uint16)
+                state = self.latest_state
+                resync = time.time() - last_resync > LCD_RESYNC_INTERVAL
+                if state != shown_state or resync:
+                    # Status changed: new base image (full write only on resync)
+                    renderer.show(state, self._overlay_values(), force=resync)
+                    shown_state = state
+                    if resync:
+                        last_resync = time.time()
+                elif LCD_OVERLAY:
+                    renderer.update(self._overlay_values())
 
-                    # Shift bits to pack into 16-bit integer
-                    rgb565 = (r5 << 11) | (g6 << 5) | b5
+                # The screen now reflects the newest result
+                pending, self.pending_trace = self.pending_trace, None
+                if pending is not None:
+                    trace, received_at = pending
+                    written_at = time.time()
+                    trace_log.span(trace, "lcd_update", received_at, written_at)
+                    trace_log.span(trace, "glass_to_lcd", trace[0] / 1000, written_at)
 
-                    # 3. Write binary data to framebuffer file
-                    with open(self.device_path, 'wb') as f:
-                        f.write(rgb565.tobytes())
-
-                time.sleep(0.5) # Refresh rate
+                time.sleep(LCD_REFRESH)
 
             except Exception as e:
                 logger.error(f"Framebuffer Error: {e}")
+                renderer = self.renderer = None
                 time.sleep(1)
 
-# Start the manager
-fb_manager = FramebufferManager()
+fb_manager = None  # Created by start_pipeline()
 
 # ==========================================
 # 3. CAMERA MANAGER
 # ==========================================
 class CameraManager:
-    def __init__(self):
-        self.cap = cv2.VideoCapture(0)
-        if not self.cap.isOpened():
-            self.cap = cv2.VideoCapture(2)
+    def __init__(self, source=None, realtime=True, recorder=None):
+        """
+        source: None = Pi camera (index 0, then 2); else see pi_backends.open_camera
+        realtime: False replays a recording frame-by-frame, as fast as the uploader takes them
+        recorder: optional SegmentRecorder that gets every captured frame
+        """
+        if source is None:
+            self.cap = cv2.VideoCapture(0)
+            if not self.cap.isOpened():
+                self.cap = cv2.VideoCapture(2)
+        else:
+            self.cap = open_camera(source, realtime=realtime)
 
         self.current_frame = None
+        self.frame_seq = 0  # Incremented for every captured frame
+        self.capture_size = None    # (width, height) frames are limited to; None = as delivered
+        self.pending_size = None    # Applied by the capture thread between reads
+        self.capture_time = 0
         self.running = True
+        self.recorder = recorder
         self.lock = threading.Lock()
+
+        # Lockstep replay: the camera waits until the uploader took the current frame
+        self.lockstep = getattr(self.cap, "lockstep", False)
+        self.new_frame = threading.Condition(self.lock)
+        self.taken_seq = 0
+
         threading.Thread(target=self._capture_loop, daemon=True).start()
 
+    def set_capture_size(self, size):
+        """Limits frames to size (width, height). Thread-safe; takes effect on the next read."""
+        self.pending_size = size
+
+    def _apply_capture_size(self):
+        size, self.pending_size = self.pending_size, None
+        self.capture_size = size
+        # Real cameras: ask the driver, so the sensor readout itself gets cheaper
+        if isinstance(self.cap, cv2.VideoCapture):
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+
     def _capture_loop(self):
         while self.running:
+            if self.pending_size is not None:
+                self._apply_capture_size()
             ret, frame = self.cap.read()
             if ret:
+                # Driver ignored the size (or not a camera): scale down here, before every consumer
+                if self.capture_size is not None and frame.shape[1] > self.capture_size[0]:
+                    frame = cv2.resize(frame, self.capture_size, interpolation=cv2.INTER_AREA)
+                captured_at = time.time()
                 with self.lock:
                     self.current_frame = frame
+                    self.frame_seq += 1
+                    self.capture_time = captured_at
+                    seq = self.frame_seq
+                    self.new_frame.notify_all()
+                    if self.lockstep:
+                        while self.taken_seq != self.frame_seq:
+                            self.new_frame.wait()
+                # Never blocks: the recorder encodes on its own thread and drops if behind
+                if self.recorder is not None:
+                    self.recorder.submit(frame, captured_at, seq)
             else:
                 time.sleep(0.1)
 
@@ -194,68 +650,507 @@ class CameraManager:
             else:
                 return np.zeros((240, 320, 3), dtype=np.uint8)
 
-global_camera = CameraManager()
+    def get_traced_frame(self):
+        """Returns (frame copy, trace key); the key is None before the first frame."""
+        with self.lock:
+            if self.lockstep:
+                # Replay: wait for a frame we have not taken yet, then release the camera
+                while self.frame_seq == self.taken_seq:
+                    self.new_frame.wait()
+                self.taken_seq = self.frame_seq
+                self.new_frame.notify_all()
+            if self.current_frame is None:
+                return np.zeros((240, 320, 3), dtype=np.uint8), None
+            return self.current_frame.copy(), (int(self.capture_time * 1000), self.frame_seq)
+
+    def get_latest(self):
+        """
+        Returns (seq, frame) WITHOUT copying. cap.read() hands us a new array
+        every time, so the reference stays valid; callers must not modify it.
+        """
+        with self.lock:
+            return self.frame_seq, self.current_frame
+
+global_camera = None  # Created by start_pipeline()
 
 # ==========================================
-# 4. CLOUD UPLOADER (SMART POLLING)
+# 3B. EDGE INFERENCE (ON-DEVICE FALLBACK)
 # ==========================================
+# Haar cascade: ships with OpenCV, cheap on ARM. Shared by edge inference and face-crop uploads.
+face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+
+def detect_faces(frame):
+    """Face boxes as (x, y, w, h) ints, largest first."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(40, 40))
+    return sorted(([int(v) for v in f] for f in faces), key=lambda f: f[2] * f[3], reverse=True)
+
+class EdgeClassifier:
+    """
+    Same quantized TFLite model as local_server, but running on the Pi, through
+    the server's own EngagementClassifier (same normalization, quantization and
+    softmax), so both show the same percentages for the same face.
+    Face detection uses OpenCV's Haar cascade (no extra install, cheap on ARM).
+    """
+    def __init__(self, model_path, num_threads):
+        self.available = False
+        self.avg_latency_ms = None
+
+        try:
+            Interpreter, runtime_name = load_interpreter_class()
+        except ImportError:
+            logger.warning("Edge inference disabled: no tflite_runtime / tensorflow installed")
+            return
+
+        if not os.path.exists(model_path):
+            logger.warning(f"Edge inference disabled: model not found at {model_path}")
+            return
+
+        try:
+            # num_threads enables the multi-threaded XNNPACK CPU delegate
+            interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+            interpreter.allocate_tensors()
+            self.model = EngagementClassifier(interpreter)
+            self.available = not face_cascade.empty()
+            logger.info(f"Edge model loaded ({runtime_name}, {num_threads} threads, "
+                        f"input normalization: {self.model.normalization}): {model_path}")
+        except Exception as e:
+            logger.error(f"Edge model load failed: {e}")
+
+    def classify(self, frame):
+        """
+        Returns an engagement_stats dict (same keys as local_server) or None
+        when no face is found.
+        """
+        start = time.time()
+
+        faces = detect_faces(frame)
+        if not faces:
+            return None
+
+        # Largest face, like MediaPipe's first detection on the server
+        x, y, w_box, h_box = faces[0]
+        face_img = frame[y:y+h_box, x:x+w_box]
+
+        scores = self.model.classify(face_img)
+
+        elapsed_ms = (time.time() - start) * 1000
+        self.avg_latency_ms = elapsed_ms if self.avg_latency_ms is None else 0.8 * self.avg_latency_ms + 0.2 * elapsed_ms
+
+        return {
+            "highly_engaged": float(scores[0] * 100),
+            "engaged": float(scores[1] * 100),
+            "barely_engaged": float(scores[2] * 100),
+            "not_engaged": float(scores[3] * 100),
+            "faces": len(faces),
+            "timestamp": int(time.time() * 1000),
+            "status": "Tracking (Edge)"
+        }
+
+edge_classifier = None  # Created by start_pipeline()
+
+# ==========================================
+# 4. ENDPOINT MANAGER (HEALTH CHECK + CIRCUIT BREAKER)
+# ==========================================
+class Endpoint:
+    """One candidate /process_frame URL with its latency and breaker state."""
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.probe_ms = None      # Moving average of GET round trips
+        self.upload_ms = None     # Moving average of real /process_frame uploads
+        self.upload_at = 0        # Time of the last successful upload
+        self.trial_at = 0         # Time of the last trial upload sent while edge inference was winning
+        self.failures = 0
+        self.opened_at = 0        # 0 = breaker closed
+        # Only our own local_server understands face-crop uploads (and has /ready)
+        self.supports_faces = name != "cloud"
+
+    @property
+    def health_url(self):
+        return self.url.rsplit("/process_frame", 1)[0] + "/"
+
+    @property
+    def probe_url(self):
+        # local_server's "/" answers while models still load; /ready is 503 until it can infer
+        return self.health_url + "ready" if self.supports_faces else self.health_url
+
+    def latency_ms(self):
+        # Real uploads include inference time, so they win over probes when known
+        return self.upload_ms if self.upload_ms is not None else self.probe_ms
+
+    def is_open(self):
+        return self.opened_at != 0 and time.time() - self.opened_at < BREAKER_COOLDOWN
+
+
+class EndpointManager:
+    """
+    Keeps the candidate set (laptop, Hugging Face, local fallback), probes their
+    latency in the background and routes uploads to the fastest healthy one.
+    The laptop URL is pushed by a Firebase listener instead of being polled.
+    cloud_url=None leaves the cloud endpoint out (--simulate default).
+    """
+    def __init__(self, cloud_url=CLOUD_API_URL):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        if cloud_url:
+            self.endpoints["cloud"] = Endpoint("cloud", cloud_url)
+        self.upload_target = None  # Endpoint name the uploader last sent to ("edge" when on-device)
+        if LOCAL_FALLBACK_URL:
+            self.endpoints["local"] = Endpoint("local", LOCAL_FALLBACK_URL)
+
+        threading.Thread(target=self._config_listener, daemon=True).start()
+        threading.Thread(target=self._probe_loop, daemon=True).start()
+
+    def _config_listener(self):
+        def on_config(event):
+            new_url = event.data
+            if not isinstance(new_url, str) or not new_url:
+                return
+            with self.lock:
+                current = self.endpoints.get("laptop")
+                if current is not None and current.url == new_url:
+                    return
+                # New server -> fresh stats and a closed breaker
+                self.endpoints["laptop"] = Endpoint("laptop", new_url)
+            logger.info(f"--> NEW SERVER FOUND! Laptop endpoint is now: {new_url}")
+
+        try:
+            rtdb.reference('server_config/active_url').listen(on_config)
+        except Exception as e:
+            # Fails if no internet/hotspot yet; cloud + local still work
+            logger.error(f"Config listener failed: {e}")
+
+    def _probe_loop(self):
+        while True:
+            with self.lock:
+                endpoints = list(self.endpoints.values())
+            for ep in endpoints:
+                # Tripped endpoints are left alone until the cooldown expires (half-open)
+                if ep.is_open():
+                    continue
+                start = time.time()
+                try:
+                    requests.get(ep.probe_url, timeout=PROBE_TIMEOUT).raise_for_status()
+                    self.report(ep, True, (time.time() - start) * 1000, probe=True)
+                except Exception:
+                    self.report(ep, False, probe=True)
+            time.sleep(PROBE_INTERVAL)
+
+    def report(self, ep, ok, elapsed_ms=None, probe=False):
+        with self.lock:
+            if ok:
+                if ep.opened_at:
+                    logger.info(f"Endpoint '{ep.name}' recovered")
+                ep.failures = 0
+                ep.opened_at = 0
+                if probe:
+                    ep.probe_ms = elapsed_ms if ep.probe_ms is None else 0.8 * ep.probe_ms + 0.2 * elapsed_ms
+                else:
+                    # An old average says nothing about the remote now: restart it from this sample
+                    stale = time.time() - ep.upload_at > REMOTE_PROBE_INTERVAL
+                    ep.upload_ms = elapsed_ms if ep.upload_ms is None or stale else 0.8 * ep.upload_ms + 0.2 * elapsed_ms
+                    ep.upload_at = time.time()
+            else:
+                ep.failures += 1
+                if ep.failures >= BREAKER_FAILURE_THRESHOLD:
+                    if not ep.is_open():
+                        logger.warning(f"Endpoint '{ep.name}' tripped after {ep.failures} failures")
+                    ep.opened_at = time.time()
+
+    def best(self):
+        """Fastest endpoint with a closed breaker and a known latency, or None."""
+        with self.lock:
+            healthy = [ep for ep in self.endpoints.values()
+                       if not ep.is_open() and ep.failures == 0 and ep.latency_ms() is not None]
+        if not healthy:
+            return None
+        return min(healthy, key=lambda ep: ep.latency_ms())
+
+endpoint_manager = None  # Created by start_pipeline()
+trace_log = TraceLog(None)  # Disabled until start_pipeline()
+
+# ==========================================
+# 4B. RESULT STREAM (PUSH FROM LOCAL SERVER)
+# ==========================================
+def result_stream_loop():
+    """
+    Subscribes to local_server's /stream (server-sent events) so the LCD and
+    buzzer react right after inference instead of after a Firebase round trip.
+    """
+    while True:
+        with endpoint_manager.lock:
+            ep = endpoint_manager.endpoints.get("laptop") or endpoint_manager.endpoints.get("local")
+
+        if ep is None or ep.is_open():
+            time.sleep(2)
+            continue
+
+        stream_url = ep.health_url + "stream"
+        try:
+            with requests.get(stream_url, stream=True, timeout=(2, STREAM_READ_TIMEOUT)) as response:
+                response.raise_for_status()
+                fb_manager.push_source = ep.name
+                fb_manager.push_connected = True
+                logger.info(f"Result stream connected: {stream_url}")
+
+                for line in response.iter_lines(decode_unicode=True):
+                    # Laptop moved to a new URL -> reconnect there.
+                    # Breaker open (e.g. /process_frame failing while /stream is fine) -> results come from elsewhere
+                    if endpoint_manager.endpoints.get(ep.name) is not ep or ep.is_open():
+                        break
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = json.loads(line[5:])
+                    fb_manager.on_result(data)
+        except Exception:
+            pass
+        finally:
+            if fb_manager.push_connected:
+                logger.info("Result stream lost, falling back to Firebase")
+            fb_manager.push_connected = False
+        time.sleep(2)
+
+
+# ==========================================
+# 5. CLOUD UPLOADER
+# ==========================================
+def should_use_remote(endpoint):
+    """Remote only when the local model is missing, or when remote is measurably faster."""
+    if edge_classifier is None or not edge_classifier.available:
+        return endpoint is not None
+    if INFERENCE_MODE == "local" or endpoint is None:
+        return False
+    if edge_classifier.avg_latency_ms is None:
+        return False
+    # Only a real upload (inference included) compares like-for-like with edge inference,
+    # so while on-device we still send one every REMOTE_PROBE_INTERVAL to keep it current
+    now = time.time()
+    if now - max(endpoint.upload_at, endpoint.trial_at) > REMOTE_PROBE_INTERVAL:
+        endpoint.trial_at = now
+        return True
+    return endpoint.upload_ms is not None and endpoint.upload_ms < edge_classifier.avg_latency_ms
+
+def build_upload(frame, endpoint):
+    """Returns (files, form) for /process_frame: whole frame, or face crops + boxes."""
+    if UPLOAD_MODE != "faces" or not endpoint.supports_faces:
+        # Compress frame (low quality for speed; the governor lowers it further when hot)
+        _, img_encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
+        return {'image': ('frame.jpg', img_encoded.tobytes(), 'image/jpeg')}, {}
+
+    h, w = frame.shape[:2]
+    files, boxes = [], []
+    for i, (x, y, fw, fh) in enumerate(detect_faces(frame)[:MAX_UPLOAD_FACES]):
+        if i > 0:
+            # The server only classifies the largest face; the others just count
+            boxes.append({"face": [x, y, fw, fh]})
+            continue
+        pad_x, pad_y = int(fw * FACE_CROP_PADDING), int(fh * FACE_CROP_PADDING)
+        x1, y1 = max(0, x - pad_x), max(0, y - pad_y)
+        x2, y2 = min(w, x + fw + pad_x), min(h, y + fh + pad_y)
+        # Crops are small, so a higher quality costs little and helps the classifier
+        _, crop_encoded = cv2.imencode('.jpg', frame[y1:y2, x1:x2], [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+        files.append(('faces', (f'face{i}.jpg', crop_encoded.tobytes(), 'image/jpeg')))
+        boxes.append({"crop": [x1, y1, x2 - x1, y2 - y1], "face": [x, y, fw, fh]})
+    return files, {'boxes': json.dumps(boxes), 'frame_size': json.dumps([w, h])}
+
+# Counters for the metrics log
+pipeline_stats = {"uploads": 0, "upload_failures": 0, "edge_runs": 0}
+
+def run_edge_inference(frame, trace=None):
+    """Classifies on the Pi and feeds the LCD/buzzer logic directly (no cloud round trip)."""
+    pipeline_stats["edge_runs"] += 1
+    start = time.time()
+    data = edge_classifier.classify(frame)
+    trace_log.span(trace, "edge_inference", start)
+    if data is not None:
+        if trace is not None:
+            data["capture_ts"], data["frame_id"] = trace
+        fb_manager.on_result(data)
+
 def cloud_upload_loop():
-    global CLOUD_API_URL
-    logger.info(f"Cloud Uploader Active. Initial Target: {CLOUD_API_URL}")
-    
-    last_config_check = 0
+    logger.info(f"Cloud Uploader Active. Mode: {INFERENCE_MODE}")
+    last_target = None
     
     while True:
-        # --- A. DYNAMIC CONFIG CHECK (Every 5 Seconds) ---
-        # Checks if Laptop Server has posted a new IP to Firebase
-        if time.time() - last_config_check > 5:
-            try:
-                ref = db.reference('server_config/active_url')
-                new_url = ref.get()
-                
-                # If we found a URL and it is different from current one
-                if new_url and new_url != CLOUD_API_URL:
-                    CLOUD_API_URL = new_url
-                    logger.info(f"--> NEW SERVER FOUND! Switching Target to: {CLOUD_API_URL}")
-            except Exception:
-                # Fails silently if no internet/hotspot yet
-                pass
-            last_config_check = time.time()
+        endpoint = endpoint_manager.best()
+        frame, trace = global_camera.get_traced_frame()
+        if trace is not None:
+            trace_log.span(trace, "capture_wait", trace[0] / 1000)
+
+        # --- A. LOCAL INFERENCE (no healthy endpoint, or local is faster) ---
+        if not should_use_remote(endpoint):
+            endpoint_manager.upload_target = "edge"
+            if edge_classifier is not None and edge_classifier.available:
+                try:
+                    run_edge_inference(frame, trace)
+                except Exception as e:
+                    logger.error(f"Edge inference error: {e}")
+                # Same rate limit as uploads, so the governor also throttles on-device inference
+                time.sleep(UPLOAD_INTERVAL)
+            else:
+                # Nothing reachable yet, wait for the probes
+                time.sleep(1)
+            continue
+
+        endpoint_manager.upload_target = endpoint.name
+        if endpoint.name != last_target:
+            logger.info(f"--> Uploading to '{endpoint.name}': {endpoint.url}")
+            last_target = endpoint.name
 
         # --- B. UPLOAD FRAME ---
         try:
-            frame = global_camera.get_frame()
-            if frame is not None:
-                # Compress frame (Quality 50 for speed)
-                _, img_encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
-                
-                response = requests.post(
-                    CLOUD_API_URL,
-                    files={'image': ('frame.jpg', img_encoded.tobytes(), 'image/jpeg')},
-                    timeout=2 # Short timeout to prevent freezing
-                )
+            start = time.time()
+            files, form = build_upload(frame, endpoint)
+            if trace is not None:
+                # Echoed back in the result so every hop can log against this frame
+                form.update({'capture_ts': trace[0], 'frame_id': trace[1]})
+            sent_at = time.time()
+            trace_log.span(trace, "encode", start, sent_at)
+            
+            response = requests.post(
+                endpoint.url,
+                files=files,
+                data=form,
+                timeout=2 # Short timeout to prevent freezing
+            )
+            response.raise_for_status()
+            endpoint_manager.report(endpoint, True, (time.time() - start) * 1000)
+            trace_log.span(trace, "upload", sent_at)
+            pipeline_stats["uploads"] += 1
             
-            # Limit FPS to ~5 to save bandwidth
-            time.sleep(0.2) 
+            # Limit FPS to save bandwidth
+            time.sleep(UPLOAD_INTERVAL)
             
         except Exception:
-            # If connection fails, wait a bit and retry
-            time.sleep(1)
+            endpoint_manager.report(endpoint, False)
+            pipeline_stats["upload_failures"] += 1
+            # Remote failed -> classify this frame locally instead of leaving the LCD stale
+            if edge_classifier is not None and edge_classifier.available:
+                try:
+                    run_edge_inference(frame, trace)
+                except Exception as e:
+                    logger.error(f"Edge inference error: {e}")
+            # The next loop picks the next-best endpoint, no long sleep needed
+            # (the breaker stops a failing endpoint from being retried every frame)
+            time.sleep(UPLOAD_INTERVAL)
+
+# ==========================================
+# 5B. PIPELINE STARTUP + METRICS
+# ==========================================
+governor = None  # Created by start_pipeline() unless disabled
+
+def apply_tier(tier, decision):
+    """Governor callback: switches every rate/size knob to the tier's values and logs why."""
+    global UPLOAD_INTERVAL, JPEG_QUALITY, LCD_REFRESH, WEBRTC_SIZE
+    UPLOAD_INTERVAL = tier["upload_interval"]
+    JPEG_QUALITY = tier["jpeg_quality"]
+    LCD_REFRESH = tier["lcd_refresh"]
+    WEBRTC_SIZE = tier["webrtc"]
+    global_camera.set_capture_size(tier["capture"])
+    logger.info(f"GOVERNOR {json.dumps(decision)}")
 
-threading.Thread(target=cloud_upload_loop, daemon=True).start()
+def start_pipeline(camera_source=None, framebuffer_path=FRAMEBUFFER_DEVICE, realtime=True, record_dir=RECORD_DIR,
+                   use_governor=GOVERNOR_ENABLED, cloud_url=CLOUD_API_URL):
+    """Creates the managers and starts every background loop (same order on Pi and --simulate)."""
+    global fb_manager, global_camera, edge_classifier, endpoint_manager, trace_log, governor
+
+    trace_log = TraceLog(TRACE_LOG or None)
+    fb_manager = FramebufferManager(framebuffer_path)
+    recorder = None
+    if record_dir:
+        recorder = SegmentRecorder(record_dir, fps=RECORD_FPS, max_segments=RECORD_MAX_SEGMENTS)
+        logger.info(f"Recording camera to {record_dir}")
+    global_camera = CameraManager(camera_source, realtime=realtime, recorder=recorder)
+    edge_classifier = EdgeClassifier(LOCAL_MODEL_PATH, EDGE_NUM_THREADS) if INFERENCE_MODE != "remote" else None
+    endpoint_manager = EndpointManager(cloud_url)
+    if use_governor:
+        sensors = SystemSensors(GOVERNOR_TEMP_PATH, GOVERNOR_THROTTLED_PATH, GOVERNOR_LOADAVG_PATH, GOVERNOR_STAT_PATH)
+        governor = WorkloadGovernor(apply_tier, sensors)
+        governor.start()
+
+    threading.Thread(target=result_stream_loop, daemon=True).start()
+    threading.Thread(target=cloud_upload_loop, daemon=True).start()
+    threading.Thread(target=metrics_loop, daemon=True).start()
+
+def collect_metrics():
+    with endpoint_manager.lock:
+        endpoints = {name: None if ep.latency_ms() is None else round(ep.latency_ms(), 1)
+                     for name, ep in endpoint_manager.endpoints.items()}
+    return {
+        "camera_frames": global_camera.frame_seq,
+        **pipeline_stats,
+        "edge_ms": None if edge_classifier is None or edge_classifier.avg_latency_ms is None
+                   else round(edge_classifier.avg_latency_ms, 1),
+        "endpoint_ms": endpoints,
+        "alerts": fb_manager.alerts.stats(),
+        "lcd_pixels_written": fb_manager.renderer.writer.pixels_written if fb_manager.renderer else 0,
+        "recorded": global_camera.recorder.recorded if global_camera.recorder else 0,
+        "record_dropped": global_camera.recorder.dropped if global_camera.recorder else 0,
+        "governor": governor.stats() if governor else None,
+    }
+
+def metrics_loop():
+    last_frames, last_time = 0, time.time()
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        metrics = collect_metrics()
+        now = time.time()
+        metrics["camera_fps"] = round((metrics["camera_frames"] - last_frames) / (now - last_time), 1)
+        last_frames, last_time = metrics["camera_frames"], now
+        logger.info(f"METRICS {json.dumps(metrics)}")
 
 # ==========================================
-# 5. SIGNALING & WEBRTC
+# 6. SIGNALING & WEBRTC
 # ==========================================
-class MyCameraTrack(VideoStreamTrack):
+class SharedCameraTrack(VideoStreamTrack):
+    """
+    ONE source track for all viewers.
+    Each captured frame is resized and converted to yuv420p (what the
+    encoders consume) only once per sequence number, and MediaRelay hands
+    every recv()'s frame to every peer, so an extra viewer only costs its own
+    encoder. Every recv() wraps the cached planes in a NEW VideoFrame (a plain
+    copy, no color conversion): the previous one may still be in a viewer's
+    encoder, so its pts is left alone.
+    """
+    def __init__(self):
+        super().__init__()
+        self.last_seq = -1
+        self.last_planes = None  # yuv420p planes as one (h * 3/2, w) array
+        self.conversions = 0
+
     async def recv(self):
         pts, time_base = await self.next_timestamp()
-        frame = global_camera.get_frame()
-        video_frame = VideoFrame.from_ndarray(frame, format="bgr24")
+        seq, frame = global_camera.get_latest()
+
+        if self.last_planes is None or seq != self.last_seq:
+            if frame is None:
+                frame = np.zeros((240, 320, 3), dtype=np.uint8)
+            elif WEBRTC_SIZE is not None and frame.shape[1] > WEBRTC_SIZE[0]:
+                # Once per captured frame, shared by every viewer's encoder
+                frame = cv2.resize(frame, WEBRTC_SIZE, interpolation=cv2.INTER_AREA)
+            converted = VideoFrame.from_ndarray(frame, format="bgr24").reformat(format="yuv420p")
+            self.last_planes = converted.to_ndarray()
+            self.last_seq = seq
+            self.conversions += 1
+
+        # Camera slower than the track clock -> resend the same planes in a fresh frame
+        video_frame = VideoFrame.from_ndarray(self.last_planes, format="yuv420p")
         video_frame.pts = pts
         video_frame.time_base = time_base
         return video_frame
 
+relay = MediaRelay()
+shared_track = None
+
+def get_viewer_track():
+    """Returns a relay subscription of the shared camera track for a new peer."""
+    global shared_track
+    if shared_track is None or shared_track.readyState != "live":
+        shared_track = SharedCameraTrack()
+    # buffered=False: a slow viewer drops frames instead of queueing them
+    return relay.subscribe(shared_track, buffered=False)
+
 pcs = set()
 
 async def run_signaling(websocket):
@@ -266,7 +1161,7 @@ async def run_signaling(websocket):
             if data["type"] == "offer":
                 pc = RTCPeerConnection(configuration=RTCConfiguration(iceServers=[]))
                 pcs.add(pc)
-                pc.addTrack(MyCameraTrack())
+                pc.addTrack(get_viewer_track())
 
                 @pc.on("connectionstatechange")
                 async def on_connectionstatechange():
@@ -298,8 +1193,63 @@ async def main():
             async with websockets.connect(SIGNALING_URL) as ws: await run_signaling(ws)
         except: await asyncio.sleep(5)
 
-if __name__ == "__main__":
+def run_simulation(duration, framebuffer_path):
+    """--simulate: no WebRTC signaling, just capture -> upload -> display until stopped."""
+    start = time.time()
     try:
-        asyncio.run(main())
+        while not duration or time.time() - start < duration:
+            time.sleep(0.5)
     except KeyboardInterrupt:
-        GPIO.cleanup()
\ No newline at end of file
+        pass
+    GPIO.cleanup()
+
+    metrics = collect_metrics()
+    metrics["camera_fps"] = round(metrics["camera_frames"] / (time.time() - start), 1)
+    metrics["gpio"] = GPIO.summary()
+    logger.info(f"FINAL METRICS {json.dumps(metrics)}")
+
+    snapshot = framebuffer_path + ".png"
+    save_framebuffer_png(framebuffer_path, fb_manager.width, fb_manager.height, snapshot)
+    logger.info(f"Last LCD frame saved to {snapshot}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IskoMate Pi client (camera, uploader, LCD, buzzer, WebRTC)")
+    parser.add_argument("--simulate", action="store_true",
+                        help="Run without Pi hardware: GPIO recorder, file framebuffer, in-memory realtime DB")
+    parser.add_argument("--camera", default=None,
+                        help="'synthetic', a video file or a device index (default: 0 then 2; 'synthetic' with --simulate)")
+    parser.add_argument("--framebuffer", default=None,
+                        help=f"Framebuffer device or file (default: {FRAMEBUFFER_DEVICE}; {SIM_FRAMEBUFFER_FILE} with --simulate)")
+    parser.add_argument("--record", default=RECORD_DIR or None,
+                        help="Record captured frames as indexed JPEG segments in this folder")
+    parser.add_argument("--replay-fast", action="store_true",
+                        help="With --camera <recording folder>: process every frame once, as fast as possible")
+    parser.add_argument("--no-governor", action="store_true",
+                        help="Fixed rates and sizes, no thermal/load governor")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="With --simulate: stop after this many seconds and print the final metrics")
+    parser.add_argument("--cloud-url", default=None,
+                        help="Cloud /process_frame URL (default: the production space; "
+                             "none with --simulate, so synthetic frames never reach the live Firebase)")
+    args = parser.parse_args()
+
+    camera = args.camera or ("synthetic" if args.simulate else None)
+    framebuffer = args.framebuffer or (SIM_FRAMEBUFFER_FILE if args.simulate else FRAMEBUFFER_DEVICE)
+    cloud_url = args.cloud_url or (None if args.simulate else CLOUD_API_URL)
+
+    if args.replay_fast:
+        UPLOAD_INTERVAL = 0
+
+    setup_hardware(simulate=args.simulate)
+    # Replay-fast must process every frame at full quality: no governor there
+    start_pipeline(camera, framebuffer, realtime=not args.replay_fast, record_dir=args.record,
+                   use_governor=GOVERNOR_ENABLED and not args.no_governor and not args.replay_fast,
+                   cloud_url=cloud_url)
+
+    if args.simulate:
+        run_simulation(args.duration, framebuffer)
+    else:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            GPIO.cleanup()
\ No newline at end of file
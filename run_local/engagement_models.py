@@ -0,0 +1,211 @@
+import cv2
+import numpy as np
+
+from landmark_cascade import geometric_features
+
+# ==========================================
+# ENGAGEMENT MODELS (DETECTOR, FACE MESH, CLASSIFIER)
+# ==========================================
+# The models behind local_server, loaded either in the server process or in
+# each inference worker. Importing this module has no side effects (no
+# threads, files or network), so spawned workers can import it safely.
+
+# How raw 0-255 pixels map to the model's real-valued input:
+#   "none" = 0..255, "unit" = 0..1, "symmetric" = -1..1
+#   "auto" = read the range from the input's quantization params (int models),
+#            "none" for float models (what this server has always fed them)
+# Quantized (int) inputs additionally get the model's own scale / zero point applied.
+INPUT_NORMALIZATION = "auto"
+INPUT_COLOR_ORDER = "bgr" # Channel order the model was trained on ("bgr" or "rgb")
+
+CASCADE_PADDING = 0.25    # Border added around the tight face crop so Face Mesh finds the face
+
+# Loaded by the load_* functions (per process)
+face_detection = None
+face_mesh = None
+classifier = None
+runtime_name = None
+
+def softmax(x):
+    e_x = np.exp(x - np.max(x))
+    return e_x / e_x.sum()
+
+class EngagementClassifier:
+    """
+    Wraps the TFLite interpreter with zero-allocation preprocessing.
+    Resize goes into a preallocated buffer, then ONE cv2.LUT pass does
+    normalization + quantization + cast straight into the interpreter's
+    input tensor (no expand_dims / astype / set_tensor copies).
+    """
+    NORMALIZATION = {"none": (1.0, 0.0), "unit": (1 / 255.0, 0.0), "symmetric": (2 / 255.0, -1.0)}
+
+    def __init__(self, interpreter, normalization=INPUT_NORMALIZATION, color_order=INPUT_COLOR_ORDER):
+        self.interpreter = interpreter
+        input_detail = interpreter.get_input_details()[0]
+        output_detail = interpreter.get_output_details()[0]
+        self.input_index = input_detail['index']
+        self.output_index = output_detail['index']
+        self.target_h, self.target_w = int(input_detail['shape'][1]), int(input_detail['shape'][2])
+        self.lut, self.normalization = self.build_lut(input_detail['dtype'], input_detail['quantization'],
+                                                      normalization)
+        self.resized = np.empty((self.target_h, self.target_w, 3), dtype=np.uint8)
+        self.swapped = np.empty_like(self.resized) if color_order == "rgb" else None
+        self.output_scale, self.output_zero_point = output_detail['quantization']
+
+    @classmethod
+    def build_lut(cls, dtype, quantization=(0.0, 0), normalization=INPUT_NORMALIZATION):
+        """
+        256-entry table: pixel value -> exact value the model wants, in its dtype.
+        Returns (table, normalization actually used).
+        """
+        scale, zero_point = quantization
+        if normalization == "auto":
+            normalization = cls.infer_normalization(scale, zero_point, dtype)
+        a, b = cls.NORMALIZATION[normalization]
+        real = np.arange(256, dtype=np.float64) * a + b
+        if scale:
+            limits = np.iinfo(dtype)
+            real = np.clip(np.round(real / scale + zero_point), limits.min, limits.max)
+        return real.astype(dtype).reshape(1, 256), normalization
+
+    @staticmethod
+    def infer_normalization(scale, zero_point, dtype):
+        """Real-valued range the quantized input covers -> matching normalization."""
+        if not scale:
+            return "none"
+        limits = np.iinfo(dtype)
+        real_min = (limits.min - zero_point) * scale
+        real_max = (limits.max - zero_point) * scale
+        if real_min < -0.5:
+            return "symmetric"
+        if real_max <= 2.0:
+            return "unit"
+        return "none"
+
+    def classify(self, face_img):
+        """Returns the softmax scores for one BGR face crop."""
+        cv2.resize(face_img, (self.target_w, self.target_h), dst=self.resized)
+        pixels = self.resized
+        if self.swapped is not None:
+            pixels = cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self.swapped)
+
+        # tensor() is a view into the interpreter's memory; never keep it across invoke()
+        input_view = self.interpreter.tensor(self.input_index)()[0]
+        written = cv2.LUT(pixels, self.lut, dst=input_view)
+        if written is not input_view:
+            input_view[...] = written
+        # invoke() refuses to run while any view into its tensors is alive
+        del input_view, written
+
+        self.interpreter.invoke()
+        output = self.interpreter.tensor(self.output_index)()[0].astype(np.float32)
+        if self.output_scale:
+            output = (output - self.output_zero_point) * self.output_scale
+        return softmax(output)
+
+    def warm_up(self):
+        self.classify(np.zeros((self.target_h, self.target_w, 3), dtype=np.uint8))
+
+def preprocess(face_img, size, lut, color_order=INPUT_COLOR_ORDER):
+    """
+    EngagementClassifier's preprocessing for runtimes without a writable input
+    tensor (ONNX Runtime). size is (w, h); lut comes from build_lut().
+    Returns a (1, h, w, 3) batch in the table's dtype.
+    """
+    pixels = cv2.resize(face_img, size)
+    if color_order == "rgb":
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB)
+    return cv2.LUT(pixels, lut)[np.newaxis]
+
+def load_interpreter_class():
+    """Prefers a slim TFLite runtime; full TensorFlow only as a last resort."""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter, "ai_edge_litert"
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter, "tflite_runtime"
+    except ImportError:
+        pass
+    import tensorflow.lite as tflite
+    return tflite.Interpreter, "tensorflow"
+
+def load_detector():
+    global face_detection
+    print("Loading MediaPipe Face Detection...")
+    import mediapipe as mp
+    mp_face_detection = mp.solutions.face_detection
+    face_detection = mp_face_detection.FaceDetection(min_detection_confidence=0.5)
+
+def load_face_mesh():
+    global face_mesh
+    print("Loading MediaPipe Face Mesh (landmark cascade)...")
+    import mediapipe as mp
+    face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1,
+                                                refine_landmarks=True, min_detection_confidence=0.5)
+
+def load_classifier(model_path, num_threads=None):
+    global classifier, runtime_name
+    Interpreter, runtime_name = load_interpreter_class()
+    print(f"Loading TFLite Model from {model_path} (runtime: {runtime_name})...")
+    interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    classifier = EngagementClassifier(interpreter)
+    print(f"Model Loaded Successfully! (input normalization: {classifier.normalization})")
+
+def warm_up():
+    """One dummy pass through the loaded models so the first real frame is not slow."""
+    dummy = np.zeros((480, 640, 3), dtype=np.uint8)
+    face_detection.process(dummy)
+    if face_mesh is not None:
+        face_mesh.process(dummy)
+    classifier.warm_up()
+
+def detect_face(frame):
+    """
+    MediaPipe on a (possibly reduced) frame.
+    Returns (first face box relative to the frame or None, face count).
+    """
+    # Convert BGR (OpenCV) to RGB (MediaPipe) -- on the small image only
+    results = face_detection.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    if not results.detections:
+        return None, 0
+
+    bboxC = results.detections[0].location_data.relative_bounding_box
+    return (bboxC.xmin, bboxC.ymin, bboxC.width, bboxC.height), len(results.detections)
+
+def classify_scores(face_img):
+    return [float(s) for s in classifier.classify(face_img)]
+
+def landmark_features(face_img):
+    """Cascade features for one BGR face crop, or None if Face Mesh finds no face in it."""
+    pad = int(max(face_img.shape[:2]) * CASCADE_PADDING)
+    padded = cv2.copyMakeBorder(face_img, pad, pad, pad, pad, cv2.BORDER_CONSTANT)
+    results = face_mesh.process(cv2.cvtColor(padded, cv2.COLOR_BGR2RGB))
+    if not results.multi_face_landmarks:
+        return None
+    h, w = padded.shape[:2]
+    return geometric_features([(p.x * w, p.y * h) for p in results.multi_face_landmarks[0].landmark])
+
+def worker_init(model_path, with_face_mesh, num_threads):
+    """
+    Runs inside each worker process: its own detector + interpreter, warmed up.
+    Bind the arguments with functools.partial (it pickles by name for spawn).
+    """
+    cv2.setNumThreads(1)
+    loaders = [("MediaPipe Face Detection", load_detector)]
+    if with_face_mesh:
+        loaders.append(("MediaPipe Face Mesh", load_face_mesh))
+    loaders.append((f"TFLite model '{model_path}'", lambda: load_classifier(model_path, num_threads)))
+    for name, load in loaders:
+        try:
+            load()
+        except Exception as e:
+            raise RuntimeError(f"{name}: {e!r}")
+    warm_up()
+    return {"input_size": (classifier.target_h, classifier.target_w), "runtime": runtime_name}
+
+# What the worker pool may run on a shared-memory image
+WORKER_HANDLERS = {"detect": detect_face, "classify": classify_scores, "landmarks": landmark_features}
@@ -0,0 +1,256 @@
+import atexit
+import itertools
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# ==========================================
+# MULTI-PROCESS INFERENCE WORKERS
+# ==========================================
+# N pre-started processes, each with its OWN models (no GIL, no shared
+# interpreter). The front end copies a decoded image into a shared-memory
+# slot and queues only (job id, kind, slot, shape) -- pixels never go
+# through a pipe. Every slot belongs to one worker and each worker has its
+# own task queue, so the front end always knows which jobs a worker holds:
+# the job is recorded against its slot BEFORE it is queued, and when the
+# supervisor finds a dead worker it fails every job in that worker's slots
+# and restarts it with a fresh queue. Each worker answers on its own one-way
+# pipe (single writer, single reader, so no cross-worker locking).
+#
+# Workers are SPAWNED, not forked: the server is already running threads
+# (Flask, Firebase, publishers) whose locks a fork could copy in a held
+# state, and restarts happen from the fully threaded process. init and the
+# handlers must therefore live in a module without import side effects
+# (they are pickled by name and the module is re-imported in each worker).
+# The parent's __main__ is re-imported too, so it must keep its setup
+# (threads, open files) under `if __name__ == "__main__"`.
+
+
+class PoolBusy(Exception):
+    """Every slot stayed in use for the whole job timeout."""
+
+
+def _worker_main(worker_id, init, handlers, tasks, conn, shm_name, slot_bytes):
+    # Spawned children share the parent's resource tracker, so attaching here
+    # does not hand ownership over: only the parent's close() unlinks the block
+    shm = SharedMemory(name=shm_name)
+    try:
+        info = init()
+    except Exception as e:
+        conn.send(("failed", worker_id, repr(e)))
+        return
+    conn.send(("ready", worker_id, info))
+
+    while True:
+        job = tasks.get()
+        if job is None:
+            break
+        job_id, kind, slot, shape, dtype = job
+        image = np.ndarray(shape, dtype, buffer=shm.buf, offset=slot * slot_bytes)
+        try:
+            message = ("result", job_id, worker_id, True, handlers[kind](image))
+        except Exception as e:
+            message = ("result", job_id, worker_id, False, repr(e))
+        del image  # No views may outlive the job: the slot is reused right away
+        conn.send(message)
+
+
+class WorkerPool:
+    """
+    run(kind, image) blocks the calling (Flask) thread until a worker
+    returns handlers[kind](image). Safe to call from many threads at once.
+    Raises PoolBusy when no slot frees up within job_timeout.
+    """
+    def __init__(self, num_workers, init, handlers, slot_bytes, slots_per_worker=2, job_timeout=10.0):
+        self.ctx = mp.get_context("spawn")
+        self.num_workers = num_workers
+        self.init = init
+        self.handlers = handlers
+        self.slot_bytes = slot_bytes
+        self.slots_per_worker = slots_per_worker
+        self.job_timeout = job_timeout
+
+        num_slots = num_workers * slots_per_worker
+        self.shm = SharedMemory(create=True, size=slot_bytes * num_slots)
+
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        # Worker w owns slots w * slots_per_worker ... (w + 1) * slots_per_worker - 1
+        self.free_slots = [list(range(w * slots_per_worker, (w + 1) * slots_per_worker))
+                           for w in range(num_workers)]
+        self.slot_jobs = [None] * num_slots  # slot -> job id, recorded before the job is queued
+        self.tasks = [None] * num_workers     # One task queue per worker
+        self.pending = {}            # job id -> {"event", "slot", "ok", "result"}
+        self.job_ids = itertools.count()
+        self.procs = [None] * num_workers
+        self.conns = [None] * num_workers
+        self.ready = set()
+        self.all_ready = threading.Event()
+        self.worker_info = None      # What init() returned (same for every worker)
+        self.jobs_done = [0] * num_workers
+        self.restarts = 0
+        self.failed = None
+
+        self.closed = False
+        atexit.register(self.close)
+
+        for worker_id in range(num_workers):
+            self._spawn(worker_id)
+        threading.Thread(target=self._collect_loop, daemon=True).start()
+        threading.Thread(target=self._supervise_loop, daemon=True).start()
+
+    def _spawn(self, worker_id):
+        """Starts a worker with a fresh task queue. Returns the jobs the previous one held."""
+        tasks = self.ctx.Queue()
+        parent_conn, child_conn = self.ctx.Pipe(duplex=False)
+        proc = self.ctx.Process(
+            target=_worker_main, daemon=True, name=f"inference-worker-{worker_id}",
+            args=(worker_id, self.init, self.handlers, tasks, child_conn,
+                  self.shm.name, self.slot_bytes))
+        proc.start()
+        child_conn.close()
+        first = worker_id * self.slots_per_worker
+        with self.lock:
+            old_conn, old_tasks = self.conns[worker_id], self.tasks[worker_id]
+            self.procs[worker_id] = proc
+            self.conns[worker_id] = parent_conn
+            self.tasks[worker_id] = tasks
+            # Same lock as dispatch: every job recorded so far went to the old
+            # queue (dequeued or not), every later one goes to the new queue
+            held = [job_id for job_id in self.slot_jobs[first:first + self.slots_per_worker]
+                    if job_id is not None]
+        # The dead worker's pipe, if the collector has not closed it yet
+        if old_conn is not None:
+            old_conn.close()
+        if old_tasks is not None:
+            old_tasks.cancel_join_thread()  # Nobody reads it any more; don't block exit on it
+            old_tasks.close()
+        return held
+
+    def _take_slot(self):
+        """Free slot of the least busy worker (ready ones first). Call with the lock held."""
+        worker_id = max(range(self.num_workers),
+                        key=lambda w: (bool(self.free_slots[w]), w in self.ready, len(self.free_slots[w])))
+        return worker_id, self.free_slots[worker_id].pop()
+
+    def run(self, kind, image):
+        if image.nbytes > self.slot_bytes:
+            raise ValueError(f"Image of {image.nbytes} bytes does not fit a {self.slot_bytes}-byte slot")
+
+        # Backpressure: wait for a free slot instead of queueing without bound
+        with self.slot_freed:
+            if not self.slot_freed.wait_for(lambda: any(self.free_slots), self.job_timeout):
+                raise PoolBusy(f"No free inference slot within {self.job_timeout}s")
+            worker_id, slot = self._take_slot()
+        view = np.ndarray(image.shape, image.dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        view[...] = image
+        del view
+
+        job_id = next(self.job_ids)
+        entry = {"event": threading.Event(), "slot": slot, "ok": False, "result": None}
+        with self.lock:
+            # Recorded against the slot first: if the worker dies at any point after
+            # this, the supervisor knows to fail the job
+            self.pending[job_id] = entry
+            self.slot_jobs[slot] = job_id
+            tasks = self.tasks[worker_id]
+        try:
+            tasks.put((job_id, kind, slot, image.shape, image.dtype.str))
+        except ValueError:
+            pass  # Queue of a worker restarted meanwhile: the job was already failed
+
+        if not entry["event"].wait(self.job_timeout):
+            # The slot stays reserved until the worker finishes (or dies) with it
+            raise TimeoutError(f"{kind} job {job_id} timed out")
+        if not entry["ok"]:
+            raise RuntimeError(f"{kind} job failed in worker: {entry['result']}")
+        return entry["result"]
+
+    def _finish(self, job_id, ok, result):
+        with self.lock:
+            entry = self.pending.pop(job_id, None)
+            if entry is None:
+                return
+            slot = entry["slot"]
+            self.slot_jobs[slot] = None
+            self.free_slots[slot // self.slots_per_worker].append(slot)
+            self.slot_freed.notify()
+        entry["ok"], entry["result"] = ok, result
+        entry["event"].set()
+
+    def _collect_loop(self):
+        while True:
+            with self.lock:
+                conns = {conn: worker_id for worker_id, conn in enumerate(self.conns) if conn is not None}
+            try:
+                ready = wait(list(conns), timeout=0.5)
+            except (OSError, ValueError):
+                continue  # A pipe was closed by a restart meanwhile; rebuild the list
+            for conn in ready:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    # Worker died; stop polling its pipe, the supervisor respawns it
+                    with self.lock:
+                        if self.conns[conns[conn]] is conn:
+                            self.conns[conns[conn]] = None
+                    conn.close()
+                    continue
+                if message[0] == "result":
+                    _, job_id, worker_id, ok, result = message
+                    self.jobs_done[worker_id] += 1
+                    self._finish(job_id, ok, result)
+                elif message[0] == "ready":
+                    self.worker_info = message[2]
+                    self.ready.add(message[1])
+                    if len(self.ready) == self.num_workers:
+                        self.all_ready.set()
+                elif message[0] == "failed":
+                    # Model load failed: restarting would fail the same way
+                    self.failed = message[2]
+                    self.all_ready.set()
+
+    def _supervise_loop(self):
+        while True:
+            time.sleep(1.0)
+            if self.closed:
+                return
+            if self.failed:
+                continue
+            for worker_id, proc in enumerate(self.procs):
+                if proc.is_alive():
+                    continue
+                print(f"Inference worker {worker_id} died (exit code {proc.exitcode}), restarting")
+                self.ready.discard(worker_id)
+                self.restarts += 1
+                for job_id in self._spawn(worker_id):
+                    self._finish(job_id, False, f"worker {worker_id} crashed")
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+            free_slots = sum(len(slots) for slots in self.free_slots)
+        return {
+            "workers": self.num_workers,
+            "alive": sum(1 for proc in self.procs if proc.is_alive()),
+            "ready": len(self.ready),
+            "restarts": self.restarts,
+            "jobs_done": list(self.jobs_done),
+            "pending": pending,
+            "free_slots": free_slots,
+        }
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for tasks in self.tasks:
+            tasks.put(None)
+        for proc in self.procs:
+            proc.join(timeout=2)
+        self.shm.close()
+        self.shm.unlink()
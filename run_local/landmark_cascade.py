@@ -0,0 +1,172 @@
+import threading
+
+import numpy as np
+
+# ==========================================
+# LANDMARK CASCADE (FAST PATH BEFORE THE CNN)
+# ==========================================
+# Cheap geometry from MediaPipe Face Mesh landmarks (with refine_landmarks,
+# so the iris points 468-477 exist). Obvious faces -- turned away, looking
+# down, or squarely facing the front with open eyes -- are decided here;
+# everything in between still goes to the TFLite CNN.
+#
+# All features are ratios of landmark distances, so they do not depend on
+# face size or image resolution:
+#   yaw        nose tip position between the outer eye corners, -0.5..0.5 (0 = frontal)
+#   pitch      nose tip position between eye line and mouth line (larger = head down)
+#   gaze_x/y   iris centre within the eye opening, -0.5..0.5 (0 = centred)
+#   openness   eye aspect ratio (vertical lid gap / eye width), ~0.3 open, < 0.15 closed
+
+NOSE_TIP = 1
+MOUTH_LEFT, MOUTH_RIGHT = 61, 291
+# Eye contour points: outer corner, two upper lid, inner corner, two lower lid
+LEFT_EYE = (33, 160, 158, 133, 153, 144)
+RIGHT_EYE = (263, 387, 385, 362, 380, 373)
+LEFT_IRIS, RIGHT_IRIS = 468, 473
+MIN_LANDMARKS = 478
+
+# Decision thresholds (tune with CASCADE_MODE = "shadow", see /cascade_stats)
+YAW_AWAY = 0.28          # |yaw| above this: head turned away
+PITCH_DOWN = 0.80        # pitch above this: looking down (desk / phone)
+YAW_FRONTAL = 0.10       # "engaged" needs |yaw| below this...
+PITCH_NEUTRAL = (0.35, 0.65)  # ...pitch in this band...
+GAZE_CENTRED = 0.15      # ...|gaze_x| below this...
+EYES_OPEN = 0.20         # ...and eyes this open (closed eyes could be a blink: left to the CNN)
+
+# Scores published when the cascade decides (highly / engaged / barely / not engaged)
+DECISION_SCORES = {
+    "engaged": [0.35, 0.55, 0.08, 0.02],
+    "not_engaged": [0.02, 0.08, 0.25, 0.65],
+}
+
+
+def _eye_features(points, eye, iris):
+    outer, up1, up2, inner, low1, low2 = (points[i] for i in eye)
+    width = np.linalg.norm(inner - outer)
+    if width == 0:
+        return None
+    openness = (np.linalg.norm(up1 - low2) + np.linalg.norm(up2 - low1)) / (2 * width)
+
+    # Iris centre along the corner-to-corner axis, and between the lids
+    axis = (inner - outer) / width
+    gaze_x = np.dot(points[iris] - outer, axis) / width - 0.5
+    upper, lower = (up1 + up2) / 2, (low1 + low2) / 2
+    lid_gap = lower[1] - upper[1]
+    gaze_y = (points[iris][1] - upper[1]) / lid_gap - 0.5 if lid_gap > 0 else 0.0
+    return openness, gaze_x, gaze_y
+
+
+def geometric_features(landmarks):
+    """
+    landmarks: (N, 2) array of x, y in pixels (not the 0..1 normalized
+    values, or non-square crops would skew the ratios). Returns a dict or
+    None if the mesh has no iris points.
+    """
+    if len(landmarks) < MIN_LANDMARKS:
+        return None
+    points = np.asarray(landmarks, dtype=np.float64)
+
+    left_outer, right_outer = points[LEFT_EYE[0]], points[RIGHT_EYE[0]]
+    eye_span = right_outer[0] - left_outer[0]
+    if eye_span == 0:
+        return None
+    nose = points[NOSE_TIP]
+    yaw = (nose[0] - left_outer[0]) / eye_span - 0.5
+
+    eye_line = (left_outer[1] + right_outer[1]) / 2
+    mouth_line = (points[MOUTH_LEFT][1] + points[MOUTH_RIGHT][1]) / 2
+    face_height = mouth_line - eye_line
+    pitch = (nose[1] - eye_line) / face_height if face_height > 0 else 1.0
+
+    left = _eye_features(points, LEFT_EYE, LEFT_IRIS)
+    right = _eye_features(points, RIGHT_EYE, RIGHT_IRIS)
+    if left is None or right is None:
+        return None
+    # Gaze x is measured outer -> inner on each eye; flip one so both mean "towards image right"
+    return {
+        "yaw": float(yaw),
+        "pitch": float(pitch),
+        "gaze_x": float((left[1] - right[1]) / 2),
+        "gaze_y": float((left[2] + right[2]) / 2),
+        "openness": float((left[0] + right[0]) / 2),
+    }
+
+
+def decide(features):
+    """'engaged', 'not_engaged', or None when the face is ambiguous (-> CNN)."""
+    if features is None:
+        return None
+    if abs(features["yaw"]) > YAW_AWAY or features["pitch"] > PITCH_DOWN:
+        return "not_engaged"
+    if (abs(features["yaw"]) < YAW_FRONTAL
+            and PITCH_NEUTRAL[0] <= features["pitch"] <= PITCH_NEUTRAL[1]
+            and abs(features["gaze_x"]) < GAZE_CENTRED
+            and features["openness"] > EYES_OPEN):
+        return "engaged"
+    return None
+
+
+def label_of(scores):
+    """Collapses the CNN's 4 classes to the cascade's 2."""
+    return "engaged" if scores[0] + scores[1] >= scores[2] + scores[3] else "not_engaged"
+
+
+class CascadeStats:
+    """
+    Hit rate of the cascade and how it compares with the CNN-only path.
+    Compared decisions come from audits (a sample of cascade hits also run
+    through the CNN) or, in shadow mode, from every face. Thread-safe.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.faces = 0
+        self.decided = {"engaged": 0, "not_engaged": 0}
+        self.ambiguous = 0
+        self.no_landmarks = 0
+        self.compared = 0
+        self.agreed = 0
+        self.engaged_delta_sum = 0.0   # |cascade engaged% - CNN engaged%|, summed
+        self.confusion = {}            # "cascade->cnn" -> count
+        self.cascade_seconds = 0.0
+
+    def record(self, decision, features, seconds):
+        with self.lock:
+            self.faces += 1
+            self.cascade_seconds += seconds
+            if features is None:
+                self.no_landmarks += 1
+            elif decision is None:
+                self.ambiguous += 1
+            else:
+                self.decided[decision] += 1
+
+    def compare(self, decision, cnn_scores):
+        cnn_label = label_of(cnn_scores)
+        cascade_scores = DECISION_SCORES[decision]
+        delta = abs((cascade_scores[0] + cascade_scores[1]) - (cnn_scores[0] + cnn_scores[1])) * 100
+        with self.lock:
+            self.compared += 1
+            self.agreed += cnn_label == decision
+            self.engaged_delta_sum += delta
+            key = f"{decision}->{cnn_label}"
+            self.confusion[key] = self.confusion.get(key, 0) + 1
+
+    def report(self):
+        with self.lock:
+            hits = sum(self.decided.values())
+            hit_rate = hits / self.faces if self.faces else 0.0
+            agreement = self.agreed / self.compared if self.compared else None
+            return {
+                "faces": self.faces,
+                "hit_rate": round(hit_rate, 4),
+                "decided": dict(self.decided),
+                "ambiguous": self.ambiguous,
+                "no_landmarks": self.no_landmarks,
+                "cascade_ms_avg": round(self.cascade_seconds / self.faces * 1000, 2) if self.faces else None,
+                "compared_with_cnn": self.compared,
+                "cnn_agreement": round(agreement, 4) if agreement is not None else None,
+                # Share of ALL faces labelled differently than the CNN-only path would
+                "accuracy_delta": round(hit_rate * (1 - agreement), 4) if agreement is not None else None,
+                "engaged_pct_delta_avg": round(self.engaged_delta_sum / self.compared, 2) if self.compared else None,
+                "confusion": dict(self.confusion),
+            }
@@ -0,0 +1,71 @@
+import argparse
+import time
+
+import numpy as np
+
+from latency_trace import HOPS, CROSS_CLOCK, read_trace
+
+# ==========================================
+# LATENCY REPORT
+# ==========================================
+# Tracing is off by default; run both sides with ISKOMATE_TRACE_LOG set
+# (e.g. /tmp/iskomate_trace_pi.bin on the Pi, ./latency_trace.bin on the laptop).
+#
+# Usage:
+#   python latency_report.py /tmp/iskomate_trace_pi.bin latency_trace.bin
+#   python latency_report.py /tmp/iskomate_trace_pi.bin --last 300
+#
+# Pass the Pi's log and (optionally) local_server's log. Spans of the same
+# frame are joined by their trace key, which also gives the derived
+# "network" hop (upload round trip minus server time).
+
+
+def percentiles_ms(values):
+    values = np.asarray(values, dtype=np.float64) * 1000
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"count": len(values), "mean": values.mean(), "p50": p50, "p90": p90, "p99": p99, "max": values.max()}
+
+
+def build_report(records):
+    rows = []
+    durations = records["end"] - records["start"]
+    for code, name in enumerate(HOPS):
+        selected = durations[records["hop"] == code]
+        if len(selected):
+            rows.append((name + (" *" if name in CROSS_CLOCK else ""), percentiles_ms(selected)))
+
+    # network = upload round trip - server_total, for frames traced on both sides
+    upload = records[records["hop"] == HOPS.index("upload")]
+    server = records[records["hop"] == HOPS.index("server_total")]
+    if len(upload) and len(server):
+        server_time = {(int(r["capture_ms"]), int(r["frame_id"])): r["end"] - r["start"] for r in server}
+        network = [r["end"] - r["start"] - server_time[key] for r in upload
+                   if (key := (int(r["capture_ms"]), int(r["frame_id"]))) in server_time]
+        if network:
+            rows.append(("network (derived)", percentiles_ms(network)))
+    return rows
+
+
+def print_report(rows, frames):
+    print(f"Frames traced: {frames}")
+    print(f"{'hop':<20}{'count':>8}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}   (ms)")
+    for name, s in rows:
+        print(f"{name:<20}{s['count']:>8}{s['mean']:>9.1f}{s['p50']:>9.1f}{s['p90']:>9.1f}{s['p99']:>9.1f}{s['max']:>9.1f}")
+    if any(name.endswith(" *") for name, _ in rows):
+        print("* compares the laptop's clock with the Pi's; only meaningful with NTP-synced clocks")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-hop latency percentiles from trace logs")
+    parser.add_argument("logs", nargs="+", help="Trace log files (Pi and/or local_server)")
+    parser.add_argument("--last", type=float, default=None, help="Only frames captured in the last N seconds")
+    args = parser.parse_args()
+
+    records = np.concatenate([read_trace(path) for path in args.logs])
+    if args.last is not None:
+        records = records[records["capture_ms"] >= (time.time() - args.last) * 1000]
+    if len(records) == 0:
+        print("No trace records.")
+    else:
+        frames = len(set(zip(records["capture_ms"].tolist(), records["frame_id"].tolist())))
+        print_report(build_report(records), frames)
@@ -0,0 +1,106 @@
+import atexit
+import multiprocessing as mp
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+# ==========================================
+# GLASS-TO-LCD LATENCY TRACE
+# ==========================================
+# Every frame gets a trace key on the Pi: (capture time in ms, camera frame id).
+# The key travels with the upload, comes back inside the published result,
+# and each hop appends one fixed-width span record to its process's log:
+#
+#   capture_ms u8 | frame_id u4 | hop u2 | pad u2 | start f8 | end f8   (32 bytes)
+#
+# start/end are time.time() on the machine that wrote the record. Spans
+# marked CROSS_CLOCK compare the laptop's clock with the Pi's and are only
+# as good as NTP between them; everything else uses one clock.
+
+HOPS = (
+    "capture_wait",     # Pi: frame captured -> picked up by the uploader
+    "encode",           # Pi: JPEG / face-crop encoding
+    "upload",           # Pi: POST round trip (includes the server)
+    "edge_inference",   # Pi: on-device classification instead of uploading
+    "server_decode",    # local_server: JPEG decode (or face crops)
+    "server_detect",    # local_server: face detection
+    "server_classify",  # local_server: classifier (or cache lookup)
+    "server_total",     # local_server: request received -> result published
+    "publish_to_pi",    # result published -> received by the Pi (CROSS_CLOCK)
+    "alert_decision",   # Pi: result received -> alert scheduler decided
+    "lcd_update",       # Pi: result received -> LCD pixels written
+    "glass_to_logic",   # Pi: capture -> _handle_logic
+    "glass_to_lcd",     # Pi: capture -> LCD pixels written
+)
+HOP_CODES = {name: i for i, name in enumerate(HOPS)}
+CROSS_CLOCK = {"publish_to_pi"}
+
+RECORD = struct.Struct("<QIHxxdd")
+RECORD_DTYPE = np.dtype([("capture_ms", "<u8"), ("frame_id", "<u4"), ("hop", "<u2"), ("pad", "<u2"),
+                         ("start", "<f8"), ("end", "<f8")])
+
+
+def trace_key(data):
+    """(capture_ms, frame_id) from a form or result dict, or None when the frame is untraced."""
+    try:
+        return int(data["capture_ts"]), int(data["frame_id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TraceLog:
+    """
+    Append-only span log. path=None disables it (span() becomes a no-op).
+    Records are buffered and flushed in batches to keep writes off the hot path;
+    the last batch is written at exit (the spans around a shutdown matter most).
+    """
+    def __init__(self, path=None, flush_every=64, flush_interval=1.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.last_flush = time.time()
+        self.file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, "ab")
+            # Main process only: a child process never owns the log
+            if mp.parent_process() is None:
+                atexit.register(self.close)
+
+    def span(self, key, hop, start, end=None):
+        if self.file is None or key is None:
+            return
+        end = time.time() if end is None else end
+        record = RECORD.pack(key[0], key[1] & 0xFFFFFFFF, HOP_CODES[hop], start, end)
+        with self.lock:
+            if self.file is None:
+                return  # Closed meanwhile
+            self.buffer.append(record)
+            if len(self.buffer) >= self.flush_every or end - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        self.file.write(b"".join(self.buffer))
+        self.file.flush()
+        self.buffer.clear()
+        self.last_flush = time.time()
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self._flush()
+            self.file.close()
+            self.file = None
+
+
+def read_trace(path):
+    """All complete records of a trace log as a NumPy structured array."""
+    raw = np.fromfile(path, dtype=np.uint8)
+    usable = len(raw) - len(raw) % RECORD_DTYPE.itemsize
+    return raw[:usable].view(RECORD_DTYPE)
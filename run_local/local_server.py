@@ -1,13 +1,30 @@
+import time
+PROCESS_START = time.time() # For time-to-first-inference reporting
+
 import numpy as np
-import tensorflow.lite as tflite 
 import cv2
 import firebase_admin
 from firebase_admin import credentials, db
-from flask import Flask, request, jsonify
-import mediapipe as mp
-import time
+from flask import Flask, request, jsonify, Response
 import os
+import json
+import itertools
+import functools
+import queue
+import threading
 import socket # Used to find your IP address automatically
+try:
+    # Optional: lets us decode just the face region of a big JPEG
+    from turbojpeg import TurboJPEG
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
+from score_store import ScoreStore, ROLLUP_LEVELS
+from result_cache import ResultCache, dhash
+from latency_trace import TraceLog, trace_key
+from inference_workers import WorkerPool, PoolBusy
+import engagement_models as models
+from landmark_cascade import CascadeStats, DECISION_SCORES, decide
 
 # ==========================================
 # CONFIGURATION
@@ -17,18 +34,66 @@ MODEL_PATH = "./engagement_model_quantized.tflite"
 KEY_PATH = "serviceAccountKey.json"
 FIREBASE_URL = "https://iskomate-f149c-default-rtdb.asia-southeast1.firebasedatabase.app/"
 
+# Results are pushed to the Pi over /stream (LAN, instant).
+# Firebase is only a mirror for the app, written at most once per interval.
+FIREBASE_MIRROR_INTERVAL = 1.0 # Seconds
+STREAM_KEEPALIVE = 15          # Seconds between keep-alive comments on idle streams
+
+# Per-frame score history (append-only column files + 1s/1m/1h rollups)
+HISTORY_DIR = "./engagement_history"
+
+# Model input normalization and color order: see engagement_models.py
+
+# Two-resolution decode: detection runs on a JPEG decoded at 1/2, 1/4 or 1/8
+# size (libjpeg DCT scaling), as long as it stays at least this wide.
+DETECTION_MIN_WIDTH = 320
+
+# Near-duplicate frame cache (perceptual hash of the downscaled frame / face crop)
+CACHE_TTL = 2.0               # Seconds a cached result may be reused
+CACHE_MAX_ENTRIES = 512
+CACHE_MAX_BYTES = 1024 * 1024
+CACHE_HASH_SIZE = 16          # 16x16 = 256-bit dHash
+CACHE_MAX_DISTANCE = 8        # Bits that may differ and still count as "the same frame"
+CACHE_FACES = True            # Also cache per face crop (catches static faces in moving scenes)
+
+# Multi-process inference: N worker processes, each with its own detector + interpreter.
+# 0 = everything in this process (one inference at a time).
+INFERENCE_WORKERS = int(os.environ.get("ISKOMATE_WORKERS", "0"))
+WORKER_TFLITE_THREADS = 1     # Per worker; the workers themselves use the cores
+WORKER_SLOT_BYTES = 8 * 1024 * 1024  # Shared-memory slot per in-flight image (fits 1080p BGR)
+
+# Landmark cascade in front of the CNN (see landmark_cascade.py):
+#   "on"     = obvious faces decided from Face Mesh geometry, CNN only for ambiguous ones
+#   "shadow" = always publish the CNN's scores, but run and compare the cascade (for tuning)
+#   "off"    = CNN only
+# Default "shadow" until the thresholds are tuned: published scores stay the CNN's
+CASCADE_MODE = os.environ.get("ISKOMATE_CASCADE", "shadow")
+CASCADE_AUDIT_EVERY = 20      # In "on" mode, also run the CNN on every Nth cascade decision
+
+# Per-hop latency spans for frames the Pi traced (read with latency_report.py).
+# Off by default (the log is never rotated); enable with ISKOMATE_TRACE_LOG=./latency_trace.bin
+TRACE_LOG = os.environ.get("ISKOMATE_TRACE_LOG", "")
+
 # ==========================================
 # 1. FIREBASE SETUP
 # ==========================================
-if not firebase_admin._apps:
-    cred = credentials.Certificate(KEY_PATH)
-    firebase_admin.initialize_app(cred, {
-        'databaseURL': FIREBASE_URL
-    })
+# References to database locations (set by init_firebase, off the startup path)
+firebase_stats_ref = None
+firebase_config_ref = None
 
-# References to database locations
-firebase_stats_ref = db.reference('aiResult/engagement_stats')
-firebase_config_ref = db.reference('server_config')
+def init_firebase():
+    global firebase_stats_ref, firebase_config_ref
+    try:
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(KEY_PATH)
+            firebase_admin.initialize_app(cred, {
+                'databaseURL': FIREBASE_URL
+            })
+        firebase_stats_ref = db.reference('aiResult/engagement_stats')
+        firebase_config_ref = db.reference('server_config')
+    except Exception as e:
+        # Inference and the Pi push stream still work without Firebase
+        print(f"Firebase Setup Failed: {e}")
 
 # ==========================================
 # 2. AUTOMATIC IP CONFIGURATION
@@ -64,29 +129,154 @@ def update_ip_on_firebase():
         print(f"CRITICAL ERROR: Could not find IP or update Firebase: {e}")
 
 # ==========================================
-# 3. LOAD MODELS
+# 3. LOAD MODELS (IN THE BACKGROUND)
 # ==========================================
-print("Loading MediaPipe Face Detection...")
-mp_face_detection = mp.solutions.face_detection
-face_detection = mp_face_detection.FaceDetection(min_detection_confidence=0.5)
+# The server binds first; models, Firebase and warm-up happen in parallel.
+# /ready answers 503 and /process_frame refuses frames until warm-up is done.
+# The models themselves live in engagement_models.py (no import side effects,
+# so spawned workers can load them without re-running this server's setup).
+tflite_runtime_name = None
+classifier_input_size = None  # (h, w); known in worker mode even though this process has no classifier
+worker_pool = None
 
-print(f"Loading TFLite Model from {MODEL_PATH}...")
-try:
-    interpreter = tflite.Interpreter(model_path=MODEL_PATH)
-    interpreter.allocate_tensors()
-    input_details = interpreter.get_input_details()
-    output_details = interpreter.get_output_details()
-    print("Model Loaded Successfully!")
-except Exception as e:
-    print(f"CRITICAL ERROR: Could not load model. Is '{MODEL_PATH}' in this folder? {e}")
-    exit()
-
-def softmax(x):
-    e_x = np.exp(x - np.max(x))
-    return e_x / e_x.sum()
+models_ready = threading.Event()
+startup_timings = {}
+first_inference_done = False
+
+def timed(name, fn):
+    start = time.time()
+    fn()
+    startup_timings[name] = round(time.time() - start, 3)
+
+def start_workers():
+    global worker_pool, classifier_input_size, tflite_runtime_name
+    print(f"Starting {INFERENCE_WORKERS} inference worker processes...")
+    init = functools.partial(models.worker_init, MODEL_PATH, CASCADE_MODE != "off", WORKER_TFLITE_THREADS)
+    worker_pool = WorkerPool(INFERENCE_WORKERS, init, models.WORKER_HANDLERS, slot_bytes=WORKER_SLOT_BYTES)
+    worker_pool.all_ready.wait()
+    if worker_pool.failed:
+        print(f"CRITICAL ERROR: Worker could not load models: {worker_pool.failed}")
+        os._exit(1)
+    classifier_input_size = tuple(worker_pool.worker_info["input_size"])
+    tflite_runtime_name = worker_pool.worker_info["runtime"]
+
+def startup():
+    global classifier_input_size, tflite_runtime_name
+    if INFERENCE_WORKERS > 0:
+        # Workers first: this process never imports MediaPipe/TFLite
+        firebase_thread = threading.Thread(target=timed, args=("firebase_s", init_firebase), daemon=True)
+        firebase_thread.start()
+        timed("workers_s", start_workers)
+        firebase_thread.join()
+    else:
+        loaders = [threading.Thread(target=timed, args=(name, fn), daemon=True)
+                   for name, fn in (("firebase_s", init_firebase),
+                                    ("detector_s", models.load_detector),
+                                    ("classifier_s", lambda: models.load_classifier(MODEL_PATH)))]
+        if CASCADE_MODE != "off":
+            loaders.append(threading.Thread(target=timed, args=("face_mesh_s", models.load_face_mesh), daemon=True))
+        for t in loaders:
+            t.start()
+        for t in loaders:
+            t.join()
+
+        missing = [name for name, ok in (
+            (f"TFLite model (is '{MODEL_PATH}' in this folder?)", models.classifier is not None),
+            ("MediaPipe Face Detection", models.face_detection is not None),
+            ("MediaPipe Face Mesh (set ISKOMATE_CASCADE=off to run without it)",
+             CASCADE_MODE == "off" or models.face_mesh is not None)) if not ok]
+        if missing:
+            print(f"CRITICAL ERROR: Could not load: {', '.join(missing)}")
+            os._exit(1)
+
+        timed("warm_up_s", models.warm_up)
+        classifier_input_size = (models.classifier.target_h, models.classifier.target_w)
+        tflite_runtime_name = models.runtime_name
+    startup_timings["ready_s"] = round(time.time() - PROCESS_START, 3)
+    models_ready.set()
+    print(f"--> READY in {startup_timings['ready_s']:.2f}s after launch {startup_timings}")
+
+    # Tell the Pi where we are only once we can actually serve it
+    update_ip_on_firebase()
+
+# ==========================================
+# 4. RESULT PUBLISHING (PUSH STREAM + FIREBASE MIRROR)
+# ==========================================
+stream_subscribers = []
+subscribers_lock = threading.Lock()
+
+mirror_lock = threading.Lock()
+pending_mirror = None  # (method, data) waiting to be written to Firebase
+
+def publish_result(data, method="set"):
+    """
+    Sends a result to every connected Pi right away and queues it for the
+    Firebase mirror. Never blocks the request on the network.
+    """
+    global pending_mirror
+    message = json.dumps(data)
+    with subscribers_lock:
+        for q in stream_subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Slow subscriber: drop its oldest result, the newest matters most
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait(message)
+
+    with mirror_lock:
+        # An "update" must not downgrade a pending full "set"
+        if method == "update" and pending_mirror is not None and pending_mirror[0] == "set":
+            pending_mirror[1].update(data)
+        else:
+            pending_mirror = (method, dict(data))
+
+def firebase_mirror_loop():
+    """Writes only the latest result to Firebase, at most once per interval."""
+    global pending_mirror
+    while True:
+        time.sleep(FIREBASE_MIRROR_INTERVAL)
+        with mirror_lock:
+            item, pending_mirror = pending_mirror, None
+        if item is None:
+            continue
+        method, data = item
+        if firebase_stats_ref is None:
+            continue
+        try:
+            if method == "set":
+                firebase_stats_ref.set(data)
+            else:
+                firebase_stats_ref.update(data)
+        except Exception as e:
+            print(f"Firebase mirror error: {e}")
+
+# Created by start_services(), in the server process only: spawned workers
+# re-import this file, and must not open the history/trace files or write Firebase
+score_store = None
+result_cache = None
+trace_log = None
+
+cascade_stats = CascadeStats()
+cascade_audits = itertools.count()
+
+def start_services():
+    global score_store, result_cache, trace_log
+    threading.Thread(target=firebase_mirror_loop, daemon=True).start()
+
+    # Firebase only keeps the latest result; the full history lives on disk here
+    score_store = ScoreStore(HISTORY_DIR)
+
+    result_cache = ResultCache(ttl_s=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES,
+                               max_bytes=CACHE_MAX_BYTES, max_distance=CACHE_MAX_DISTANCE)
+
+    trace_log = TraceLog(TRACE_LOG or None)
 
 # ==========================================
-# 4. FLASK SERVER
+# 5. FLASK SERVER
 # ==========================================
 app = Flask(__name__)
 
@@ -94,85 +284,379 @@ app = Flask(__name__)
 def home():
     return "Iskomate Local Laptop Server is Running!"
 
+@app.route('/ready')
+def ready():
+    """503 until models are loaded and warm. Lets scripts wait for a restart."""
+    if not models_ready.is_set():
+        return jsonify({"status": "warming_up",
+                        "uptime_s": round(time.time() - PROCESS_START, 3)}), 503
+    return jsonify({"status": "ready", "runtime": tflite_runtime_name, "timings": startup_timings,
+                    "workers": worker_pool.stats() if worker_pool else None})
+
+@app.route('/stream')
+def stream():
+    """
+    Server-sent events: one `data:` line per result.
+    The Pi keeps this open and reacts within milliseconds of inference.
+    """
+    q = queue.Queue(maxsize=10)
+    with subscribers_lock:
+        stream_subscribers.append(q)
+    print(f"Stream subscriber connected: {request.remote_addr}")
+
+    def events():
+        try:
+            while True:
+                try:
+                    yield f"data: {q.get(timeout=STREAM_KEEPALIVE)}\n\n"
+                except queue.Empty:
+                    # Comment line keeps proxies happy and detects dead clients
+                    yield ": keepalive\n\n"
+        finally:
+            with subscribers_lock:
+                stream_subscribers.remove(q)
+            print("Stream subscriber disconnected")
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({"status": "success", "data": result_cache.stats()})
+
+@app.route('/cascade_stats')
+def cascade_stats_route():
+    """Cascade hit rate and agreement with the CNN-only path."""
+    return jsonify({"status": "success", "mode": CASCADE_MODE, "data": cascade_stats.report()})
+
+@app.route('/history')
+def history():
+    """
+    Time-range aggregate of the stored scores.
+    Query args (ms since epoch): start, end, optional camera, level (raw/1s/1m/1h), series=1
+    Defaults to the last hour.
+    """
+    try:
+        end = int(request.args.get('end', time.time() * 1000))
+        start = int(request.args.get('start', end - 60 * 60 * 1000))
+        camera = request.args.get('camera')
+        camera = int(camera) if camera is not None else None
+        level = request.args.get('level')
+    except ValueError:
+        return jsonify({"status": "error", "message": "start/end/camera must be integers"}), 400
+
+    if level is not None and level not in ["raw"] + [name for name, _ in ROLLUP_LEVELS]:
+        return jsonify({"status": "error", "message": f"Unknown level '{level}'"}), 400
+    if end <= start:
+        return jsonify({"status": "error", "message": "end must be after start"}), 400
+
+    data = score_store.query(start, end, camera_id=camera, level=level,
+                             series=request.args.get('series') == '1')
+    return jsonify({"status": "success", "data": data})
+
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def find_sof(buf):
+    """Offset of the JPEG SOF marker (frame header), or None."""
+    if buf[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(buf):
+        if buf[i] != 0xFF:
+            i += 1
+            continue
+        marker = buf[i + 1]
+        if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2 if marker != 0xFF else 1
+            continue
+        # SOF0..SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return i
+        i += 2 + int.from_bytes(buf[i + 2:i + 4], 'big')
+    return None
+
+def jpeg_dimensions(buf):
+    """(width, height) from the JPEG SOF header without decoding, or None."""
+    i = find_sof(buf)
+    if i is None:
+        return None
+    height = int.from_bytes(buf[i + 5:i + 7], 'big')
+    width = int.from_bytes(buf[i + 7:i + 9], 'big')
+    return width, height
+
+def jpeg_mcu_size(buf):
+    """
+    (width, height) of one MCU in pixels: 8 x the largest sampling factor,
+    e.g. 16x16 for 4:2:0, 16x8 for 4:2:2, 8x8 for 4:4:4 and grayscale.
+    """
+    i = find_sof(buf)
+    components = buf[i + 9] if i is not None and i + 9 < len(buf) else 0
+    factors = buf[i + 11:i + 10 + 3 * components:3] if components else b''
+    if len(factors) != components or not components:
+        return 16, 16  # Unreadable header: the coarsest common grid
+    return 8 * max(f >> 4 for f in factors), 8 * max(f & 0x0F for f in factors)
+
+# camera id -> (w, h) of its last detected face, in full-resolution pixels
+last_face_size = {}
+
+def pick_reduction(width, face_size=None):
+    """
+    Largest DCT scale factor that keeps the detection image wide enough and,
+    when the camera's face size is known, the face big enough for the
+    classifier -- so one reduced decode is usually all a frame needs.
+    """
+    for factor in (8, 4, 2):
+        if width // factor < DETECTION_MIN_WIDTH:
+            continue
+        if face_size is not None and classifier_input_size is not None and (
+                face_size[0] // factor < classifier_input_size[1]
+                or face_size[1] // factor < classifier_input_size[0]):
+            continue
+        return factor
+    return 1
+
+def relative_to_pixels(rel_box, width, height):
+    """MediaPipe relative box -> clipped (x, y, w, h) in pixels of a width x height image."""
+    xmin, ymin, rel_w, rel_h = rel_box
+    x, y = max(0, int(xmin * width)), max(0, int(ymin * height))
+    w_box, h_box = int(rel_w * width), int(rel_h * height)
+    return x, y, min(w_box, width - x), min(h_box, height - y)
+
+def decode_face_region(buf, rel_box, full_size):
+    """
+    Full-resolution pixels of just the face.
+    With turbojpeg: lossless JPEG crop (MCU aligned) and decode only that.
+    Without it: one full decode, still no full-frame color conversion.
+    """
+    x, y, w_box, h_box = relative_to_pixels(rel_box, *full_size)
+    if turbo_jpeg is not None:
+        try:
+            # Crop origin must sit on this JPEG's MCU grid (depends on its chroma subsampling)
+            mcu_w, mcu_h = jpeg_mcu_size(buf)
+            ax, ay = x - x % mcu_w, y - y % mcu_h
+            aw = min(full_size[0] - ax, w_box + (x - ax))
+            ah = min(full_size[1] - ay, h_box + (y - ay))
+            region = turbo_jpeg.decode(turbo_jpeg.crop(buf, ax, ay, aw, ah))
+            return region[y - ay:y - ay + h_box, x - ax:x - ax + w_box]
+        except Exception:
+            pass
+    frame = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+    return frame[y:y+h_box, x:x+w_box]
+
+def decode_face_crops(req):
+    """
+    Face-crop upload from the Pi: a padded JPEG crop of the largest face in
+    'faces' and a JSON 'boxes' list of every face, in frame pixels; the first
+    is {"crop": [x, y, w, h], "face": [x, y, w, h]}, the rest only "face".
+    Detection already happened on the Pi, so we only cut the tight face box
+    out of the first crop. Returns (face crop or None, face count).
+    """
+    boxes = json.loads(req.form.get('boxes', '[]'))
+    crops = req.files.getlist('faces')
+    if not boxes or not crops:
+        return None, 0
+
+    crop = cv2.imdecode(np.frombuffer(crops[0].read(), np.uint8), cv2.IMREAD_COLOR)
+    if crop is None:
+        raise ValueError("Could not decode face crop")
+
+    cx, cy, _, _ = boxes[0]["crop"]
+    fx, fy, fw, fh = boxes[0]["face"]
+    x, y = max(0, fx - cx), max(0, fy - cy)
+    return crop[y:y+fh, x:x+fw], len(boxes)
+
+# MediaPipe and the TFLite interpreter are not thread-safe; Flask is threaded
+inference_lock = threading.Lock()
+
+def run_detect(frame):
+    """(relative face box or None, face count), in a worker process when there are any."""
+    if worker_pool is not None:
+        return worker_pool.run("detect", frame)
+    with inference_lock:
+        return models.detect_face(frame)
+
+def run_classify(face_img):
+    if worker_pool is not None:
+        return worker_pool.run("classify", face_img)
+    with inference_lock:
+        return models.classify_scores(face_img)
+
+def run_landmarks(face_img):
+    if worker_pool is not None:
+        return worker_pool.run("landmarks", face_img)
+    with inference_lock:
+        return models.landmark_features(face_img)
+
+def classify_face(face_img):
+    """Scores for one face crop and what produced them ("cascade" or "cnn")."""
+    if CASCADE_MODE == "off":
+        return run_classify(face_img), "cnn"
+
+    start = time.time()
+    features = run_landmarks(face_img)
+    decision = decide(features)
+    cascade_stats.record(decision, features, time.time() - start)
+    if decision is None:
+        return run_classify(face_img), "cnn"
+
+    if CASCADE_MODE == "shadow":
+        scores = run_classify(face_img)
+        cascade_stats.compare(decision, scores)
+        return scores, "cnn"
+
+    # Keep measuring how often the fast path disagrees with the CNN
+    if next(cascade_audits) % CASCADE_AUDIT_EVERY == 0:
+        cascade_stats.compare(decision, run_classify(face_img))
+    return list(DECISION_SCORES[decision]), "cascade"
+
+def with_trace(data, trace, received_at):
+    """Echoes the Pi's trace key in the result and logs the server's share of the latency."""
+    if trace is not None:
+        data["capture_ts"], data["frame_id"] = trace
+        trace_log.span(trace, "server_total", received_at, data["timestamp"] / 1000)
+    return data
+
+def report_no_face(trace=None, received_at=None):
+    # Update Firebase even if no face, so app knows system is alive
+    data = {"status": "No Face Detected", "timestamp": int(time.time()*1000)}
+    publish_result(with_trace(data, trace, received_at), method="update")
+    print("No face detected")
+    return jsonify({"status": "no_face"})
+
+def report_scores(scores, face_count, camera_id, cached=False, trace=None, received_at=None, decided_by="cnn"):
+    global first_inference_done
+
+    # Push Results to the Pi (and the Firebase mirror)
+    data = {
+        "highly_engaged": float(scores[0] * 100),
+        "engaged": float(scores[1] * 100),
+        "barely_engaged": float(scores[2] * 100),
+        "not_engaged": float(scores[3] * 100),
+        "faces": face_count,
+        "timestamp": int(time.time() * 1000),
+        "status": "Tracking"
+    }
+    publish_result(with_trace(data, trace, received_at))
+    score_store.append(data["timestamp"], data, face_count, camera_id=camera_id)
+    
+    if not first_inference_done:
+        first_inference_done = True
+        startup_timings["first_inference_s"] = round(time.time() - PROCESS_START, 3)
+        print(f"--> Time to first inference: {startup_timings['first_inference_s']:.2f}s")
+
+    # Local Debug Print
+    print(f"Processed{' (cached)' if cached else ''}{' (cascade)' if decided_by == 'cascade' else ''}: "
+          f"Engaged {data['engaged']:.1f}%")
+    
+    return jsonify({"status": "success", "data": data, "cached": cached, "decided_by": decided_by})
+
 @app.route('/process_frame', methods=['POST'])
 def process_frame():
+    if not models_ready.is_set():
+        return jsonify({"status": "warming_up"}), 503
+
     try:
-        # Check if image was sent
-        if 'image' not in request.files:
-            return jsonify({"status": "no_image"}), 400
+        received_at = time.time()
+        trace = trace_key(request.form)  # None unless the Pi traces this frame
+        camera_id = int(request.form.get('camera_id', 0))
+        frame_key = None
+
+        if 'boxes' in request.form:
+            # Face-crop mode: the Pi already found the faces
+            face_img, face_count = decode_face_crops(request)
+            trace_log.span(trace, "server_decode", received_at)
+        else:
+            # Check if image was sent
+            if 'image' not in request.files:
+                return jsonify({"status": "no_image"}), 400
+                
+            file = request.files['image']
+            buf = file.read()
             
-        file = request.files['image']
-        
-        # Decode Image
-        npimg = np.frombuffer(file.read(), np.uint8)
-        frame = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
-
-        if frame is None:
-             return jsonify({"status": "error", "message": "Could not decode image"}), 400
-
-        # Face Detection (MediaPipe)
-        # Convert BGR (OpenCV) to RGB (MediaPipe)
-        results = face_detection.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-
-        if not results.detections:
-            # Update Firebase even if no face, so app knows system is alive
-            firebase_stats_ref.update({"status": "No Face Detected", "timestamp": int(time.time()*1000)})
-            print("No face detected")
-            return jsonify({"status": "no_face"})
-
-        # Crop Face logic
-        h, w, _ = frame.shape
-        bboxC = results.detections[0].location_data.relative_bounding_box
-        x, y = int(bboxC.xmin * w), int(bboxC.ymin * h)
-        w_box, h_box = int(bboxC.width * w), int(bboxC.height * h)
-        
-        # Ensure crop is within image bounds
-        x, y = max(0, x), max(0, y)
-        face_img = frame[y:y+h_box, x:x+w_box]
+            # Decode Image at reduced size for detection (DCT scaling, much cheaper),
+            # reduced only as far as this camera's faces stay classifier-sized
+            full_size = jpeg_dimensions(buf)
+            factor = pick_reduction(full_size[0], last_face_size.get(camera_id)) if full_size else 1
+            frame = cv2.imdecode(np.frombuffer(buf, np.uint8), REDUCED_DECODE_FLAGS[factor])
+
+            if frame is None:
+                 return jsonify({"status": "error", "message": "Could not decode image"}), 400
+            decoded_at = time.time()
+            trace_log.span(trace, "server_decode", received_at, decoded_at)
+
+            # Same scene as a moment ago? Reuse that result, skip detection + classification
+            frame_key = dhash(frame, CACHE_HASH_SIZE)
+            cached = result_cache.get(f"frame:{camera_id}", frame_key)
+            if cached is not None:
+                if cached["kind"] == "no_face":
+                    return report_no_face(trace, received_at)
+                return report_scores(cached["scores"], cached["face_count"], camera_id, cached=True,
+                                     trace=trace, received_at=received_at)
+
+            # Face Detection (MediaPipe)
+            rel_box, face_count = run_detect(frame)
+            trace_log.span(trace, "server_detect", decoded_at)
+
+            face_img = None
+            if rel_box is not None:
+                x, y, w_box, h_box = relative_to_pixels(rel_box, frame.shape[1], frame.shape[0])
+                face_img = frame[y:y+h_box, x:x+w_box]
+                last_face_size[camera_id] = (w_box * factor, h_box * factor)
+
+                # Too few pixels at reduced size for the classifier -> fetch the face at full
+                # resolution (rare: the next frame from this camera is decoded less reduced)
+                if factor > 1 and (h_box < classifier_input_size[0] or w_box < classifier_input_size[1]):
+                    face_img = decode_face_region(buf, rel_box, full_size)
+
+        if face_img is None:
+            if frame_key is not None:
+                result_cache.put(f"frame:{camera_id}", frame_key, {"kind": "no_face"})
+            return report_no_face(trace, received_at)
 
         if face_img.size == 0: return jsonify({"status": "crop_fail"})
 
-        # AI Inference (TFLite)
-        target_h, target_w = input_details[0]['shape'][1], input_details[0]['shape'][2]
-        resized_face = cv2.resize(face_img, (target_w, target_h))
-        
-        input_data = np.expand_dims(resized_face, axis=0)
-        
-        # Handle Float vs Int models automatically
-        if input_details[0]['dtype'] == np.float32:
-            input_data = np.float32(input_data)
-            # If your model expects 0-1 normalization, uncomment the next line:
-            # input_data = input_data / 255.0 
-
-        interpreter.set_tensor(input_details[0]['index'], input_data)
-        interpreter.invoke()
-        output_data = interpreter.get_tensor(output_details[0]['index'])[0]
-        scores = softmax(output_data)
-
-        # Update Results to Firebase
-        data = {
-            "highly_engaged": float(scores[0] * 100),
-            "engaged": float(scores[1] * 100),
-            "barely_engaged": float(scores[2] * 100),
-            "not_engaged": float(scores[3] * 100),
-            "timestamp": int(time.time() * 1000),
-            "status": "Tracking"
-        }
-        firebase_stats_ref.set(data)
-        
-        # Local Debug Print
-        print(f"Processed: Engaged {data['engaged']:.1f}%")
-        
-        return jsonify({"status": "success", "data": data})
+        # Same face as a moment ago? (works even when the rest of the scene moves)
+        classify_start = time.time()
+        face_key = dhash(face_img, CACHE_HASH_SIZE) if CACHE_FACES else None
+        scores = result_cache.get(f"face:{camera_id}", face_key) if CACHE_FACES else None
+        cached = scores is not None
+        decided_by = "cnn"
+        if not cached:
+            # Landmark cascade first; the CNN only for faces it can't call
+            scores, decided_by = classify_face(face_img)
+            if CACHE_FACES:
+                result_cache.put(f"face:{camera_id}", face_key, scores)
+        trace_log.span(trace, "server_classify", classify_start)
+
+        if frame_key is not None:
+            result_cache.put(f"frame:{camera_id}", frame_key,
+                             {"kind": "scores", "scores": scores, "face_count": face_count})
+
+        return report_scores(scores, face_count, camera_id, cached=cached, trace=trace, received_at=received_at,
+                             decided_by=decided_by)
+
+    except PoolBusy as e:
+        # Every worker is busy: ask the Pi to back off instead of reporting an error
+        print(f"Busy, frame refused: {e}")
+        return jsonify({"status": "busy"}), 503, {"Retry-After": "1"}
 
     except Exception as e:
         print(f"Error processing frame: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 if __name__ == '__main__':
-    # 1. Update Firebase with our IP so the Pi can find us
-    update_ip_on_firebase()
+    # 1. History, cache, trace log and the Firebase mirror (server process only)
+    start_services()
+
+    # 2. Load models + Firebase in the background, then publish our IP
+    threading.Thread(target=startup, daemon=True).start()
     
-    # 2. Start the Server
+    # 3. Start the Server (binds immediately; /ready says when we can infer)
     # host='0.0.0.0' allows external devices (Pi) to connect
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    # threaded=True so open /stream connections don't block /process_frame
+    app.run(host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from segment_store import SegmentReader
+
+# ==========================================
+# SIMULATED HARDWARE (--simulate)
+# ==========================================
+# Stand-ins for what ai_serverlcdbuzzer_modified.py normally touches on the Pi,
+# so the capture -> upload -> display loop can run and be profiled anywhere:
+#   GPIO      -> GpioRecorder      (same calls as RPi.GPIO, records every write)
+#   /dev/fb1  -> any regular file  (FramebufferWriter mmaps it; see save_framebuffer_png)
+#   camera    -> VideoFileCamera / SyntheticCamera / ReplayCamera (cv2.VideoCapture interface)
+#   Firebase  -> MemoryDatabase    (reference().get/set/update/listen)
+
+
+class GpioRecorder:
+    """Drop-in for the subset of RPi.GPIO we use. Thread-safe."""
+    BCM = "BCM"
+    BOARD = "BOARD"
+    OUT = "OUT"
+    IN = "IN"
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, max_events=10000):
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=max_events)  # (time, pin, value)
+        self.levels = {}                         # pin -> current value
+        self.high_since = {}                     # pin -> time it went HIGH
+        self.high_total = {}                     # pin -> seconds spent HIGH
+        self.writes = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode):
+        with self.lock:
+            self.levels.setdefault(pin, self.LOW)
+
+    def output(self, pin, value):
+        now = time.time()
+        value = self.HIGH if value else self.LOW
+        with self.lock:
+            self.events.append((now, pin, value))
+            self.writes[pin] = self.writes.get(pin, 0) + 1
+            if value == self.HIGH and self.levels.get(pin) != self.HIGH:
+                self.high_since[pin] = now
+            elif value == self.LOW and pin in self.high_since:
+                self.high_total[pin] = self.high_total.get(pin, 0.0) + now - self.high_since.pop(pin)
+            self.levels[pin] = value
+
+    def input(self, pin):
+        with self.lock:
+            return self.levels.get(pin, self.LOW)
+
+    def cleanup(self):
+        for pin in list(self.high_since):
+            self.output(pin, self.LOW)
+
+    def summary(self):
+        with self.lock:
+            return {pin: {"writes": self.writes.get(pin, 0),
+                          "high_s": round(self.high_total.get(pin, 0.0), 3)}
+                    for pin in self.levels}
+
+
+class VideoFileCamera:
+    """Plays a video file at its own frame rate, looping at the end."""
+    def __init__(self, path, fps=None, loop=True):
+        self.cap = cv2.VideoCapture(path)
+        self.fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or 30
+        self.loop = loop
+        self.next_at = time.time()
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        # Pace like a real camera instead of decoding as fast as possible
+        delay = self.next_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_at = max(self.next_at, time.time() - 1.0 / self.fps) + 1.0 / self.fps
+
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class SyntheticCamera:
+    """Generated frames (moving block + frame counter) at a fixed rate. No input file needed."""
+    def __init__(self, width=640, height=480, fps=30):
+        self.width, self.height, self.fps = width, height, fps
+        self.count = 0
+        self.next_at = time.time()
+        # Static background, copied per frame (cap.read() returns a new array every time)
+        x = np.linspace(40, 160, width, dtype=np.uint8)
+        self.background = np.dstack([np.tile(x, (height, 1))] * 3)
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        delay = self.next_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_at = max(self.next_at, time.time() - 1.0 / self.fps) + 1.0 / self.fps
+
+        frame = self.background.copy()
+        x = int((self.count * 4) % (self.width - 120))
+        cv2.rectangle(frame, (x, self.height // 3), (x + 120, self.height // 3 + 150), (60, 120, 200), -1)
+        cv2.putText(frame, f"SIM {self.count}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        self.count += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class ReplayCamera:
+    """
+    Plays a SegmentRecorder folder. realtime=False sets lockstep: CameraManager
+    then waits until the uploader took each frame, so every recorded frame is
+    processed exactly once, as fast as the pipeline allows.
+    """
+    def __init__(self, folder, realtime=True, loop=True):
+        self.reader = SegmentReader(folder)
+        self.lockstep = not realtime
+        self.frames = self.reader.replay(realtime=realtime, loop=loop)
+
+    def isOpened(self):
+        return len(self.reader) > 0
+
+    def read(self):
+        try:
+            _, _, jpeg = next(self.frames)
+        except StopIteration:
+            return False, None
+        return True, cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+    def release(self):
+        pass
+
+
+def open_camera(source, realtime=True):
+    """'synthetic', a recording folder, a video file path, or a device index ('0', '2', ...)."""
+    if source == "synthetic":
+        return SyntheticCamera()
+    if str(source).isdigit():
+        return cv2.VideoCapture(int(source))
+    if os.path.isdir(source):
+        return ReplayCamera(source, realtime=realtime, loop=realtime)
+    return VideoFileCamera(source)
+
+
+class MemoryEvent:
+    """Same fields as firebase_admin.db.Event."""
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class MemoryListener:
+    def __init__(self, db, path, callback):
+        self.db, self.path, self.callback = db, path, callback
+
+    def close(self):
+        with self.db.lock:
+            self.db.listeners.discard(self)
+
+
+class MemoryReference:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path.strip("/")
+
+    def get(self):
+        with self.db.lock:
+            return self.db.data.get(self.path)
+
+    def set(self, value):
+        with self.db.lock:
+            self.db.data[self.path] = value
+        self.db._notify(self.path, "put", value)
+
+    def update(self, value):
+        with self.db.lock:
+            current = self.db.data.get(self.path)
+            merged = dict(current) if isinstance(current, dict) else {}
+            merged.update(value)
+            self.db.data[self.path] = merged
+        self.db._notify(self.path, "patch", value)
+
+    def listen(self, callback):
+        """Like firebase: the current value is delivered first, then every change."""
+        listener = MemoryListener(self.db, self.path, callback)
+        with self.db.lock:
+            self.db.listeners.add(listener)
+            current = self.db.data.get(self.path)
+        callback(MemoryEvent("put", "/", current))
+        return listener
+
+
+class MemoryDatabase:
+    """
+    In-process stand-in for firebase_admin.db (flat: one value per path).
+    Callbacks run on the writer's thread, which is fine for our listeners.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.listeners = set()
+
+    def reference(self, path):
+        return MemoryReference(self, path)
+
+    def _notify(self, path, event_type, value):
+        with self.lock:
+            targets = [l for l in self.listeners if l.path == path]
+        for listener in targets:
+            try:
+                listener.callback(MemoryEvent(event_type, "/", value))
+            except Exception:
+                pass
+
+
+def save_framebuffer_png(fb_path, width, height, out_path):
+    """Decodes an RGB565 framebuffer file into a PNG, to check what the LCD would show."""
+    raw = np.fromfile(fb_path, dtype=np.uint16, count=width * height).reshape(height, width)
+    r = ((raw >> 11) & 0x1F).astype(np.uint8) << 3
+    g = ((raw >> 5) & 0x3F).astype(np.uint8) << 2
+    b = (raw & 0x1F).astype(np.uint8) << 3
+    cv2.imwrite(out_path, np.dstack([b, g, r]))
@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ==========================================
+# PERCEPTUAL-HASH RESULT CACHE
+# ==========================================
+# Static classroom scenes send near-identical frames. We hash a tiny grayscale
+# version of the frame (dHash) and reuse the previous result when a
+# recent frame from the same camera is within a few bits of it.
+
+
+def dhash(image, hash_size=8):
+    """Difference hash (hash_size^2 bits): compares neighbouring pixels of a tiny thumbnail."""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class ResultCache:
+    """
+    LRU cache of results keyed by (namespace, perceptual hash).
+    Entries expire after ttl_s; the cache is capped by entry count and by an
+    estimate of its memory use. Thread-safe.
+    """
+    ENTRY_OVERHEAD = 200  # Rough bytes per entry on top of the JSON payload
+
+    def __init__(self, ttl_s=2.0, max_entries=512, max_bytes=1024 * 1024, max_distance=4):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (namespace, hash) -> (value, stored_at, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, namespace, h):
+        """Fresh value stored for a hash within max_distance bits, or None."""
+        now = time.time()
+        with self.lock:
+            expired = []  # Matches too old to use: skipped, then evicted
+            key = (namespace, h)
+            if key not in self.entries or not self._fresh(key, now, expired):
+                # Near match: newest entries first, they are the likeliest
+                key = None
+                for candidate in reversed(self.entries):
+                    if (candidate[0] == namespace and candidate not in expired
+                            and hamming(candidate[1], h) <= self.max_distance
+                            and self._fresh(candidate, now, expired)):
+                        key = candidate
+                        break
+
+            for stale in expired:
+                self._remove(stale)
+                self.expired += 1
+
+            if key is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return None
+
+    def _fresh(self, key, now, expired):
+        if now - self.entries[key][1] <= self.ttl_s:
+            return True
+        expired.append(key)
+        return False
+
+    def put(self, namespace, h, value):
+        size = len(json.dumps(value)) + self.ENTRY_OVERHEAD
+        with self.lock:
+            key = (namespace, h)
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.time(), size)
+            self.bytes += size
+
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
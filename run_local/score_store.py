@@ -0,0 +1,225 @@
+import atexit
+import os
+import threading
+import numpy as np
+
+# ==========================================
+# ENGAGEMENT HISTORY STORE
+# ==========================================
+# Append-only, fixed-width, one file per column (memory-mapped with NumPy).
+#
+#   <root>/raw/  ts.i8  highly_engaged.f2 ... faces.u2  camera.u2      (20 bytes / frame)
+#   <root>/1s/   ts.i8  camera.u2  count.u4  <score>_sum.f4 ...  faces_sum.u4
+#   <root>/1m/   (same as 1s)
+#   <root>/1h/   (same as 1s)
+#
+# Rollups keep sums + counts so any range can be averaged exactly.
+# Queries read the coarsest rollup that still fits the requested range.
+
+SCORE_FIELDS = ("highly_engaged", "engaged", "barely_engaged", "not_engaged")
+
+# (name, bucket size in ms), finest first
+ROLLUP_LEVELS = (("1s", 1000), ("1m", 60 * 1000), ("1h", 60 * 60 * 1000))
+
+RAW_COLUMNS = [("ts", np.int64)] + [(f, np.float16) for f in SCORE_FIELDS] + \
+              [("faces", np.uint16), ("camera", np.uint16)]
+ROLLUP_COLUMNS = [("ts", np.int64), ("camera", np.uint16), ("count", np.uint32)] + \
+                 [(f"{f}_sum", np.float32) for f in SCORE_FIELDS] + [("faces_sum", np.uint32)]
+
+
+class ColumnFile:
+    """One fixed-width column: appended with plain writes, read through np.memmap."""
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.writer = open(path, "ab")
+        self._map = None
+        self._map_len = 0
+
+    def __len__(self):
+        return os.path.getsize(self.path) // self.dtype.itemsize
+
+    def append(self, values):
+        self.writer.write(np.asarray(values, dtype=self.dtype).tobytes())
+        self.writer.flush()
+
+    def read(self):
+        n = len(self)
+        if n == 0:
+            return np.empty(0, dtype=self.dtype)
+        # Re-map only when the file has grown since the last read
+        if self._map is None or self._map_len != n:
+            self._map = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(n,))
+            self._map_len = n
+        return self._map
+
+    def close(self):
+        self.writer.close()
+
+
+class Table:
+    """A set of equally long columns in one folder."""
+    def __init__(self, folder, columns):
+        os.makedirs(folder, exist_ok=True)
+        self.columns = {
+            name: ColumnFile(os.path.join(folder, f"{name}.{np.dtype(dtype).str[1:]}"), dtype)
+            for name, dtype in columns
+        }
+
+    def append(self, rows):
+        """rows: dict of column name -> sequence (all the same length)"""
+        for name, column in self.columns.items():
+            column.append(rows[name])
+
+    def read(self):
+        data = {name: column.read() for name, column in self.columns.items()}
+        # A crash between column writes can leave one column a row longer
+        n = min(len(v) for v in data.values())
+        return {name: v[:n] for name, v in data.items()}
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+
+class ScoreStore:
+    """
+    Per-frame engagement scores with 1 s / 1 min / 1 h rollups.
+    Thread-safe: Flask handlers append while /history queries read.
+    """
+    def __init__(self, root):
+        self.lock = threading.Lock()
+        self.raw = Table(os.path.join(root, "raw"), RAW_COLUMNS)
+        self.rollups = {name: Table(os.path.join(root, name), ROLLUP_COLUMNS) for name, _ in ROLLUP_LEVELS}
+        # (level, camera) -> [bucket_ts, count, score sums..., faces_sum] for buckets still filling
+        self.open_buckets = {}
+        self.last_ts = 0
+        self.closed = False
+        # Partial buckets live in memory: write them out on a normal exit
+        atexit.register(self.close)
+
+    def append(self, ts_ms, scores, face_count, camera_id=0):
+        """scores: dict with the SCORE_FIELDS keys (percentages)"""
+        with self.lock:
+            # Keep the time column sorted even if requests finish out of order
+            ts_ms = max(int(ts_ms), self.last_ts)
+            self.last_ts = ts_ms
+
+            row = {"ts": [ts_ms], "faces": [face_count], "camera": [camera_id]}
+            row.update({f: [scores[f]] for f in SCORE_FIELDS})
+            self.raw.append(row)
+
+            for level, size in ROLLUP_LEVELS:
+                bucket_ts = ts_ms - ts_ms % size
+                self._flush_before(level, bucket_ts)
+
+                acc = self.open_buckets.get((level, camera_id))
+                if acc is None:
+                    acc = self.open_buckets[(level, camera_id)] = [bucket_ts, 0] + [0.0] * len(SCORE_FIELDS) + [0]
+                acc[1] += 1
+                for i, f in enumerate(SCORE_FIELDS):
+                    acc[2 + i] += scores[f]
+                acc[-1] += face_count
+
+    def _flush_before(self, level, bucket_ts):
+        """Writes every open bucket of this level (any camera) that is older than bucket_ts."""
+        done = sorted((acc[0], camera) for (lvl, camera), acc in self.open_buckets.items()
+                      if lvl == level and acc[0] < bucket_ts)
+        for _, camera in done:
+            acc = self.open_buckets.pop((level, camera))
+            row = {"ts": [acc[0]], "camera": [camera], "count": [acc[1]], "faces_sum": [acc[-1]]}
+            row.update({f"{f}_sum": [acc[2 + i]] for i, f in enumerate(SCORE_FIELDS)})
+            self.rollups[level].append(row)
+
+    @staticmethod
+    def pick_level(duration_ms):
+        """Coarsest level that still gives at least 2 buckets for the range."""
+        chosen = "raw"
+        for level, size in ROLLUP_LEVELS:
+            if duration_ms >= 2 * size:
+                chosen = level
+        return chosen
+
+    def query(self, start_ms, end_ms, camera_id=None, level=None, series=False):
+        """
+        Average scores over [start_ms, end_ms). Reads only the chosen level;
+        on rollups the edges snap outward to whole buckets.
+        Returns a dict; with series=True also a per-bucket list.
+        """
+        level = level or self.pick_level(end_ms - start_ms)
+
+        with self.lock:
+            if level == "raw":
+                cols = self.raw.read()
+                count = None  # One frame per row
+                sums = {f: cols[f] for f in SCORE_FIELDS}
+                faces = cols["faces"]
+                size = 1
+                pending = []
+            else:
+                cols = self.rollups[level].read()
+                count = cols["count"]
+                sums = {f: cols[f"{f}_sum"] for f in SCORE_FIELDS}
+                faces = cols["faces_sum"]
+                size = dict(ROLLUP_LEVELS)[level]
+                pending = [(camera, list(acc)) for (lvl, camera), acc in self.open_buckets.items() if lvl == level]
+
+        # Time column is sorted (rollups to within one bucket), so only a slice is touched
+        ts = cols["ts"]
+        lo = np.searchsorted(ts, start_ms - 2 * size, side="left")
+        hi = np.searchsorted(ts, end_ms + size, side="left")
+        mask = (ts[lo:hi] > start_ms - size) & (ts[lo:hi] < end_ms)
+        if camera_id is not None:
+            mask &= cols["camera"][lo:hi] == camera_id
+
+        sel_ts = np.asarray(ts[lo:hi][mask])
+        if count is None:
+            sel_count = np.ones(len(sel_ts), dtype=np.float64)
+        else:
+            sel_count = np.asarray(count[lo:hi][mask], dtype=np.float64)
+        sel_sums = {f: np.asarray(sums[f][lo:hi][mask], dtype=np.float64) for f in SCORE_FIELDS}
+        sel_faces = np.asarray(faces[lo:hi][mask], dtype=np.float64)
+
+        # Buckets still filling in memory
+        for camera, acc in pending:
+            if start_ms - size < acc[0] < end_ms and (camera_id is None or camera == camera_id):
+                sel_ts = np.append(sel_ts, acc[0])
+                sel_count = np.append(sel_count, acc[1])
+                for i, f in enumerate(SCORE_FIELDS):
+                    sel_sums[f] = np.append(sel_sums[f], acc[2 + i])
+                sel_faces = np.append(sel_faces, acc[-1])
+
+        total = float(sel_count.sum())
+        result = {"level": level, "start": start_ms, "end": end_ms, "frames": int(total)}
+        for f in SCORE_FIELDS:
+            result[f] = float(sel_sums[f].sum() / total) if total else None
+        result["avg_faces"] = float(sel_faces.sum() / total) if total else None
+
+        if series:
+            # Merge cameras that share a bucket
+            buckets, inverse = np.unique(sel_ts, return_inverse=True)
+            n = len(buckets)
+            bucket_count = np.bincount(inverse, weights=sel_count, minlength=n)
+            bucket_means = {f: np.bincount(inverse, weights=sel_sums[f], minlength=n) / bucket_count
+                            for f in SCORE_FIELDS}
+            result["series"] = [
+                {"ts": int(buckets[i]), "frames": int(bucket_count[i]),
+                 **{f: float(bucket_means[f][i]) for f in SCORE_FIELDS}}
+                for i in range(n)
+            ]
+        return result
+
+    def close(self):
+        """
+        Writes the partial buckets, then closes the files. A bucket continued
+        after a restart becomes a second row with the same ts; queries sum them.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for level, _ in ROLLUP_LEVELS:
+                self._flush_before(level, float("inf"))
+        self.raw.close()
+        for table in self.rollups.values():
+            table.close()
@@ -0,0 +1,93 @@
+import argparse
+import socket
+import time
+
+import requests
+
+from segment_store import SegmentReader
+
+# ==========================================
+# SEGMENT REPLAY
+# ==========================================
+# Plays a recording made with ai_serverlcdbuzzer_modified.py --record into:
+#   http  -> local_server /process_frame (same form the Pi sends, traced)
+#   tcp   -> server.py (4-byte little-endian length + JPEG, like the Pi's video client)
+# The Pi pipeline itself replays with:  --camera <folder> [--replay-fast]
+#
+#   python segment_replay.py info  recordings/
+#   python segment_replay.py http  recordings/ --url http://127.0.0.1:5000/process_frame --fast
+#   python segment_replay.py tcp   recordings/ --host 127.0.0.1 --port 5555
+
+
+def print_info(reader):
+    if not len(reader):
+        print("Empty recording.")
+        return
+    ts = reader.timestamps
+    duration = ts[-1] - ts[0]
+    sizes = reader.index["length"]
+    print(f"Frames:    {len(reader)}  in {len(reader.maps)} segment(s)")
+    print(f"Captured:  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts[0]))}  ({duration:.1f} s)")
+    print(f"Rate:      {(len(reader) - 1) / duration if duration else 0:.1f} fps")
+    print(f"JPEG size: {sizes.mean() / 1024:.1f} KiB avg, {sizes.sum() / 2**20:.1f} MiB total")
+
+
+def replay_http(reader, url, realtime, speed, loop):
+    statuses = {}
+    latencies = []
+    for i, _, jpeg in reader.replay(realtime=realtime, speed=speed, loop=loop):
+        start = time.time()
+        # capture_ts = send time, so local_server's trace spans line up with this replay
+        form = {"capture_ts": int(start * 1000), "frame_id": i}
+        try:
+            response = requests.post(url, files={"image": ("frame.jpg", bytes(jpeg), "image/jpeg")},
+                                     data=form, timeout=5)
+            status = response.json().get("status", response.status_code)
+        except Exception as e:
+            status = type(e).__name__
+        latencies.append((time.time() - start) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+    return statuses, latencies
+
+
+def replay_tcp(reader, host, port, realtime, speed, loop):
+    latencies = []
+    with socket.create_connection((host, port)) as sock:
+        for _, _, jpeg in reader.replay(realtime=realtime, speed=speed, loop=loop):
+            start = time.time()
+            sock.sendall(len(jpeg).to_bytes(4, "little"))
+            sock.sendall(jpeg)
+            latencies.append((time.time() - start) * 1000)
+    return {"sent": len(latencies)}, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay an indexed JPEG segment recording")
+    parser.add_argument("target", choices=["info", "http", "tcp"])
+    parser.add_argument("folder", help="Recording folder (seg_*.jpgs / seg_*.idx)")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/process_frame")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--fast", action="store_true", help="As fast as possible instead of recorded timing")
+    parser.add_argument("--speed", type=float, default=1.0, help="Real-time speed factor")
+    parser.add_argument("--loop", action="store_true")
+    args = parser.parse_args()
+
+    reader = SegmentReader(args.folder)
+    if args.target == "info":
+        print_info(reader)
+    else:
+        started = time.time()
+        try:
+            if args.target == "http":
+                counts, latencies = replay_http(reader, args.url, not args.fast, args.speed, args.loop)
+            else:
+                counts, latencies = replay_tcp(reader, args.host, args.port, not args.fast, args.speed, args.loop)
+        except KeyboardInterrupt:
+            counts, latencies = {"interrupted": True}, []
+        elapsed = time.time() - started
+        print(f"Replayed {len(latencies)} frames in {elapsed:.1f} s ({len(latencies) / elapsed:.1f} fps): {counts}")
+        if latencies:
+            latencies.sort()
+            print(f"Per-frame send/response time: p50 {latencies[len(latencies) // 2]:.1f} ms, "
+                  f"max {latencies[-1]:.1f} ms")
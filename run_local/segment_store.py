@@ -0,0 +1,193 @@
+import glob
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# ==========================================
+# INDEXED JPEG SEGMENTS (RECORD / REPLAY)
+# ==========================================
+# A recording is a folder of rolling segments, each a pair of files:
+#
+#   seg_<first capture ms>.jpgs   JPEG frames back to back
+#   seg_<first capture ms>.idx    one 24-byte record per frame:
+#                                 offset u8 | length u4 | frame_id u4 | capture time f8
+#
+# Segments roll over after SEGMENT_SECONDS and the oldest are deleted past
+# max_segments. The reader memory-maps the .jpgs files, so any frame can be
+# fetched by index or by time without reading the rest.
+
+SEGMENT_SECONDS = 60
+MAX_REPLAY_GAP = 0.5  # Seconds: longer pauses between recorded frames (e.g. two sessions) are cut to this
+INDEX_RECORD = struct.Struct("<QIId")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("frame_id", "<u4"), ("ts", "<f8")])
+
+
+class SegmentWriter:
+    """Appends JPEG bytes to the current segment; not thread-safe (one recorder thread)."""
+    def __init__(self, folder, segment_seconds=SEGMENT_SECONDS, max_segments=60):
+        self.folder = folder
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        os.makedirs(folder, exist_ok=True)
+        self.data = self.index = None
+        self.segment_start = 0
+        self.offset = 0
+
+    def append(self, jpeg_bytes, ts, frame_id):
+        if self.data is None or ts - self.segment_start >= self.segment_seconds:
+            self._roll(ts)
+        self.data.write(jpeg_bytes)
+        # Index after data: a crash can only leave unindexed bytes, never a dangling index entry
+        self.index.write(INDEX_RECORD.pack(self.offset, len(jpeg_bytes), frame_id & 0xFFFFFFFF, ts))
+        self.offset += len(jpeg_bytes)
+
+    def flush(self):
+        if self.data is not None:
+            self.data.flush()
+            self.index.flush()
+
+    def _roll(self, ts):
+        self.close()
+        base = os.path.join(self.folder, f"seg_{int(ts * 1000):013d}")
+        self.data = open(base + ".jpgs", "ab")
+        self.index = open(base + ".idx", "ab")
+        self.segment_start = ts
+        self.offset = self.data.tell()
+
+        # Rolling window: drop the oldest segments
+        for old in list_segments(self.folder)[:-self.max_segments]:
+            for path in (old + ".jpgs", old + ".idx"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.index.close()
+            self.data = self.index = None
+
+
+class SegmentRecorder:
+    """
+    Records camera frames in the background. submit() never blocks the
+    capture loop: frames go through a small queue and the oldest is dropped
+    when encoding falls behind, so live capture fps is unaffected.
+    """
+    def __init__(self, folder, fps=10, quality=85, segment_seconds=SEGMENT_SECONDS, max_segments=60):
+        self.writer = SegmentWriter(folder, segment_seconds, max_segments)
+        self.min_interval = 1.0 / fps if fps else 0
+        self.quality = quality
+        self.frames = queue.Queue(maxsize=4)
+        self.next_due = 0
+        self.recorded = 0
+        self.dropped = 0
+        threading.Thread(target=self._record_loop, daemon=True).start()
+
+    def submit(self, frame, ts, frame_id):
+        """frame must not be modified afterwards (cap.read() returns a new array every time)."""
+        if ts < self.next_due:
+            return
+        # Keep the average rate even when the camera period doesn't divide the interval
+        self.next_due = max(self.next_due + self.min_interval, ts - self.min_interval)
+        try:
+            self.frames.put_nowait((frame, ts, frame_id))
+        except queue.Full:
+            try:
+                self.frames.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            self.frames.put_nowait((frame, ts, frame_id))
+
+    def _record_loop(self):
+        last_flush = time.time()
+        while True:
+            frame, ts, frame_id = self.frames.get()
+            ok, encoded = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+            if ok:
+                self.writer.append(encoded.tobytes(), ts, frame_id)
+                self.recorded += 1
+            if time.time() - last_flush >= 1.0:
+                self.writer.flush()
+                last_flush = time.time()
+
+
+def list_segments(folder):
+    """Segment base paths (without extension), oldest first."""
+    return sorted(path[:-4] for path in glob.glob(os.path.join(folder, "seg_*.idx")))
+
+
+class SegmentReader:
+    """
+    Random access over every segment of a recording.
+    Frames are numbered 0..len-1 across segments, in capture order.
+    """
+    def __init__(self, folder):
+        self.maps = []
+        indexes = []
+        for base in list_segments(folder):
+            raw = np.fromfile(base + ".idx", dtype=np.uint8)
+            index = raw[:len(raw) - len(raw) % INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+            size = os.path.getsize(base + ".jpgs")
+            # Only frames whose bytes are fully on disk
+            index = index[index["offset"] + index["length"] <= size]
+            if len(index) == 0:
+                continue
+            with open(base + ".jpgs", "rb") as f:
+                self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            indexes.append((len(self.maps) - 1, index))
+
+        self.segment = np.concatenate([np.full(len(ix), s, dtype=np.int32) for s, ix in indexes]) \
+            if indexes else np.empty(0, dtype=np.int32)
+        self.index = np.concatenate([ix for _, ix in indexes]) if indexes else np.empty(0, dtype=INDEX_DTYPE)
+        self.timestamps = self.index["ts"]
+
+    def __len__(self):
+        return len(self.index)
+
+    def jpeg(self, i):
+        """Encoded frame i as a zero-copy memoryview into the mapped segment."""
+        entry = self.index[i]
+        start = int(entry["offset"])
+        return memoryview(self.maps[self.segment[i]])[start:start + int(entry["length"])]
+
+    def frame(self, i):
+        return cv2.imdecode(np.frombuffer(self.jpeg(i), np.uint8), cv2.IMREAD_COLOR)
+
+    def find(self, ts):
+        """Index of the first frame captured at or after ts."""
+        return int(np.searchsorted(self.timestamps, ts, side="left"))
+
+    def replay(self, realtime=True, speed=1.0, start=0, loop=False):
+        """
+        Yields (i, capture ts, jpeg memoryview). realtime=True keeps the
+        recorded spacing (scaled by speed, gaps capped at MAX_REPLAY_GAP);
+        False is as fast as possible.
+        """
+        while len(self):
+            due = time.time()
+            for i in range(start, len(self)):
+                if realtime:
+                    if i > start:
+                        gap = min(self.timestamps[i] - self.timestamps[i - 1], MAX_REPLAY_GAP)
+                        due += max(0.0, gap) / speed
+                    delay = due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                yield i, float(self.timestamps[i]), self.jpeg(i)
+            if not loop:
+                break
+            start = 0
+
+    def close(self):
+        for m in self.maps:
+            m.close()
+        self.maps = []
@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from collections import deque
+
+# ==========================================
+# THERMAL / LOAD WORKLOAD GOVERNOR
+# ==========================================
+# Samples SoC temperature, the firmware's throttling flags, CPU busy time and
+# the load average, and moves the Pi client between quality tiers BEFORE the
+# SoC throttles:
+#   - one tier down after DOWN_SAMPLES consecutive samples under pressure
+#   - straight to the lightest tier at TEMP_CRITICAL
+#   - one tier up only after UP_HOLD seconds of calm (hysteresis, no flapping)
+#
+# Every path is a plain file, so a test can point them at fake files:
+#   echo 82000 > /tmp/fake/temp; echo 0x4 > /tmp/fake/throttled
+
+TEMP_PATH = "/sys/class/thermal/thermal_zone0/temp"                  # millidegrees C
+THROTTLED_PATH = "/sys/devices/platform/soc/soc:firmware/get_throttled"  # hex flags (Pi firmware)
+LOADAVG_PATH = "/proc/loadavg"
+STAT_PATH = "/proc/stat"
+
+# get_throttled "right now" bits: under-voltage, ARM freq capped, throttled, soft temp limit
+THROTTLED_NOW_MASK = 0xF
+
+TEMP_HIGH = 75.0       # C: step down (the Pi firmware soft-limits at 80)
+TEMP_CRITICAL = 80.0   # C: lightest tier at once
+TEMP_LOW = 65.0        # C: may step up below this
+CPU_HIGH = 0.90        # Busy fraction of all cores
+CPU_LOW = 0.60
+LOAD_HIGH = 1.5        # 1-minute load average per core (runnable + waiting tasks)
+LOAD_LOW = 0.8
+DOWN_SAMPLES = 2       # Consecutive pressured samples before stepping down
+UP_HOLD = 60           # Seconds of calm (and since the last change) before stepping up
+SAMPLE_INTERVAL = 2.0  # Seconds
+
+# Best first. capture/webrtc are (width, height); upload_interval and lcd_refresh in seconds
+TIERS = [
+    {"name": "full",    "capture": (640, 480), "upload_interval": 0.2, "jpeg_quality": 50,
+     "webrtc": (640, 480), "lcd_refresh": 0.2},
+    {"name": "reduced", "capture": (640, 480), "upload_interval": 0.33, "jpeg_quality": 45,
+     "webrtc": (480, 360), "lcd_refresh": 0.3},
+    {"name": "low",     "capture": (480, 360), "upload_interval": 0.5, "jpeg_quality": 40,
+     "webrtc": (320, 240), "lcd_refresh": 0.5},
+    {"name": "minimal", "capture": (320, 240), "upload_interval": 1.0, "jpeg_quality": 35,
+     "webrtc": (320, 240), "lcd_refresh": 1.0},
+]
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class SystemSensors:
+    """Reads the sensor files; a missing or unreadable file just yields None."""
+    def __init__(self, temp_path=TEMP_PATH, throttled_path=THROTTLED_PATH,
+                 loadavg_path=LOADAVG_PATH, stat_path=STAT_PATH):
+        self.temp_path = temp_path
+        self.throttled_path = throttled_path
+        self.loadavg_path = loadavg_path
+        self.stat_path = stat_path
+        self.cores = os.cpu_count() or 1
+        self.last_cpu = None  # (busy, total) jiffies from the previous sample
+
+    def read(self):
+        reading = {"temp_c": None, "throttled": None, "load1": None, "cpu": None}
+
+        raw = _read(self.temp_path)
+        if raw:
+            try:
+                value = float(raw)
+                reading["temp_c"] = value / 1000 if value > 1000 else value
+            except ValueError:
+                pass
+
+        raw = _read(self.throttled_path)
+        if raw:
+            try:
+                # "throttled=0x50005" (vcgencmd style) or just "0x50005" / "50005"
+                reading["throttled"] = int(raw.split("=")[-1], 16)
+            except ValueError:
+                pass
+
+        raw = _read(self.loadavg_path)
+        if raw:
+            try:
+                reading["load1"] = float(raw.split()[0]) / self.cores
+            except (ValueError, IndexError):
+                pass
+
+        # Busy fraction since the previous sample, from the aggregate "cpu" line
+        raw = _read(self.stat_path)
+        if raw and raw.startswith("cpu "):
+            try:
+                fields = [int(v) for v in raw.splitlines()[0].split()[1:]]
+                idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+                total = sum(fields)
+                if self.last_cpu is not None and total > self.last_cpu[1]:
+                    reading["cpu"] = ((total - idle) - self.last_cpu[0]) / (total - self.last_cpu[1])
+                self.last_cpu = (total - idle, total)
+            except (ValueError, IndexError):
+                pass
+        return reading
+
+
+class WorkloadGovernor:
+    """
+    apply(tier, decision) is called from the governor thread on every tier
+    change (and once at start with the initial tier); decision holds the
+    readings and the reason, ready to be logged.
+    """
+    def __init__(self, apply, sensors=None, tiers=TIERS, interval=SAMPLE_INTERVAL, start_tier=0):
+        self.apply = apply
+        self.sensors = sensors or SystemSensors()
+        self.tiers = tiers
+        self.interval = interval
+        self.level = start_tier
+        self.pressure_samples = 0
+        self.calm_since = None
+        self.last_change = time.time()
+        self.changes = 0
+        self.last_reading = None
+        self.history = deque(maxlen=50)  # Recent decisions, for the metrics log
+        self.running = True
+
+    @property
+    def tier(self):
+        return self.tiers[self.level]
+
+    def start(self):
+        self.apply(self.tier, {"reason": "start", "tier": self.tier["name"]})
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def _loop(self):
+        while self.running:
+            self.step(self.sensors.read())
+            time.sleep(self.interval)
+
+    def _pressure(self, reading):
+        """Why the Pi is under pressure, or None."""
+        if reading["temp_c"] is not None and reading["temp_c"] >= TEMP_HIGH:
+            return f"temp {reading['temp_c']:.1f}C"
+        if reading["throttled"] is not None and reading["throttled"] & THROTTLED_NOW_MASK:
+            return f"throttled 0x{reading['throttled']:x}"
+        if reading["cpu"] is not None and reading["cpu"] >= CPU_HIGH:
+            return f"cpu {reading['cpu']:.0%}"
+        if reading["load1"] is not None and reading["load1"] >= LOAD_HIGH:
+            return f"load {reading['load1']:.2f}/core"
+        return None
+
+    def _calm(self, reading):
+        return ((reading["temp_c"] is None or reading["temp_c"] <= TEMP_LOW)
+                and not (reading["throttled"] or 0) & THROTTLED_NOW_MASK
+                and (reading["cpu"] is None or reading["cpu"] <= CPU_LOW)
+                and (reading["load1"] is None or reading["load1"] <= LOAD_LOW))
+
+    def step(self, reading, now=None):
+        """One decision from one reading. Returns the new tier level."""
+        now = time.time() if now is None else now
+        self.last_reading = reading
+        lightest = len(self.tiers) - 1
+
+        if reading["temp_c"] is not None and reading["temp_c"] >= TEMP_CRITICAL and self.level < lightest:
+            self._change(lightest, f"critical temp {reading['temp_c']:.1f}C", reading, now)
+            return self.level
+
+        reason = self._pressure(reading)
+        if reason:
+            self.calm_since = None
+            self.pressure_samples += 1
+            if self.pressure_samples >= DOWN_SAMPLES and self.level < lightest:
+                self._change(self.level + 1, reason, reading, now)
+            return self.level
+        self.pressure_samples = 0
+
+        if not self._calm(reading):
+            self.calm_since = None
+            return self.level
+        if self.calm_since is None:
+            self.calm_since = now
+        if (self.level > 0 and now - self.calm_since >= UP_HOLD
+                and now - self.last_change >= UP_HOLD):
+            self._change(self.level - 1, f"calm for {now - self.calm_since:.0f}s", reading, now)
+        return self.level
+
+    def _change(self, level, reason, reading, now):
+        previous = self.tier["name"]
+        self.level = level
+        self.last_change = now
+        self.pressure_samples = 0
+        self.calm_since = None
+        self.changes += 1
+        decision = {"reason": reason, "from": previous, "tier": self.tier["name"],
+                    **{k: (round(v, 3) if isinstance(v, float) else v) for k, v in reading.items()}}
+        self.history.append((now, decision))
+        self.apply(self.tier, decision)
+
+    def stats(self):
+        reading = self.last_reading or {}
+        return {"tier": self.tier["name"], "changes": self.changes,
+                "temp_c": reading.get("temp_c"), "cpu": None if reading.get("cpu") is None
+                else round(reading["cpu"], 2)}
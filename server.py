@@ -1,15 +1,15 @@
 import cv2
 import socket
-import numpy as np
 import time
 import struct
 import threading
 from pynput import keyboard # Handles non-blocking keyboard input
+from video_stream import FrameReceiver, available_codecs
 
 # --- Configuration ---
 HOST = '0.0.0.0' # Laptop listens on this for incoming video (Port 5555)
 PORT = 5555      # Video stream port
-FRAME_SIZE_HEADER = 4 
+VIDEO_CODECS = available_codecs() # Offered to negotiating senders (h264 needs PyAV); legacy JPEG senders always work
 
 
 # --- New Configuration for Command Client (Laptop connects to Pi) ---
@@ -56,20 +56,6 @@ def start_keyboard_listener():
     keyboard_listener.start()
     print("Keyboard listener active. Press '1' or '2' to send commands, 'q' to quit.")
 
-# --- Socket Helper Function ---
-def recvall(sock, count):
-    """Receives a specific number of bytes from the socket."""
-    buf = b''
-    while count:
-        try:
-            newbuf = sock.recv(count)
-            if not newbuf: return None
-            buf += newbuf
-            count -= len(newbuf)
-        except Exception:
-            return None
-    return buf
-
 # --- Main Server Logic ---
 def main_server():
     global command_socket, is_running
@@ -114,20 +100,15 @@ def main_server():
     # -------------------------------------------------------------
     # 3. VIDEO PROCESSING LOOP
     # -------------------------------------------------------------
+    receiver = None
     try:
-        while is_running:
-            # Receive size header
-            size_data = recvall(conn, FRAME_SIZE_HEADER)
-            if size_data is None: break
-                
-            frame_size = int.from_bytes(size_data, 'little')
-            
-            # Receive frame data
-            encoded_image_bytes = recvall(conn, frame_size)
-            if encoded_image_bytes is None: break
+        # Codec negotiation (or legacy JPEG stream); one decoder for the whole connection
+        receiver = FrameReceiver(conn, VIDEO_CODECS)
+        print(f"Video codec: {receiver.codec}{' (legacy sender)' if receiver.legacy else ''}")
+        started = time.time()
 
-            nparr = np.frombuffer(encoded_image_bytes, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        for frame, capture_ts in receiver.frames():
+            if not is_running: break
 
             if frame is not None:
                 # DISPLAY & KEYBOARD CHECK
@@ -150,6 +131,10 @@ def main_server():
     finally:
         # Cleanup
         print("Starting cleanup...")
+        if receiver is not None and receiver.frames_received:
+            elapsed = max(time.time() - started, 1e-6)
+            print(f"Received {receiver.frames_received} frames ({receiver.codec}), "
+                  f"{receiver.bytes_received * 8 / 1000 / elapsed:.0f} kbit/s average")
         if keyboard_listener and keyboard_listener.running:
             keyboard_listener.stop()
         cv2.destroyAllWindows()
@@ -0,0 +1,127 @@
+import argparse
+import socket
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from video_stream import FrameReceiver, FrameSender, available_codecs
+
+# ==========================================
+# JPEG vs H.264 STREAM COMPARISON
+# ==========================================
+# Streams the same frames through video_stream.py once per codec over a
+# loopback TCP socket (sender and receiver share a clock, so latency is
+# exact) and prints bandwidth, latency and quality side by side.
+#
+#   python stream_compare.py                          # synthetic classroom-like scene
+#   python stream_compare.py --source lecture.mp4 --frames 600
+#   python stream_compare.py --source 0               # live camera
+
+
+def synthetic_frames(width, height, count):
+    """Mostly static scene with one small moving object, like a classroom camera."""
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    for i in range(count):
+        frame = background.copy()
+        x = int(width * 0.3 + 40 * np.sin(i / 15))
+        cv2.circle(frame, (x, height // 2), 30, (40, 160, 220), -1)
+        yield frame
+
+
+def source_frames(source, width, height, count):
+    if source == "synthetic":
+        yield from synthetic_frames(width, height, count)
+        return
+    cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    for _ in range(count):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield cv2.resize(frame, (width, height))
+    cap.release()
+
+
+def run_codec(codec, frames, width, height, fps, realtime):
+    server = socket.create_server(("127.0.0.1", 0))
+    port = server.getsockname()[1]
+    sent = {}        # capture ts -> source frame (for PSNR)
+    latencies, psnrs = [], []
+    received = {}
+
+    def receive():
+        conn, _ = server.accept()
+        receiver = FrameReceiver(conn, [codec])
+        for frame, capture_ts in receiver.frames():
+            latencies.append((time.time() - capture_ts) * 1000)
+            source = sent.pop(capture_ts, None)
+            if source is not None:
+                psnrs.append(cv2.PSNR(source, frame))
+        received["frames"] = receiver.frames_received
+        received["bytes"] = receiver.bytes_received
+        conn.close()
+
+    thread = threading.Thread(target=receive, daemon=True)
+    thread.start()
+
+    encode_ms = []
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sender = FrameSender(sock, width, height, fps, [codec])
+        if sender.codec != codec:
+            raise RuntimeError(f"Receiver negotiated {sender.codec} instead of {codec}")
+        started = time.time()
+        for i, frame in enumerate(frames):
+            capture_ts = time.time()
+            sent[capture_ts] = frame
+            t0 = time.perf_counter()
+            sender.send(frame, capture_ts)
+            encode_ms.append((time.perf_counter() - t0) * 1000)
+            if realtime:
+                time.sleep(max(0, started + (i + 1) / fps - time.time()))
+        duration = time.time() - started
+    thread.join(timeout=10)
+    server.close()
+
+    frames_out = max(received.get("frames", 0), 1)
+    return {
+        "codec": codec,
+        "frames": received.get("frames", 0),
+        "kib_per_frame": received.get("bytes", 0) / frames_out / 1024,
+        "kbit_s": received.get("bytes", 0) * 8 / 1000 / max(duration, 1e-6) if realtime
+                  else received.get("bytes", 0) / frames_out * 8 * fps / 1000,
+        "send_ms": float(np.median(encode_ms)) if encode_ms else 0,
+        "latency_p50": float(np.percentile(latencies, 50)) if latencies else 0,
+        "latency_p90": float(np.percentile(latencies, 90)) if latencies else 0,
+        "psnr": float(np.mean(psnrs)) if psnrs else 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare JPEG and H.264 over the TCP video path")
+    parser.add_argument("--source", default="synthetic", help="'synthetic', camera index or video file")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--fast", action="store_true", help="Send as fast as possible (bitrate then assumes --fps)")
+    args = parser.parse_args()
+
+    # Same frames for every codec
+    frames = list(source_frames(args.source, args.width, args.height, args.frames))
+    if not frames:
+        raise SystemExit(f"No frames from source {args.source}")
+
+    results = []
+    for codec in reversed(available_codecs()):
+        results.append(run_codec(codec, frames, args.width, args.height, args.fps, not args.fast))
+    if "h264" not in available_codecs():
+        print("PyAV is not installed: only the JPEG path was measured")
+
+    print(f"{len(frames)} frames, {args.width}x{args.height} @ {args.fps} fps ({args.source})")
+    print(f"{'codec':<8}{'frames':>8}{'KiB/frame':>11}{'kbit/s':>10}{'send ms':>9}{'lat p50':>9}{'lat p90':>9}{'PSNR dB':>9}")
+    for r in results:
+        print(f"{r['codec']:<8}{r['frames']:>8}{r['kib_per_frame']:>11.1f}{r['kbit_s']:>10.0f}{r['send_ms']:>9.2f}"
+              f"{r['latency_p50']:>9.1f}{r['latency_p90']:>9.1f}{r['psnr']:>9.1f}")
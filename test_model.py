@@ -1,3 +1,6 @@
+import argparse
+import contextlib
+import os
 import cv2
 from deepface import DeepFace
 import numpy as np
@@ -17,72 +20,221 @@ EMOTIONS_TO_ENGAGEMENT = {
 
 VIDEO_SOURCE = 'rtsp://100.74.50.99:8554/mystream' # Use 0 for webcam, or change to your Pi's URL
 
-# --- NEW: Threading and State Variables ---
+# Face detectors DeepFace can use. Cheapest first (on CPU).
+# Press 'b' in the video window to cycle through them.
+DETECTOR_BACKENDS = ['opencv', 'yunet', 'mediapipe', 'ssd', 'mtcnn', 'retinaface']
+DEFAULT_BACKEND = 'retinaface'
+ANALYSIS_WIDTH = 320 # Analyze at 320p width
+
+# Ask FFmpeg not to buffer the RTSP stream (must be set before VideoCapture opens)
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "fflags;nobuffer|flags;low_delay")
+
+# --- Analysis Engine (models built + warmed ONCE) ---
+
+def resize_for_analysis(frame):
+    """Analyzing a smaller image is MUCH faster. Keeps the aspect ratio."""
+    scale = ANALYSIS_WIDTH / frame.shape[1]
+    dim = (ANALYSIS_WIDTH, int(frame.shape[0] * scale))
+    return cv2.resize(frame, dim, interpolation=cv2.INTER_AREA)
+
+class AnalysisEngine:
+    """
+    Builds the emotion model and the chosen face detector at startup and runs
+    one dummy analysis so the first real frame doesn't pay for lazy loading.
+    DeepFace caches built models, so switching back to a warmed backend is free.
+    detector_backend=None builds only the emotion model (no detector warmed yet).
+    """
+    def __init__(self, detector_backend):
+        self.detector_backend = detector_backend
+        self.warmed_backends = set()
+
+        print("Building emotion model...")
+        try:
+            DeepFace.build_model("Emotion")
+        except (TypeError, ValueError):
+            # Newer DeepFace versions need the task name (and raise ValueError without it)
+            DeepFace.build_model(model_name="Emotion", task="facial_attribute")
+        if detector_backend is not None:
+            self.warm_up(detector_backend)
+
+    def warm_up(self, backend):
+        if backend in self.warmed_backends:
+            return
+        print(f"Warming up detector '{backend}'...")
+        start = time.time()
+        dummy = np.zeros((240, ANALYSIS_WIDTH, 3), dtype=np.uint8)
+        DeepFace.analyze(dummy, actions=['emotion'], enforce_detection=False,
+                         detector_backend=backend, silent=True)
+        self.warmed_backends.add(backend)
+        print(f"Detector '{backend}' ready in {time.time() - start:.2f}s")
+
+    def set_backend(self, backend):
+        self.warm_up(backend)
+        self.detector_backend = backend
+
+    def analyze(self, frame):
+        """Returns the dominant emotion. Raises if no face is found."""
+        analysis_results = DeepFace.analyze(
+            frame,
+            actions=['emotion'],
+            enforce_detection=True,
+            detector_backend=self.detector_backend,
+            silent=True
+        )
+
+        # Process results (DeepFace V1)
+        if isinstance(analysis_results, list) and len(analysis_results) > 0:
+            return analysis_results[0]['dominant_emotion']
+        # Process results (DeepFace V0)
+        elif isinstance(analysis_results, dict):
+            return analysis_results['dominant_emotion']
+        return "unknown"
+
+def benchmark_backends(frame, backends, runs=10):
+    """Prints per-backend cold warm-up time and warm latency on a single frame."""
+    # No backend warmed up front: every backend's warm-up is timed from cold
+    engine = AnalysisEngine(None)
+    resized_frame = resize_for_analysis(frame)
+
+    print(f"\n{'Backend':<12}{'Warm-up (s)':>12}{'Mean (ms)':>12}{'Min (ms)':>12}{'Face':>8}")
+    for backend in backends:
+        try:
+            start = time.time()
+            engine.set_backend(backend)
+            warmup_s = time.time() - start
+
+            timings = []
+            found_face = True
+            for _ in range(runs):
+                t0 = time.time()
+                try:
+                    engine.analyze(resized_frame)
+                except ValueError:
+                    found_face = False
+                timings.append((time.time() - t0) * 1000)
+            print(f"{backend:<12}{warmup_s:>12.2f}{np.mean(timings):>12.1f}{np.min(timings):>12.1f}{'yes' if found_face else 'no':>8}")
+        except Exception as e:
+            print(f"{backend:<12}  failed: {e}")
+
+# --- Low-Latency Ingest (decode thread + double buffer) ---
+
+class FrameIngest:
+    """
+    Decodes the stream on its own thread, as fast as frames arrive, so the
+    decoder buffer never fills up and we always sit at the live edge.
+
+    Frames are decoded into two preallocated buffers (no copies):
+    the thread writes the BACK buffer, then swaps it to the FRONT under the lock.
+    Readers use `with ingest.read() as (frame_id, frame, captured_at):` and must
+    be quick (resize / copy), because the swap waits for them.
+    """
+    def __init__(self, source):
+        self.cap = cv2.VideoCapture(source)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.buffers = [None, None]
+        self.front = 0
+        self.frame_id = 0
+        self.captured_at = 0.0
+        self.running = self.cap.isOpened()
+        self.cond = threading.Condition()
+        self.dropped_by_display = 0
+
+        if self.running:
+            threading.Thread(target=self._decode_loop, daemon=True).start()
+
+    def _decode_loop(self):
+        back = 1
+        while self.running:
+            # grab() pulls the next packet; retrieve() decodes straight into our back buffer
+            if not self.cap.grab():
+                break
+            if self.buffers[back] is None:
+                ok, self.buffers[back] = self.cap.retrieve()
+            else:
+                ok, self.buffers[back] = self.cap.retrieve(self.buffers[back])
+            if not ok:
+                continue
+
+            with self.cond:
+                self.front, back = back, self.front
+                self.frame_id += 1
+                self.captured_at = time.time()
+                self.cond.notify_all()
+
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def wait_for_frame(self, last_id, timeout=1.0):
+        """Blocks until a frame newer than last_id exists. Returns False if the stream ended."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.frame_id != last_id or not self.running, timeout=timeout)
+            return self.running or self.frame_id != last_id
+
+    @contextlib.contextmanager
+    def read(self):
+        with self.cond:
+            yield self.frame_id, self.buffers[self.front], self.captured_at
+
+    def release(self):
+        self.running = False
+        self.cap.release()
+
+# --- Threading and State Variables ---
 
 # This lock prevents race conditions (e.g., trying to read/write the
 # status at the exact same time from two threads)
 data_lock = threading.Lock()
 
-# We'll run analysis on a copy of the latest frame
-latest_frame = None
-
 # These variables will be shared between our threads
 current_engagement_status = "ANALYZING..."
 dominant_emotion = ""
 is_analysis_running = False
+requested_backend = None
+analysis_fps = 0.0
+frame_age_ms = 0.0 # How old the analyzed frame was when analysis started
 
-# --- NEW: AI Analysis Function (for the worker thread) ---
+# --- AI Analysis Function (for the worker thread) ---
 
-def run_ai_analysis():
+def run_ai_analysis(engine, ingest):
     """
     This function runs in a separate thread.
-    It continuously analyzes the 'latest_frame'.
+    It analyzes every NEW frame as fast as the CPU allows (no fixed sleep).
     """
-    global current_engagement_status, dominant_emotion, latest_frame, is_analysis_running
+    global current_engagement_status, dominant_emotion, is_analysis_running
+    global requested_backend, analysis_fps, frame_age_ms
+
+    last_analyzed_id = 0
 
     while True:
-        # Check if there's a frame to analyze
-        if latest_frame is None:
-            time.sleep(0.1) # Wait for the main loop to provide a frame
-            continue
+        # Backend switch requested from the main thread
+        if requested_backend is not None:
+            backend, requested_backend = requested_backend, None
+            try:
+                engine.set_backend(backend)
+            except Exception as e:
+                print(f"Could not switch to '{backend}': {e}")
+
+        # Sleep until the decode thread delivers a frame we haven't analyzed yet
+        if not ingest.wait_for_frame(last_analyzed_id):
+            break
 
-        # Safely get a copy of the frame to analyze
-        with data_lock:
-            # We must make a copy, otherwise the main thread will
-            # change the image while we're analyzing it!
-            frame_to_analyze = latest_frame.copy()
-        
-        # --- OPTIMIZATION: Resize the frame ---
-        # Analyzing a smaller image is MUCH faster.
-        # We calculate a scaling factor to maintain aspect ratio
-        target_width = 320 # Analyze at 320p width
-        scale = target_width / frame_to_analyze.shape[1]
-        dim = (target_width, int(frame_to_analyze.shape[0] * scale))
-        
+        start = time.time()
         try:
-            # Resize the image for faster analysis
-            resized_frame = cv2.resize(frame_to_analyze, dim, interpolation=cv2.INTER_AREA)
+            # The resize IS our private copy, so the shared buffer is held only briefly
+            with ingest.read() as (frame_id, frame, captured_at):
+                if frame is None or frame_id == last_analyzed_id:
+                    continue
+                # Age when the frame is actually picked up (after the read, never negative)
+                frame_age_ms = max(0.0, (time.time() - captured_at) * 1000)
+                resized_frame = resize_for_analysis(frame)
+                last_analyzed_id = frame_id
 
             # Let the main thread know we are busy
             is_analysis_running = True
             
             # --- Run the AI analysis ---
-            analysis_results = DeepFace.analyze(
-                resized_frame,
-                actions=['emotion'],
-                enforce_detection=True,
-                detector_backend='retinaface' # Use 'retinaface' or 'mediapipe'
-            )
-            
-            # Process results (DeepFace V1)
-            if isinstance(analysis_results, list) and len(analysis_results) > 0:
-                local_emotion = analysis_results[0]['dominant_emotion']
-            # Process results (DeepFace V0)
-            elif isinstance(analysis_results, dict):
-                local_emotion = analysis_results['dominant_emotion']
-            else:
-                local_emotion = "unknown"
-
+            local_emotion = engine.analyze(resized_frame)
             local_status = EMOTIONS_TO_ENGAGEMENT.get(local_emotion, "UNKNOWN")
 
             # --- Safely update the global status ---
@@ -100,38 +252,63 @@ def run_ai_analysis():
                 current_engagement_status = "NO FACE DETECTED"
             # print(f"Analysis error: {e}") # Uncomment for debugging
 
-        # Wait a little before the next analysis to not overload the CPU
-        time.sleep(0.5) # Analyze ~2 times per second
+        elapsed = time.time() - start
+        if elapsed > 0:
+            analysis_fps = 0.9 * analysis_fps + 0.1 * (1.0 / elapsed)
 
 
 # --- Initialization ---
-cap = cv2.VideoCapture(VIDEO_SOURCE)
-if not cap.isOpened():
+parser = argparse.ArgumentParser(description="Student engagement monitor (DeepFace)")
+parser.add_argument("--backend", default=DEFAULT_BACKEND, choices=DETECTOR_BACKENDS,
+                    help="Face detector used by DeepFace")
+parser.add_argument("--benchmark", nargs="?", const=VIDEO_SOURCE, metavar="IMAGE",
+                    help="Print per-backend latency on an image (or one frame of the stream) and exit")
+args = parser.parse_args()
+
+if args.benchmark is not None:
+    sample = cv2.imread(args.benchmark) if args.benchmark != VIDEO_SOURCE else None
+    if sample is None:
+        bench_cap = cv2.VideoCapture(args.benchmark)
+        _, sample = bench_cap.read()
+        bench_cap.release()
+    if sample is None:
+        print(f"Error: Could not read a benchmark frame from '{args.benchmark}'.")
+        exit()
+    benchmark_backends(sample, DETECTOR_BACKENDS)
+    exit()
+
+ingest = FrameIngest(VIDEO_SOURCE)
+if not ingest.running:
     print(f"Error: Could not open video source '{VIDEO_SOURCE}'.")
     exit()
 
-print("Starting video stream. Press 'q' to quit.")
+engine = AnalysisEngine(args.backend)
+
+print("Starting video stream. Press 'q' to quit, 'b' to switch detector.")
 print("Starting background AI analysis thread...")
 
-# --- NEW: Start the worker thread ---
+# --- Start the worker thread ---
 # daemon=True means this thread will automatically shut down
 # when the main program (this script) exits.
-ai_thread = threading.Thread(target=run_ai_analysis, daemon=True)
+ai_thread = threading.Thread(target=run_ai_analysis, args=(engine, ingest), daemon=True)
 ai_thread.start()
 
 
-# --- Main Video Loop (Runs on Main Thread) ---
+# --- Main Video Loop (Runs on Main Thread, display only) ---
+last_displayed_id = 0
 while True:
-    ret, frame = cap.read()
-    if not ret:
+    if not ingest.wait_for_frame(last_displayed_id):
         print("Error: Failed to grab frame. Stream ended?")
         break
 
-    # --- NEW: Update the latest_frame for the AI thread ---
-    with data_lock:
-        latest_frame = frame.copy()
-    
-    display_frame = frame.copy()
+    # The only copy per frame: we draw on it, so it can't be the shared buffer
+    with ingest.read() as (frame_id, frame, captured_at):
+        if frame is None or frame_id == last_displayed_id:
+            continue
+        if frame_id - last_displayed_id > 1 and last_displayed_id > 0:
+            ingest.dropped_by_display += frame_id - last_displayed_id - 1
+        last_displayed_id = frame_id
+        display_frame = frame.copy()
 
     # --- Safely read the status from the worker thread ---
     with data_lock:
@@ -160,14 +337,28 @@ while True:
     cv2.putText(display_frame, f"Emotion: {emotion_to_display}", (10, 70),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
 
+    # Display the detector in use and how fast it is running
+    cv2.putText(display_frame, f"Detector: {engine.detector_backend} ({analysis_fps:.1f} fps)", (10, 140),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1, cv2.LINE_AA)
+
+    # How stale the analyzed frame was when the AI picked it up
+    cv2.putText(display_frame, f"Frame age at analysis: {frame_age_ms:.0f} ms", (10, 160),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1, cv2.LINE_AA)
+
     # --- Show the Window ---
     cv2.imshow("Student Engagement Monitor (Laptop/Server)", display_frame)
 
-    # --- Quit Condition ---
-    if cv2.waitKey(1) & 0xFF == ord('q'):
+    # --- Quit / Switch Detector ---
+    key = cv2.waitKey(1) & 0xFF
+    if key == ord('q'):
         break
+    elif key == ord('b'):
+        next_index = (DETECTOR_BACKENDS.index(engine.detector_backend) + 1) % len(DETECTOR_BACKENDS)
+        requested_backend = DETECTOR_BACKENDS[next_index]
+        print(f"Switching detector to '{requested_backend}'...")
 
 # --- Cleanup ---
 print("Shutting down...")
-cap.release()
+print(f"Frames skipped by display (kept at live edge): {ingest.dropped_by_display}")
+ingest.release()
 cv2.destroyAllWindows()
\ No newline at end of file
@@ -0,0 +1,267 @@
+import argparse
+import json
+import socket
+import struct
+import time
+from fractions import Fraction
+
+import cv2
+import numpy as np
+
+try:
+    import av  # PyAV (bundles FFmpeg/libx264); only needed for the h264 codec
+except ImportError:
+    av = None
+
+# ==========================================
+# TCP VIDEO STREAM (JPEG / H.264)
+# ==========================================
+# Wire format is the one server.py always used: 4-byte little-endian length,
+# then the payload.
+#
+# Legacy senders just send JPEGs. A negotiating sender first sends
+#     HELLO_MAGIC + {"codecs": [...preferred first], "width", "height", "fps"}
+# and the receiver answers (same framing) with {"codec": <chosen>}. After
+# that every payload is an 8-byte capture timestamp (float64 seconds) + data:
+#     jpeg  one JPEG per frame
+#     h264  one H.264 access unit per frame (x264 zerolatency: no B-frames,
+#           no lookahead, so every frame comes out as soon as it goes in)
+#
+# The receiver keeps ONE decoder for the whole connection; inter-frame
+# prediction is what makes a static classroom scene cheap to send.
+#
+#   python video_stream.py --host <laptop ip> --codec h264 --source 0
+#   python video_stream.py --host <laptop ip> --codec jpeg --source video.mp4
+
+FRAME_SIZE_HEADER = 4
+HELLO_MAGIC = b"ISKO"
+TIMESTAMP = struct.Struct("<d")
+
+H264_ENCODERS = ("libx264", "h264_v4l2m2m", "h264")  # First one FFmpeg knows is used
+H264_OPTIONS = {"preset": "ultrafast", "tune": "zerolatency"}
+H264_BITRATE = 1_000_000  # bits/s
+KEYFRAME_SECONDS = 2      # A receiver recovers from a lost/bad frame within this
+JPEG_QUALITY = 80
+
+
+def available_codecs():
+    """Codecs this machine can handle, preferred first."""
+    return ["h264", "jpeg"] if av is not None else ["jpeg"]
+
+
+# --- Socket helpers ---
+def recvall(sock, count):
+    """Receives exactly count bytes, or None if the connection closed."""
+    buf = bytearray(count)
+    view = memoryview(buf)
+    while count:
+        try:
+            received = sock.recv_into(view, count)
+        except OSError:
+            return None
+        if not received:
+            return None
+        view = view[received:]
+        count -= received
+    return bytes(buf)
+
+
+def send_message(sock, *parts):
+    """Length-prefixed message from one or more byte strings (no concatenation copy)."""
+    size = sum(len(part) for part in parts)
+    sock.sendall(size.to_bytes(FRAME_SIZE_HEADER, "little"))
+    for part in parts:
+        sock.sendall(part)
+    return FRAME_SIZE_HEADER + size
+
+
+def recv_message(sock):
+    size_data = recvall(sock, FRAME_SIZE_HEADER)
+    if size_data is None:
+        return None
+    return recvall(sock, int.from_bytes(size_data, "little"))
+
+
+# --- Encoders / decoders (same interface for both codecs) ---
+class JpegEncoder:
+    def __init__(self, width, height, fps, quality=JPEG_QUALITY):
+        self.quality = quality
+
+    def encode(self, frame):
+        ok, encoded = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+        return [encoded.tobytes()] if ok else []
+
+
+class JpegDecoder:
+    def decode(self, data):
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        return [frame] if frame is not None else []
+
+
+class H264Encoder:
+    def __init__(self, width, height, fps, bitrate=H264_BITRATE):
+        for name in H264_ENCODERS:
+            try:
+                self.codec = av.CodecContext.create(name, "w")
+                break
+            except Exception:
+                continue
+        else:
+            raise RuntimeError(f"No H.264 encoder available (tried {', '.join(H264_ENCODERS)})")
+        self.codec.width = width
+        self.codec.height = height
+        self.codec.pix_fmt = "yuv420p"
+        self.codec.time_base = Fraction(1, max(1, int(fps)))
+        self.codec.bit_rate = bitrate
+        self.codec.gop_size = max(1, int(fps * KEYFRAME_SECONDS))
+        self.codec.max_b_frames = 0
+        self.codec.options = dict(H264_OPTIONS)
+        self.pts = 0
+
+    def encode(self, frame):
+        video_frame = av.VideoFrame.from_ndarray(frame, format="bgr24")
+        video_frame.pts = self.pts
+        self.pts += 1
+        return [bytes(packet) for packet in self.codec.encode(video_frame)]
+
+
+class H264Decoder:
+    """One decoder context for the whole stream (it holds the reference frames)."""
+    def __init__(self):
+        self.codec = av.CodecContext.create("h264", "r")
+        self.errors = 0
+
+    def decode(self, data):
+        try:
+            frames = self.codec.decode(av.Packet(data))
+        except av.error.FFmpegError:
+            # Corrupt/missing reference: frames resume at the next keyframe
+            self.errors += 1
+            return []
+        return [frame.to_ndarray(format="bgr24") for frame in frames]
+
+
+ENCODERS = {"jpeg": JpegEncoder, "h264": H264Encoder}
+DECODERS = {"jpeg": JpegDecoder, "h264": H264Decoder}
+
+
+# --- Sender (Pi side) ---
+class FrameSender:
+    """
+    Negotiates a codec with the receiver, then send(frame) encodes and sends.
+    Frames of another size are resized to the negotiated one (the H.264
+    encoder is fixed-size).
+    """
+    def __init__(self, sock, width, height, fps=30, codecs=None, jpeg_quality=JPEG_QUALITY):
+        self.sock = sock
+        self.width, self.height = width, height
+        hello = {"codecs": codecs or available_codecs(), "width": width, "height": height, "fps": fps}
+        send_message(sock, HELLO_MAGIC, json.dumps(hello).encode())
+        reply = recv_message(sock)
+        if reply is None:
+            raise ConnectionError("Receiver closed the connection during codec negotiation")
+        self.codec = json.loads(reply)["codec"]
+        if self.codec == "jpeg":
+            self.encoder = JpegEncoder(width, height, fps, jpeg_quality)
+        else:
+            self.encoder = ENCODERS[self.codec](width, height, fps)
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def send(self, frame, capture_ts=None):
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            frame = cv2.resize(frame, (self.width, self.height))
+        stamp = TIMESTAMP.pack(capture_ts if capture_ts is not None else time.time())
+        for data in self.encoder.encode(frame):
+            self.bytes_sent += send_message(self.sock, stamp, data)
+        self.frames_sent += 1
+
+
+# --- Receiver (laptop side) ---
+class FrameReceiver:
+    """
+    Yields (frame, capture_ts) from a connected socket. Accepts both
+    negotiating senders and legacy JPEG-only ones (capture_ts is then the
+    receive time).
+    """
+    def __init__(self, conn, codecs=None):
+        self.conn = conn
+        self.supported = codecs or available_codecs()
+        self.codec = None
+        self.decoder = None
+        self.sender_info = {}
+        self.legacy = False
+        self.frames_received = 0
+        self.bytes_received = 0
+        self._first = None
+
+        message = recv_message(conn)
+        if message is None:
+            raise ConnectionError("Sender closed the connection before the first frame")
+        if message.startswith(HELLO_MAGIC):
+            self.sender_info = json.loads(message[len(HELLO_MAGIC):])
+            offered = self.sender_info.get("codecs", ["jpeg"])
+            # The sender's preference order, among what we can decode
+            self.codec = next((codec for codec in offered if codec in self.supported), "jpeg")
+            send_message(conn, json.dumps({"codec": self.codec}).encode())
+        else:
+            self.codec = "jpeg"
+            self.legacy = True
+            self._first = message
+        self.bytes_received += FRAME_SIZE_HEADER + len(message)
+        self.decoder = DECODERS[self.codec]()
+
+    def frames(self):
+        if self._first is not None:
+            message, self._first = self._first, None
+            yield from self._decode(message)
+        while True:
+            message = recv_message(self.conn)
+            if message is None:
+                return
+            self.bytes_received += FRAME_SIZE_HEADER + len(message)
+            yield from self._decode(message)
+
+    def _decode(self, message):
+        if self.legacy:
+            capture_ts, data = time.time(), message
+        else:
+            capture_ts, data = TIMESTAMP.unpack_from(message)[0], memoryview(message)[TIMESTAMP.size:]
+        for frame in self.decoder.decode(data):
+            self.frames_received += 1
+            yield frame, capture_ts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a camera or video file to server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--codec", choices=["h264", "jpeg"], default=None,
+                        help="Codec to offer (default: best available, falls back to jpeg)")
+    parser.add_argument("--source", default="0", help="Camera index or video file")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=int, default=30)
+    args = parser.parse_args()
+
+    cap = cv2.VideoCapture(int(args.source) if args.source.isdigit() else args.source)
+    codecs = [args.codec, "jpeg"] if args.codec else None
+    with socket.create_connection((args.host, args.port)) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sender = FrameSender(sock, args.width, args.height, args.fps, codecs)
+        print(f"Streaming with codec: {sender.codec}")
+        interval = 1.0 / args.fps
+        started = time.time()
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                sender.send(frame, time.time())
+                time.sleep(max(0, started + sender.frames_sent * interval - time.time()))
+        except (KeyboardInterrupt, BrokenPipeError, ConnectionResetError):
+            pass
+        elapsed = time.time() - started
+        print(f"Sent {sender.frames_sent} frames, {sender.bytes_sent / 1024:.0f} KiB "
+              f"({sender.bytes_sent * 8 / 1000 / max(elapsed, 1e-6):.0f} kbit/s)")
+    cap.release()